@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+"""
+Microbenchmarks of the robot code's hot paths, run headless against the HAL sim.
+
+Each benchmark is a function that's called over and over, with an optional untimed
+setup before each call. Latency is measured for every call, without tracemalloc
+running, and then a second, shorter run measures how much memory each call
+allocates (the peak, traced by tracemalloc) and how much of it sticks around.
+
+Every run is appended to a history file, and compared against a baseline if there
+is one. Any benchmark whose median or 99th percentile got more than `--threshold`
+slower is flagged as a regression, and the script exits with an error. The sum of
+the per-loop benchmarks is also checked against the loop period, since that's the
+budget all of them have to fit in together.
+"""
+
+OUT_DIR = "benchmarks"
+HISTORY_FILE = os.path.join(OUT_DIR, "history.jsonl")
+BASELINE_FILE = os.path.join(OUT_DIR, "baseline.json")
+
+# Benchmarks that run every loop while driving an auto route
+LOOP_BENCHMARKS = (
+    "DriveTrajectory.execute",
+    "Drivetrain.periodic (limelight frame)",
+    "Arm.periodic",
+)
+
+Benchmark = Tuple[Callable[[], object], Callable[[], object]]
+
+
+def _make_benchmarks(robot) -> Dict[str, Benchmark]:
+    """
+    Build every benchmark as (setup, call), against a robot instance.
+    """
+    from wpilib.simulation import stepTiming
+
+    from robot.auto.paths import SUB_TO_CUBE
+    from robot.auto.trajectory import DriveTrajectory, mirror_trajectory
+    from robot.constants import FIELD_LENGTH, FIELD_WIDTH, LOOP_PERIOD
+    from robot.subsystems.arm import ArmPosition
+    from robot.util.localization import VisionFrame
+
+    nothing = lambda: None
+
+    drive = DriveTrajectory(robot, SUB_TO_CUBE)
+    drive.initialize()
+    drive.execute()
+
+    def drive_setup():
+        # Move through the trajectory, and start it over once it's done
+        stepTiming(LOOP_PERIOD)
+        if drive.isFinished():
+            drive.initialize()
+            drive.execute()
+
+    def frame_setup():
+        # A frame right where the estimate is, so it's not thrown out
+        pose = robot.drivetrain.get_pose()
+        robot.drivetrain._vision._frames.append(
+            VisionFrame(
+                robot.drivetrain._inputs.time,
+                pose.X() - FIELD_LENGTH / 2,
+                pose.Y() - FIELD_WIDTH / 2,
+                pose.rotation().degrees(),
+                2,
+                3,
+            )
+        )
+
+    positions = [ArmPosition.HOME, ArmPosition.HIGH]
+
+    def arm_setup():
+        # Keep the arm moving between presets
+        stepTiming(LOOP_PERIOD)
+        if robot.arm.get_arrival_time() == 0:
+            positions.reverse()
+            robot.arm.set_position(positions[0]).initialize()
+
+    run_cmd = robot.arm.bump_lower_position(0)
+    run_once_cmd = robot.arm.set_position(ArmPosition.HOME)
+
+    return {
+        "mirror_trajectory": (nothing, lambda: mirror_trajectory(SUB_TO_CUBE._blue)),
+        "Trajectories.trajectory": (nothing, lambda: SUB_TO_CUBE.trajectory),
+        "DriveTrajectory.execute": (drive_setup, drive.execute),
+        "Drivetrain.set_wheel_speeds": (
+            nothing,
+            lambda: robot.drivetrain.set_wheel_speeds(1, 1),
+        ),
+        "Drivetrain.periodic": (nothing, robot.drivetrain.periodic),
+        "Drivetrain.periodic (limelight frame)": (
+            frame_setup,
+            robot.drivetrain.periodic,
+        ),
+        "Arm.periodic": (arm_setup, robot.arm.periodic),
+        "cmd.run (build)": (nothing, lambda: robot.arm.bump_lower_position(0)),
+        "cmd.run (execute)": (nothing, run_cmd.execute),
+        "cmd.run_once (build)": (
+            nothing,
+            lambda: robot.arm.set_position(ArmPosition.HOME),
+        ),
+        "cmd.run_once (execute)": (nothing, run_once_cmd.initialize),
+    }
+
+
+def measure(setup, call, iterations: int, alloc_iterations: int) -> Dict[str, float]:
+    """
+    Time `iterations` calls, then trace the memory of `alloc_iterations` more.
+    Latencies are in microseconds and memory is in bytes.
+    """
+    perf_counter_ns = time.perf_counter_ns
+
+    # Warm up caches, lazy loads and the like
+    for _ in range(min(iterations, 50)):
+        setup()
+        call()
+
+    latencies: List[float] = []
+
+    for _ in range(iterations):
+        setup()
+        start = perf_counter_ns()
+        call()
+        latencies.append((perf_counter_ns() - start) / 1000)
+
+    latencies.sort()
+
+    peaks = []
+    retained = 0
+    tracemalloc.start()
+
+    for _ in range(alloc_iterations):
+        setup()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        retained += current - before
+
+    tracemalloc.stop()
+
+    def percentile(p: float) -> float:
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)]
+
+    return {
+        "mean": statistics.fmean(latencies),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": latencies[-1],
+        "alloc_peak": statistics.fmean(peaks),
+        "alloc_retained": retained / alloc_iterations,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "--short", "HEAD"),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    flagged = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        for stat in ("p50", "p99"):
+            old = baseline[name][stat]
+            new = result[stat]
+
+            # Ignore sub-microsecond noise on really fast calls
+            if new > old * (1 + threshold) and new - old > 1:
+                flagged.append(f"{name} {stat}: {old:.1f}us -> {new:.1f}us")
+
+    return flagged
+
+
+def main():
+    """
+    Benchmark the robot code's hot paths against the HAL sim, record the results,
+    and flag regressions against the baseline.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "benchmarks", nargs="*", help="benchmarks to run (default: all)"
+    )
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--alloc-iterations", type=int, default=200)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fraction slower than the baseline that counts as a regression",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="make this run the new baseline"
+    )
+    args = parser.parse_args()
+
+    from wpilib.simulation import pauseTiming
+
+    from robot import Robot
+    from robot.constants import LOOP_PERIOD
+
+    # Time only moves when a benchmark steps it
+    pauseTiming()
+    robot = Robot()
+    robot.robotInit()
+
+    benchmarks = _make_benchmarks(robot)
+    names = args.benchmarks or list(benchmarks)
+
+    results = {}
+    print(
+        f"{'benchmark':40} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"
+        f" {'alloc':>9} {'kept':>7}"
+    )
+
+    for name in names:
+        setup, call = benchmarks[name]
+        result = measure(setup, call, args.iterations, args.alloc_iterations)
+        results[name] = result
+
+        print(
+            f"{name:40} {result['p50']:8.1f}u {result['p90']:8.1f}u"
+            f" {result['p99']:8.1f}u {result['max']:8.1f}u"
+            f" {result['alloc_peak']:8.0f}B {result['alloc_retained']:6.0f}B"
+        )
+
+    failed = False
+
+    if all(name in results for name in LOOP_BENCHMARKS):
+        loop = sum(results[name]["p99"] for name in LOOP_BENCHMARKS) / 1000
+        budget = LOOP_PERIOD * 1000
+        print(f"\nper-loop p99 total: {loop:.2f}ms of a {budget:.0f}ms budget")
+
+        if loop > budget:
+            print("OVER BUDGET")
+            failed = True
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+
+    with open(HISTORY_FILE, "a") as f:
+        entry = {"time": time.time(), "commit": _git_commit(), "results": results}
+        f.write(json.dumps(entry) + "\n")
+
+    if os.path.exists(BASELINE_FILE) and not args.save_baseline:
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+        flagged = _regressions(results, baseline["results"], args.threshold)
+
+        if flagged:
+            print(f"\nREGRESSIONS against baseline {baseline['commit']}:")
+            for line in flagged:
+                print(f"  {line}")
+            failed = True
+        else:
+            print(f"\nno regressions against baseline {baseline['commit']}")
+    elif not args.save_baseline:
+        print(
+            f"\nNO REGRESSION CHECK: there's no baseline at {BASELINE_FILE}, make one"
+            " from a known good commit with --save-baseline"
+        )
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({"commit": _git_commit(), "results": results}, f, indent=2)
+
+        print("\nsaved as the baseline")
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import robot.util.arm_kinematics as arm_kinematics
+import robot.util.arm_planner as arm_planner
+
+
+def main():
+    """
+    Build-time arm compiler. Builds the arm's inverse kinematics grid and collision
+    map and writes them to the deploy directory, so the robot only has to memory map
+    them when it boots.
+    """
+    grid = arm_kinematics.IKGrid.build()
+    grid.write()
+
+    print(f"{arm_kinematics.GRID_FILE}: compiled")
+
+    cspace = arm_planner.ConfigSpace.build()
+    cspace.write()
+
+    print(f"{arm_planner.CSPACE_FILE}: compiled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import os
+import shutil
+
+import robot.auto.cache as cache
+
+
+def main():
+    """
+    Build-time trajectory compiler. Loads every trajectory in `robot/auto/paths.py`,
+    (re)generating any that are missing or stale in the trajectory cache, and removes
+    cache files that are no longer used. Run this before deploying so the robot never
+    has to generate a path while booting.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="regenerate every trajectory"
+    )
+    args = parser.parse_args()
+
+    if args.force:
+        shutil.rmtree(cache.CACHE_DIR, ignore_errors=True)
+
+    import robot.auto.paths
+
+    for filename, compiled in sorted(cache.used.items()):
+        status = "compiled" if compiled else "up to date"
+        print(f"{os.path.basename(filename)}: {status}")
+
+    if os.path.isdir(cache.CACHE_DIR):
+        for filename in os.listdir(cache.CACHE_DIR):
+            filename = os.path.join(cache.CACHE_DIR, filename)
+
+            if filename not in cache.used:
+                print(f"{os.path.basename(filename)}: removed")
+                os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
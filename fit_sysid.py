@@ -0,0 +1,260 @@
+import argparse
+import math
+import os
+import re
+from typing import Dict, List, Sequence, Tuple
+
+from robot.util.datalog import read_log
+
+"""
+Offline fitter for the characterization logs recorded by `robot/auto/sysid.py`.
+
+Every sample from every log of a mechanism becomes one row of a single least squares
+problem, so all of its runs (quasistatic and dynamic, both directions) are solved
+at once. The rows are folded into the normal equations as they're read, which keeps
+memory constant no matter how many logs there are, and the small system left over
+is solved directly.
+
+The drivetrain is fit to V = kS * sign(v) + kV * v + kA * a, with both sides as
+samples. The arm's joints add kG * cos(angle), in the same encoder angles and
+direction the Arm's feedforward uses.
+"""
+
+CONSTANTS_FILE = os.path.join("robot", "constants.py")
+
+# The gains each mechanism's fit solves for, in the same order as its rows
+GAINS = {
+    "drive": ("kS", "kV", "kA"),
+    "lower_arm": ("kS", "kG", "kV", "kA"),
+    "upper_arm": ("kS", "kG", "kV", "kA"),
+}
+CONSTANT_NAMES = {
+    "drive": "DRIVE_FF",
+    "lower_arm": "LOWER_ARM_FF",
+    "upper_arm": "UPPER_ARM_FF",
+}
+
+# Samples slower than this are ignored, since friction is unpredictable near 0
+MIN_VELOCITY = 0.01
+
+
+class NormalEquations:
+    """
+    Accumulates the normal equations (X^T X, X^T y) of a least squares problem one
+    row at a time.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.xtx = [[0.0] * size for _ in range(size)]
+        self.xty = [0.0] * size
+        self.yty = 0.0
+        self.count = 0
+
+    def add(self, x: Sequence[float], y: float):
+        xtx = self.xtx
+
+        for i in range(self.size):
+            xi = x[i]
+            row = xtx[i]
+
+            for j in range(self.size):
+                row[j] += xi * x[j]
+
+            self.xty[i] += xi * y
+
+        self.yty += y * y
+        self.count += 1
+
+    def solve(self) -> Tuple[List[float], float]:
+        """
+        Solve for the gains, by Gaussian elimination with partial pivoting. Returns
+        the gains and the RMS error of the fit.
+        """
+        n = self.size
+        a = [self.xtx[i][:] + [self.xty[i]] for i in range(n)]
+
+        for col in range(n):
+            pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+            if abs(a[pivot][col]) < 1e-12:
+                raise ValueError("not enough data to fit every gain")
+
+            a[col], a[pivot] = a[pivot], a[col]
+
+            for r in range(col + 1, n):
+                factor = a[r][col] / a[col][col]
+                for c in range(col, n + 1):
+                    a[r][c] -= factor * a[col][c]
+
+        gains = [0.0] * n
+        for r in reversed(range(n)):
+            known = sum(a[r][c] * gains[c] for c in range(r + 1, n))
+            gains[r] = (a[r][n] - known) / a[r][r]
+
+        # ||y - Xb||^2 = y^T y - 2 b^T X^T y + b^T X^T X b
+        sse = self.yty - 2 * sum(b * xy for b, xy in zip(gains, self.xty))
+        sse += sum(
+            gains[i] * self.xtx[i][j] * gains[j] for i in range(n) for j in range(n)
+        )
+
+        return gains, math.sqrt(max(sse, 0.0) / max(self.count, 1))
+
+
+def _derivative(times: Sequence[float], values: Sequence[float], i: int) -> float:
+    return (values[i + 1] - values[i - 1]) / (times[i + 1] - times[i - 1])
+
+
+def _add_drive_log(equations: NormalEquations, fields, records):
+    columns = list(zip(*records))
+    field = {name: i for i, name in enumerate(fields)}
+    times = columns[field["time"]]
+
+    for side in ("left", "right"):
+        volts = columns[field[f"{side}_volts"]]
+        vels = columns[field[f"{side}_vel"]]
+
+        for i in range(1, len(times) - 1):
+            vel = vels[i]
+
+            if abs(vel) < MIN_VELOCITY:
+                continue
+
+            accel = _derivative(times, vels, i)
+            equations.add((math.copysign(1, vel), vel, accel), volts[i])
+
+
+def _add_arm_log(equations: NormalEquations, fields, records):
+    columns = list(zip(*records))
+    field = {name: i for i, name in enumerate(fields)}
+    times = columns[field["time"]]
+    volts = columns[field["volts"]]
+
+    # Unwrap the absolute encoder angles so differences across 0 aren't a full turn
+    raw = columns[field["pos"]]
+    angles = [raw[0]]
+    for angle in raw[1:]:
+        angles.append(angles[-1] + math.remainder(angle - angles[-1], math.tau))
+
+    vels = [0.0] + [_derivative(times, angles, i) for i in range(1, len(times) - 1)]
+
+    for i in range(2, len(times) - 2):
+        # The motors move opposite to the encoders, like in Arm.periodic
+        vel = -vels[i]
+        accel = -_derivative(times, vels, i)
+
+        if abs(vel) < MIN_VELOCITY:
+            continue
+
+        row = (math.copysign(1, vel), math.cos(raw[i]), vel, accel)
+        equations.add(row, volts[i])
+
+
+def _mechanism(filename: str) -> str:
+    name = os.path.basename(filename)
+
+    for mechanism in GAINS:
+        if name.startswith(f"sysid_{mechanism}_"):
+            return mechanism
+
+    raise ValueError(f"'{filename}' isn't a characterization log")
+
+
+def _split_runs(fields, records) -> List[List[Tuple[float, ...]]]:
+    """
+    Split a log's records into each run of its test, since they're only continuous
+    within a run. Logs without a run field are one run.
+    """
+    if "run" not in fields:
+        return [list(records)]
+
+    index = fields.index("run")
+    runs: Dict[float, List[Tuple[float, ...]]] = {}
+
+    for record in records:
+        runs.setdefault(record[index], []).append(record)
+
+    return list(runs.values())
+
+
+def fit(logs: Sequence[str]) -> Dict[str, Tuple[Dict[str, float], float, int]]:
+    """
+    Fit every mechanism that has logs. Returns each one's gains, RMS error and
+    sample count.
+    """
+    equations: Dict[str, NormalEquations] = {}
+
+    for filename in logs:
+        mechanism = _mechanism(filename)
+        fields, records = read_log(filename)
+
+        for run in _split_runs(fields, records):
+            if len(run) < 5:
+                continue
+
+            if mechanism not in equations:
+                equations[mechanism] = NormalEquations(len(GAINS[mechanism]))
+
+            if mechanism == "drive":
+                _add_drive_log(equations[mechanism], fields, run)
+            else:
+                _add_arm_log(equations[mechanism], fields, run)
+
+    results = {}
+
+    for mechanism, eq in equations.items():
+        gains, rms = eq.solve()
+        results[mechanism] = (dict(zip(GAINS[mechanism], gains)), rms, eq.count)
+
+    return results
+
+
+def write_constants(results, filename: str = CONSTANTS_FILE) -> None:
+    """
+    Rewrite the feedforward constants in constants.py with the fitted gains.
+    """
+    with open(filename) as f:
+        source = f.read()
+
+    for mechanism, (gains, _, _) in results.items():
+        name = CONSTANT_NAMES[mechanism]
+        value = ", ".join(f'"{gain}": {value:.5g}' for gain, value in gains.items())
+
+        source, count = re.subn(
+            rf"^{name} = \{{.*\}}$", f"{name} = {{{value}}}", source, flags=re.M
+        )
+        if count != 1:
+            raise ValueError(f"couldn't find {name} in {filename}")
+
+    with open(filename + ".tmp", "w") as f:
+        f.write(source)
+
+    os.replace(filename + ".tmp", filename)
+
+
+def main():
+    """
+    Fit feedforward gains to characterization logs, and optionally write them into
+    constants.py.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("logs", nargs="+", help="characterization logs (sysid_*.rlog)")
+    parser.add_argument(
+        "--write", action="store_true", help=f"update the gains in {CONSTANTS_FILE}"
+    )
+    args = parser.parse_args()
+
+    results = fit(args.logs)
+
+    for mechanism, (gains, rms, count) in results.items():
+        values = ", ".join(f"{gain} {value:.5g}" for gain, value in gains.items())
+        print(
+            f"{CONSTANT_NAMES[mechanism]}: {values} ({count} samples, {rms:.3f}V rms)"
+        )
+
+    if args.write:
+        write_constants(results)
+        print(f"{CONSTANTS_FILE}: updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,135 @@
 import math
 
+from wpimath.geometry import Pose2d, Rotation2d
 from wpimath.system.plant import DCMotor
 from pyfrc.physics.core import PhysicsInterface
-from wpilib.simulation import SingleJointedArmSim, DIOSim, SimDeviceSim
+from wpilib.simulation import (
+    ADXRS450_GyroSim,
+    AnalogGyroSim,
+    SingleJointedArmSim,
+    DIOSim,
+    SimDeviceSim,
+)
 
 from robot.subsystems.arm import ArmPosition
 from robot.constants import *
 
+CHARGE_STATION_MAX_TILT = 15  # degrees
+CHARGE_STATION_LEVEL_ZONE = 0.15  # meters either side of the pivot that's level-ish
+CHARGE_STATION_TIME_CONSTANT = 0.3  # seconds
+
+
+class DrivetrainModel:
+    """
+    Differential drive plant model, built from the DRIVE_FF characterization. Each
+    side follows V = kS * sign(v) + kV * v + kA * a, and the sides are combined into
+    the robot's pose using the track width. It's plain Python math on floats, so it's
+    cheap to step at 1 kHz.
+
+    Also models the charge station, which tilts towards whichever side of its pivot
+    the robot is on, and the pitch of the robot as it drives over it.
+    """
+
+    STEP = 0.001
+
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+
+        # How far the field heading is from the gyro's, since the robot was placed
+        # somewhere new. The gyro didn't move, so it keeps reading continuously
+        self.gyro_offset = 0.0
+
+        self.left_pos = 0.0
+        self.right_pos = 0.0
+        self.left_vel = 0.0
+        self.right_vel = 0.0
+
+        # Positive when the +x side of the charge station is up
+        self.station_tilt = 0.0
+
+    def reset_pose(self, x: float, y: float, heading: float):
+        """
+        Place the robot somewhere on the field, without changing what the gyro reads.
+        """
+        self.x = x
+        self.y = y
+        self.gyro_offset += heading - self.heading
+        self.heading = heading
+
+    def get_gyro_heading(self) -> float:
+        """
+        Heading the gyro would measure, in radians counterclockwise.
+        """
+        return self.heading - self.gyro_offset
+
+    def _side(self, vel: float, volts: float, dt: float) -> float:
+        # Static friction holds the side still until it's overcome
+        if vel == 0 and abs(volts) <= DRIVE_FF["kS"]:
+            return 0.0
+
+        friction = math.copysign(DRIVE_FF["kS"], vel if vel != 0 else volts)
+        accel = (volts - friction - DRIVE_FF["kV"] * vel) / DRIVE_FF["kA"]
+        new_vel = vel + accel * dt
+
+        # Friction can stop a side, but not reverse it
+        if vel != 0 and (new_vel > 0) != (vel > 0) and abs(volts) <= DRIVE_FF["kS"]:
+            return 0.0
+
+        return new_vel
+
+    def _station_target(self) -> float:
+        min_x, max_x, min_y, max_y = CHARGE_STATION
+        if self.x > FIELD_LENGTH / 2:
+            min_x, max_x = FIELD_LENGTH - max_x, FIELD_LENGTH - min_x
+
+        if not (min_x <= self.x <= max_x and min_y <= self.y <= max_y):
+            return 0.0
+
+        # The side the robot is on goes down, so the other side goes up
+        offset = (min_x + max_x) / 2 - self.x
+        frac = max(-1.0, min(offset / CHARGE_STATION_LEVEL_ZONE, 1.0))
+
+        return frac * CHARGE_STATION_MAX_TILT
+
+    def update(self, left_volts: float, right_volts: float, dt: float):
+        """
+        Step the model by `dt` seconds, in STEP sized steps.
+        """
+        while dt > 1e-9:
+            step = min(self.STEP, dt)
+            dt -= step
+
+            self.left_vel = self._side(self.left_vel, left_volts, step)
+            self.right_vel = self._side(self.right_vel, right_volts, step)
+
+            self.left_pos += self.left_vel * step
+            self.right_pos += self.right_vel * step
+
+            vel = (self.left_vel + self.right_vel) / 2
+            self.heading += (self.right_vel - self.left_vel) / DRIVE_TRACK_WIDTH * step
+            self.x += vel * math.cos(self.heading) * step
+            self.y += vel * math.sin(self.heading) * step
+
+            target = self._station_target()
+            self.station_tilt += (
+                (target - self.station_tilt) * step / CHARGE_STATION_TIME_CONSTANT
+            )
+
+    def get_pitch(self) -> float:
+        """
+        Pitch of the robot in degrees, positive when the front is up.
+        """
+        return self.station_tilt * math.cos(self.heading)
+
+
+def meters_to_talon(meters: float) -> float:
+    """
+    Convert meters at the wheel to Talon FX integrated sensor units.
+    """
+    return meters / DRIVE_ENC_DPR / DRIVE_GEARBOX * DRIVE_ENC_CPR
+
 
 class PhysicsEngine:
     """
@@ -21,8 +144,8 @@ class PhysicsEngine:
         self.lower_arm_sim = SingleJointedArmSim(
             gearbox=self.arm_gearbox,
             gearing=100,
-            moi=SingleJointedArmSim.estimateMOI(0.762, 4),
-            armLength=0.762,
+            moi=SingleJointedArmSim.estimateMOI(LOWER_ARM_LENGTH, 4),
+            armLength=LOWER_ARM_LENGTH,
             minAngle=0,
             maxAngle=math.radians(360),
             simulateGravity=True,
@@ -31,8 +154,8 @@ class PhysicsEngine:
         self.upper_arm_sim = SingleJointedArmSim(
             gearbox=self.arm_gearbox,
             gearing=100,
-            moi=SingleJointedArmSim.estimateMOI(0.659, 3),
-            armLength=0.659,
+            moi=SingleJointedArmSim.estimateMOI(UPPER_ARM_LENGTH, 3),
+            armLength=UPPER_ARM_LENGTH,
             minAngle=0,
             maxAngle=math.radians(180),
             simulateGravity=True,
@@ -54,6 +177,18 @@ class PhysicsEngine:
         self.l_limit = DIOSim(LOWER_ARM_HOME)
         self.u_limit = DIOSim(UPPER_ARM_HOME)
 
+        self.drivetrain = robot.drivetrain
+        self.drive_model = DrivetrainModel()
+        self.drive_gearbox = DCMotor.falcon500(2)
+        self.drive_volts = (0.0, 0.0)
+        self.pose_resets = self.drivetrain.get_pose_resets()
+
+        self.l_talon = self.drivetrain._left_motor.getSimCollection()
+        self.r_talon = self.drivetrain._right_motor.getSimCollection()
+
+        self.gyro = ADXRS450_GyroSim(self.drivetrain._gyro)
+        self.level = AnalogGyroSim(self.drivetrain._level)
+
     def update_sim(self, now: float, tm_diff: float) -> None:
         self.lower_arm_sim.setInputVoltage(self.l_spark_output.get())
         self.upper_arm_sim.setInputVoltage(self.u_spark_output.get())
@@ -74,3 +209,62 @@ class PhysicsEngine:
         self.u_limit.setValue(
             self.upper_arm_sim.wouldHitLowerLimit(self.lower_arm_sim.getAngle())
         )
+
+        self.update_drivetrain(tm_diff)
+
+    def update_drivetrain(self, tm_diff: float) -> None:
+        model = self.drive_model
+
+        # When the robot code resets its pose, it's because the robot was placed
+        # there, so move the simulated robot there too
+        if self.drivetrain.get_pose_resets() != self.pose_resets:
+            self.pose_resets = self.drivetrain.get_pose_resets()
+            pose = self.drivetrain.get_pose()
+            model.reset_pose(pose.X(), pose.Y(), pose.rotation().radians())
+
+        self.l_talon.setBusVoltage(12)
+        self.r_talon.setBusVoltage(12)
+
+        # The right side is inverted, and sim values are from the motor's perspective
+        self.drive_volts = (
+            self.l_talon.getMotorOutputLeadVoltage(),
+            -self.r_talon.getMotorOutputLeadVoltage(),
+        )
+        model.update(*self.drive_volts, tm_diff)
+
+        self.l_talon.setIntegratedSensorRawPosition(
+            int(meters_to_talon(model.left_pos))
+        )
+        self.l_talon.setIntegratedSensorVelocity(
+            int(meters_to_talon(model.left_vel) / 10)
+        )
+        self.r_talon.setIntegratedSensorRawPosition(
+            int(-meters_to_talon(model.right_pos))
+        )
+        self.r_talon.setIntegratedSensorVelocity(
+            int(-meters_to_talon(model.right_vel) / 10)
+        )
+
+        # The ADXRS450 is clockwise positive
+        self.gyro.setAngle(-math.degrees(model.get_gyro_heading()))
+        self.level.setAngle(model.get_pitch())
+
+        if self.physics_controller is not None:
+            self.physics_controller.field.setRobotPose(
+                Pose2d(model.x, model.y, Rotation2d(model.heading))
+            )
+
+    def get_current_draw(self) -> float:
+        """
+        Get the total current drawn by every simulated motor, in amps.
+        """
+        model = self.drive_model
+        current = (
+            self.lower_arm_sim.getCurrentDraw() + self.upper_arm_sim.getCurrentDraw()
+        )
+
+        for vel, volts in zip((model.left_vel, model.right_vel), self.drive_volts):
+            motor_speed = vel / (DRIVE_WHEEL_DIAMETER / 2) / DRIVE_GEARBOX
+            current += abs(self.drive_gearbox.current(motor_speed, volts))
+
+        return current
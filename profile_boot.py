@@ -0,0 +1,159 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+"""
+Cold start profiler for the robot code, run headless against the HAL sim.
+
+Every run boots the robot in a fresh Python process, the same way `entry.py` does,
+and times each phase of it: importing `robot.robot`, constructing the Robot, and
+robotInit, where the subsystems, hardware and auto routes are actually created.
+Python's own startup is whatever's left of the process's wall time.
+
+One more run is made with `-X importtime`, and the import time is added up by top
+level package, so it's easy to see what a boot is spending its time importing.
+
+The boot fails the check if its median total is over `--budget`, or if importing
+and constructing the Robot pulled in anything that's supposed to wait for robotInit.
+"""
+
+# Median seconds a full boot can take in the desktop sim
+BOOT_BUDGET = 3.0
+
+# Modules that importing and constructing the Robot must not import
+DEFERRED_MODULES = (
+    "ctre",
+    "rev",
+    "pathplannerlib",
+    "robot.subsystems.arm",
+    "robot.subsystems.claw",
+    "robot.subsystems.drivetrain",
+    "robot.auto.routes",
+)
+
+PHASES = ("python", "import", "construct", "robotInit")
+
+
+def _boot():
+    """
+    Boot the robot in this process, and print how long each phase took as JSON.
+    """
+    start = time.perf_counter()
+
+    from robot.robot import Robot
+
+    imported = time.perf_counter()
+    robot = Robot()
+    constructed = time.perf_counter()
+
+    early = [name for name in DEFERRED_MODULES if name in sys.modules]
+
+    robot.robotInit()
+    initialized = time.perf_counter()
+
+    result = {
+        "import": imported - start,
+        "construct": constructed - imported,
+        "robotInit": initialized - constructed,
+        "early": early,
+    }
+    print(json.dumps(result), flush=True)
+
+
+def _run(importtime: bool = False) -> Tuple[Dict[str, float], str]:
+    args = [sys.executable]
+    if importtime:
+        args += ["-X", "importtime"]
+    args += [__file__, "--child"]
+
+    start = time.perf_counter()
+    proc = subprocess.run(args, capture_output=True, text=True)
+    total = time.perf_counter() - start
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"robot failed to boot:\n{proc.stderr}")
+
+    # The robot code can print too, so the result is the last line
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["python"] = total - sum(result[phase] for phase in PHASES[1:])
+    result["total"] = total
+
+    return result, proc.stderr
+
+
+def import_report(stderr: str, top: int) -> List[Tuple[str, float]]:
+    """
+    Add up the self time of every import in `-X importtime` output by top level
+    package, in seconds. Returns the `top` slowest packages.
+    """
+    packages: Dict[str, float] = {}
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_us, _, name = line[len("import time:") :].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1e6
+
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    """
+    Time a cold start of the robot code against the HAL sim, report what it spends
+    its time importing, and check it against the boot budget.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="packages to report")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=BOOT_BUDGET,
+        help="median seconds a full boot can take",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _boot()
+        return
+
+    runs = [_run()[0] for _ in range(args.runs)]
+    _, stderr = _run(importtime=True)
+
+    print(f"{'phase':12} {'median':>9} {'max':>9}")
+    for phase in PHASES + ("total",):
+        times = [run[phase] for run in runs]
+        print(
+            f"{phase:12} {statistics.median(times) * 1000:7.0f}ms"
+            f" {max(times) * 1000:7.0f}ms"
+        )
+
+    print(f"\n{'package':24} {'import':>9}")
+    for package, seconds in import_report(stderr, args.top):
+        print(f"{package:24} {seconds * 1000:7.0f}ms")
+
+    failed = False
+    total = statistics.median(run["total"] for run in runs)
+
+    print(f"\nboot: {total:.2f}s of a {args.budget:.2f}s budget")
+    if total > args.budget:
+        print("OVER BUDGET")
+        failed = True
+
+    early = sorted({name for run in runs for name in run["early"]})
+    if early:
+        print(f"imported before robotInit: {', '.join(early)}")
+        failed = True
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from wpimath.geometry import Pose2d, Rotation2d
+
+from robot.constants import VISION_STD_DEVS
+from robot.util.datalog import read_log
+from robot.util.localization import (
+    VisionFilter,
+    VisionFrame,
+    botpose_to_pose,
+    make_pose_estimator,
+    update_pose_estimator,
+)
+
+
+def replay(filename: str, std_devs: Tuple[float, float, float]):
+    """
+    Replay a data log through the pose estimator, with the given vision std devs.
+    Returns the estimated pose track as (time, x, y, heading), the distance
+    between the estimate and every vision measurement, and how many were rejected.
+    """
+    fields, records = read_log(filename)
+    field = {name: i for i, name in enumerate(fields)}
+
+    # The indices of each slot's fields, for every vision frame slot in the log
+    slots = []
+    while f"vision{len(slots)}_time" in field:
+        i = len(slots)
+        slots.append([field[f"vision{i}_{name}"] for name in VisionFrame._fields])
+
+    estimator = None
+    vision_filter = VisionFilter(std_devs)
+    resets = 0
+    track: List[Tuple[float, float, float, float]] = []
+    residuals: List[float] = []
+
+    for record in records:
+        time = record[field["time"]]
+        # The ADXRS450 is clockwise positive, getRotation2d negates it
+        gyro = Rotation2d.fromDegrees(-record[field["gyro"]])
+        left = record[field["left_pos"]]
+        right = record[field["right_pos"]]
+        count = int(record[field["vision_frames"]])
+        frames = [VisionFrame(*(record[i] for i in slot)) for slot in slots[:count]]
+
+        logged_pose = Pose2d(
+            record[field["est_x"]],
+            record[field["est_y"]],
+            Rotation2d(record[field["est_heading"]]),
+        )
+
+        if estimator is None:
+            estimator = make_pose_estimator(gyro, left, right)
+            estimator.resetPosition(gyro, left, right, logged_pose)
+            resets = record[field["pose_resets"]]
+
+        update_pose_estimator(estimator, vision_filter, time, gyro, left, right, frames)
+
+        # Pose resets happen after the estimator is updated, so the logged pose
+        # for that loop is the pose it was reset to
+        if record[field["pose_resets"]] != resets:
+            estimator.resetPosition(gyro, left, right, logged_pose)
+            resets = record[field["pose_resets"]]
+
+        pose = estimator.getEstimatedPosition()
+        track.append((time, pose.X(), pose.Y(), pose.rotation().radians()))
+
+        for frame in frames:
+            vision = botpose_to_pose(frame.x, frame.y, frame.yaw)
+            residuals.append(pose.translation().distance(vision.translation()))
+
+    return track, residuals, vision_filter.rejected
+
+
+def _run(job: Tuple[str, Tuple[float, float, float], str]) -> str:
+    filename, std_devs, out_dir = job
+    track, residuals, rejected = replay(filename, std_devs)
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    std_name = "_".join(f"{std:g}" for std in std_devs)
+    out_file = os.path.join(out_dir, f"{name}_{std_name}.csv")
+
+    with open(out_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("time", "x", "y", "heading"))
+        writer.writerows(track)
+
+    mean = sum(residuals) / len(residuals) if residuals else 0
+    worst = max(residuals, default=0)
+
+    return (
+        f"{name} std devs {std_devs}: {len(track)} loops, {len(residuals)} frames "
+        f"({rejected} rejected), "
+        f"vision residual mean {mean:.3f}m max {worst:.3f}m"
+    )
+
+
+def main():
+    """
+    Replay recorded data logs through the pose estimator, as fast as possible, for
+    one or more sets of vision std devs. Writes each estimated pose track to a CSV
+    and prints how far the estimate was from the vision measurements.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("logs", nargs="+", help="data logs (.rlog) to replay")
+    parser.add_argument(
+        "--std-devs",
+        nargs=3,
+        type=float,
+        action="append",
+        metavar=("X", "Y", "HEADING"),
+        help="vision std devs to replay with, can be given more than once",
+    )
+    parser.add_argument("--out", default="replay", help="output directory")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    std_devs = [tuple(std) for std in args.std_devs or [VISION_STD_DEVS]]
+    jobs = [(log, std, args.out) for log in args.logs for std in std_devs]
+
+    with ProcessPoolExecutor(args.jobs) as pool:
+        for summary in pool.map(_run, jobs):
+            print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,9 @@
-from robot.robot import Robot
+def __getattr__(name: str):
+    # Robot is imported lazily so tools can import the rest of the package without
+    # creating any hardware or starting the HAL.
+    if name == "Robot":
+        from robot.robot import Robot
+
+        return Robot
+
+    raise AttributeError(f"module 'robot' has no attribute '{name}'")
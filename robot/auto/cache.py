@@ -0,0 +1,221 @@
+"""
+Precompiled trajectory cache.
+
+Generating a trajectory from a PathPlanner `.path` file means parsing the JSON,
+generating the splines and time-parameterizing them, and then mirroring the result
+for the red alliance. That's slow on the roboRIO, and it used to all happen while
+the robot was booting.
+
+Instead, every trajectory is compiled once (see `compile_paths.py`) into a small
+binary file in `deploy/trajectories`, holding the sampled blue and red states and the
+times the path's event markers are passed. At startup these files are memory-mapped
+and turned straight into `Trajectory` objects, without reading the `.path` JSON.
+Each file stores the hash of the `.path` file it was generated from and the
+constraints it was generated with, so if a path is edited the entry is stale and
+gets regenerated (and re-cached) the next time it's loaded.
+
+File layout (little endian):
+
+    header: magic, version, reversed, sha1 of the .path file, max vel, max accel,
+            state count, marker count, then padding to 8 bytes
+    states: `count` blue states followed by `count` red states,
+            each one (t, velocity, acceleration, x, y, heading, curvature)
+    markers: each one (time, name length), then the UTF-8 name
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from wpilib import getDeployDirectory
+from wpimath.geometry import Pose2d, Rotation2d
+from wpimath.trajectory import Trajectory
+
+PATH_DIR = os.path.join(getDeployDirectory(), "pathplanner")
+CACHE_DIR = os.path.join(getDeployDirectory(), "trajectories")
+
+MAGIC = b"TRAJ"
+VERSION = 2
+
+_HEADER = struct.Struct("<4sHH20sddII4x")
+_STATE = struct.Struct("<7d")
+_MARKER = struct.Struct("<dB")
+
+# Every cache file touched since startup, and whether it had to be regenerated
+used: Dict[str, bool] = {}
+
+
+def path_hash(name: str) -> bytes:
+    """
+    SHA1 of a PathPlanner `.path` file in the deploy directory.
+    """
+    with open(os.path.join(PATH_DIR, f"{name}.path"), "rb") as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def cache_file(name: str, max_vel: float, max_accel: float, reversed: bool) -> str:
+    """
+    Get the cache file for a path and set of constraints.
+    """
+    rev = "_rev" if reversed else ""
+    return os.path.join(CACHE_DIR, f"{name}_{max_vel:g}_{max_accel:g}{rev}.traj")
+
+
+def _pack_states(traj: Trajectory) -> List[bytes]:
+    return [
+        _STATE.pack(
+            state.t,
+            state.velocity,
+            state.acceleration,
+            state.pose.X(),
+            state.pose.Y(),
+            state.pose.rotation().radians(),
+            state.curvature,
+        )
+        for state in traj.states()
+    ]
+
+
+def _unpack_states(values: memoryview, start: int, count: int) -> Trajectory:
+    states = []
+
+    for i in range(start, start + count * 7, 7):
+        t, vel, accel, x, y, heading, curvature = values[i : i + 7]
+        states.append(
+            Trajectory.State(
+                t, vel, accel, Pose2d(x, y, Rotation2d(heading)), curvature
+            )
+        )
+
+    return Trajectory(states)
+
+
+def _pack_markers(markers: Sequence[Tuple[float, str]]) -> List[bytes]:
+    packed = []
+
+    for time, marker_name in markers:
+        encoded = marker_name.encode()
+        packed.append(_MARKER.pack(time, len(encoded)) + encoded)
+
+    return packed
+
+
+def _unpack_markers(
+    data: mmap.mmap, offset: int, count: int
+) -> Optional[List[Tuple[float, str]]]:
+    markers = []
+
+    for _ in range(count):
+        if offset + _MARKER.size > len(data):
+            return None
+
+        time, length = _MARKER.unpack_from(data, offset)
+        offset += _MARKER.size
+        markers.append((time, data[offset : offset + length].decode()))
+        offset += length
+
+    # Anything left over (or missing) means the file is corrupt
+    if offset != len(data):
+        return None
+
+    return markers
+
+
+def read(
+    name: str, max_vel: float, max_accel: float, reversed: bool
+) -> Optional[Tuple[Trajectory, Trajectory, List[Tuple[float, str]]]]:
+    """
+    Read a (blue, red) pair of trajectories and their (time, name) event markers from
+    the cache. Returns None if there is no entry, or if the entry is stale.
+    """
+    filename = cache_file(name, max_vel, max_accel, reversed)
+
+    try:
+        digest = path_hash(name)
+        f = open(filename, "rb")
+    except OSError:
+        return None
+
+    with f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            return None
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with mm:
+        header = _HEADER.unpack_from(mm)
+        magic, version, rev, sha, vel, accel, count, marker_count = header
+        states_end = _HEADER.size + 2 * count * _STATE.size
+
+        # fmt: off
+        if (
+            magic != MAGIC or version != VERSION or sha != digest
+            or vel != max_vel or accel != max_accel or bool(rev) != reversed
+            or len(mm) < states_end
+        ):
+            return None
+        # fmt: on
+
+        markers = _unpack_markers(mm, states_end, marker_count)
+        if markers is None:
+            return None
+
+        values = memoryview(mm)[_HEADER.size : states_end].cast("d")
+        try:
+            blue = _unpack_states(values, 0, count)
+            red = _unpack_states(values, count * 7, count)
+        finally:
+            values.release()
+
+    used[filename] = False
+    return blue, red, markers
+
+
+def write(
+    name: str,
+    max_vel: float,
+    max_accel: float,
+    reversed: bool,
+    blue: Trajectory,
+    red: Trajectory,
+    markers: Sequence[Tuple[float, str]] = (),
+) -> None:
+    """
+    Write a (blue, red) pair of trajectories and their (time, name) event markers to
+    the cache. Failing to write the cache is not fatal, the trajectory will just be
+    regenerated next time.
+    """
+    filename = cache_file(name, max_vel, max_accel, reversed)
+    blue_states = _pack_states(blue)
+    red_states = _pack_states(red)
+    packed_markers = _pack_markers(markers)
+
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        reversed,
+        path_hash(name),
+        max_vel,
+        max_accel,
+        len(blue_states),
+        len(packed_markers),
+    )
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        # Write to a temporary file first so a half-written file is never mapped
+        with open(filename + ".tmp", "wb") as f:
+            f.write(header)
+            f.writelines(blue_states)
+            f.writelines(red_states)
+            f.writelines(packed_markers)
+
+        os.replace(filename + ".tmp", filename)
+    except OSError as e:
+        print(f"Failed to cache trajectory '{name}': {e}")
+        return
+
+    used[filename] = True
@@ -0,0 +1,278 @@
+from array import array
+from typing import Callable, List, Set, Tuple, Union
+
+from commands2 import Command, CommandBase, Subsystem
+from wpilib import Timer
+
+"""
+Route compiler, which flattens the command tree an auto route builds into a single
+state machine command.
+
+Routes describe their structure with the builders here (`sequence`, `parallel`,
+`race`, `deadline`, `wait` and `wait_until`) instead of with commands2's groups.
+Each builder just returns a node, and every other command is a leaf. `compile_route`
+then turns the tree into a flat list of states:
+
+- every leaf or wait in a sequence, no matter how deeply nested, is its own state,
+  so a sequence of sequences is just one longer list of states
+- a parallel group is one state that runs all of its children at once, and any of
+  its children that are more than one state are compiled into a machine of their own
+
+Each state's requirements and the state it goes to when it's done (the transition
+table) are worked out when the route is built. So every loop, the route only runs
+the commands of the state it's in, no matter how the route was nested. Waits are
+handled by the machine itself, and aren't commands at all.
+
+Building a route fails if a command shows up in it twice, or if two commands that
+run at the same time require the same subsystem.
+
+## Example:
+```
+@auto.route("Example")
+def example(robot) -> Node:
+    return sequence(
+        robot.arm.move_to(ArmPosition.HIGH),
+        wait(0.2),
+        deadline(DriveTrajectory(robot, SUB_TO_CUBE), intake(robot)),
+    )
+```
+"""
+
+# When a parallel state is done
+ALL, ANY, DEADLINE = range(3)
+
+
+class Node:
+    """
+    A group in a route's command tree, before it's compiled.
+    """
+
+    __slots__ = ("children", "policy", "seconds", "condition")
+
+    def __init__(
+        self,
+        children: Tuple[Union["Node", Command], ...] = (),
+        policy: int = None,
+        seconds: float = None,
+        condition: Callable[[], bool] = None,
+    ):
+        self.children = children
+        self.policy = policy
+        self.seconds = seconds
+        self.condition = condition
+
+
+def sequence(*children: Union[Node, Command]) -> Node:
+    """
+    Run each child after the last one finishes.
+    """
+    return Node(children)
+
+
+def parallel(*children: Union[Node, Command]) -> Node:
+    """
+    Run every child at once, until they've all finished.
+    """
+    return Node(children, ALL)
+
+
+def race(*children: Union[Node, Command]) -> Node:
+    """
+    Run every child at once, until any one of them finishes.
+    """
+    return Node(children, ANY)
+
+
+def deadline(first: Union[Node, Command], *children: Union[Node, Command]) -> Node:
+    """
+    Run every child at once, until the first one finishes.
+    """
+    return Node((first,) + children, DEADLINE)
+
+
+def wait(seconds: float) -> Node:
+    """
+    Wait for some number of seconds.
+    """
+    return Node(seconds=seconds)
+
+
+def wait_until(condition: Callable[[], bool]) -> Node:
+    """
+    Wait until `condition` returns True.
+    """
+    return Node(condition=condition)
+
+
+class State:
+    """
+    One state of a compiled route. A state either runs commands, or waits.
+    """
+
+    __slots__ = ("commands", "policy", "seconds", "condition", "requirements")
+
+    def __init__(
+        self,
+        commands: Tuple[Command, ...] = (),
+        policy: int = ALL,
+        seconds: float = 0.0,
+        condition: Callable[[], bool] = None,
+    ):
+        self.commands = commands
+        self.policy = policy
+        self.seconds = seconds
+        self.condition = condition
+
+        self.requirements: Set[Subsystem] = set()
+        for command in commands:
+            self.requirements |= command.getRequirements()
+
+
+def _name(subsystem: Subsystem) -> str:
+    return type(subsystem).__name__
+
+
+class CompiledRoute(CommandBase):
+    """
+    Runs a compiled route's states one after another, following its transition
+    table. Made by `compile_route`.
+    """
+
+    def __init__(self, states: List[State], transitions: List[int]):
+        super().__init__()
+
+        self._states = states
+        self._transitions = array("i", transitions)
+
+        for state in states:
+            self.addRequirements(*state.requirements)
+
+        self._timer = Timer()
+        self._index = -1
+        self._running: List[Command] = []
+
+    def _enter(self, index: int):
+        self._index = index
+        self._running.clear()
+
+        if index < 0:
+            return
+
+        state = self._states[index]
+        self._timer.restart()
+
+        for command in state.commands:
+            command.initialize()
+            self._running.append(command)
+
+    def initialize(self):
+        self._enter(0 if self._states else -1)
+
+    def execute(self):
+        if self._index < 0:
+            return
+
+        state = self._states[self._index]
+        running = self._running
+        finished = False
+
+        for command in running[:]:
+            command.execute()
+
+            if command.isFinished():
+                command.end(False)
+                running.remove(command)
+                finished = True
+
+        if state.policy == ALL:
+            done = (
+                not running
+                and self._timer.hasElapsed(state.seconds)
+                and (state.condition is None or state.condition())
+            )
+        elif state.policy == ANY:
+            done = finished
+        else:
+            done = state.commands[0] not in running
+
+        if done:
+            for command in running:
+                command.end(True)
+
+            self._enter(self._transitions[self._index])
+
+    def end(self, interrupted: bool):
+        for command in self._running:
+            command.end(True)
+
+        self._running.clear()
+        self._index = -1
+
+    def isFinished(self) -> bool:
+        return self._index < 0
+
+
+def _flatten(node: Union[Node, Command], states: List[State]):
+    if not isinstance(node, Node):
+        states.append(State((node,)))
+    elif node.seconds is not None:
+        states.append(State(seconds=node.seconds))
+    elif node.condition is not None:
+        states.append(State(condition=node.condition))
+    elif node.policy is None:
+        for child in node.children:
+            _flatten(child, states)
+    else:
+        commands = tuple(_compile(child) for child in node.children)
+        states.append(State(commands, node.policy))
+
+
+def _compile(node: Union[Node, Command]) -> Command:
+    """
+    Compile a node into a single command, leaving commands alone.
+    """
+    if not isinstance(node, Node):
+        return node
+
+    states: List[State] = []
+    _flatten(node, states)
+
+    # Every state goes on to the next one, and the last one ends the route
+    transitions = list(range(1, len(states))) + [-1]
+
+    return CompiledRoute(states, transitions)
+
+
+def _validate(route: CompiledRoute, seen: Set[int]):
+    for state in route._states:
+        claimed: Set[Subsystem] = set()
+
+        for command in state.commands:
+            if id(command) in seen:
+                raise ValueError(f"{command.getName()} is used more than once")
+            seen.add(id(command))
+
+            conflicts = claimed & command.getRequirements()
+            if conflicts:
+                names = ", ".join(sorted(_name(s) for s in conflicts))
+                raise ValueError(
+                    f"{command.getName()} requires {names} while something else"
+                    " running at the same time does"
+                )
+            claimed |= command.getRequirements()
+
+            if isinstance(command, CompiledRoute):
+                _validate(command, seen)
+
+
+def compile_route(node: Union[Node, Command]) -> Command:
+    """
+    Compile a route's command tree into a single state machine command, checking
+    it for conflicts. Plain commands are returned as they are.
+    """
+    command = _compile(node)
+
+    if isinstance(command, CompiledRoute):
+        _validate(command, set())
+
+    return command
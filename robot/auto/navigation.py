@@ -0,0 +1,327 @@
+import heapq
+import itertools
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from wpilib import DriverStation, reportWarning
+from wpimath.geometry import Pose2d, Rotation2d, Translation2d
+from wpimath.trajectory import TrajectoryConfig, TrajectoryGenerator
+
+from robot.constants import *
+from robot.auto.trajectory import ArrayTrajectory, DriveTrajectory
+
+"""
+On the fly trajectory generation, for driving to a pose from wherever the robot is.
+
+The field's obstacles (both charge stations and both grids) are grown by the
+robot's clearance, and their corners make up a navigation graph, with an edge
+between every pair of corners that can see each other. That graph is built once.
+To plan a path, the start and goal are connected to the corners they can see, the
+shortest path through the graph is found, and a trajectory is generated through
+its corners.
+
+Generating a trajectory (and the ArrayTrajectory that follows it) takes too long for
+the main loop, so it's done on a background thread, and the result is a Future. The
+graph is built when the robot boots, in robotInit. Trajectories are cached by their
+goal and their start pose, rounded to `NAV_POSE_RESOLUTION` and
+`NAV_HEADING_RESOLUTION`, so driving to the same place from about the same place
+again is free.
+"""
+
+Point = Tuple[float, float]
+Rect = Tuple[float, float, float, float]
+
+
+def _mirror(rect: Rect) -> Rect:
+    min_x, max_x, min_y, max_y = rect
+    return FIELD_LENGTH - max_x, FIELD_LENGTH - min_x, min_y, max_y
+
+
+def _grow(rect: Rect, amount: float) -> Rect:
+    min_x, max_x, min_y, max_y = rect
+    return min_x - amount, max_x + amount, min_y - amount, max_y + amount
+
+
+def _contains(rect: Rect, point: Point) -> bool:
+    min_x, max_x, min_y, max_y = rect
+    return min_x < point[0] < max_x and min_y < point[1] < max_y
+
+
+def _crosses(rect: Rect, a: Point, b: Point) -> bool:
+    """
+    Whether the segment from a to b passes through the inside of a rectangle
+    (Liang-Barsky clipping).
+    """
+    min_x, max_x, min_y, max_y = rect
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    t0, t1 = 0.0, 1.0
+
+    for p, q in (
+        (-dx, a[0] - min_x),
+        (dx, max_x - a[0]),
+        (-dy, a[1] - min_y),
+        (dy, max_y - a[1]),
+    ):
+        if p == 0:
+            if q <= 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+
+            if t0 >= t1:
+                return False
+
+    return True
+
+
+class NavGraph:
+    """
+    Visibility graph between the corners of the field's obstacles.
+    """
+
+    def __init__(self, clearance: float = NAV_CLEARANCE):
+        obstacles = (CHARGE_STATION, GRID)
+        self.obstacles: List[Rect] = [
+            _grow(rect, clearance)
+            for obstacle in obstacles
+            for rect in (obstacle, _mirror(obstacle))
+        ]
+
+        # Corners are just outside the grown obstacles, so paths don't graze them
+        self.nodes: List[Point] = []
+        for min_x, max_x, min_y, max_y in self.obstacles:
+            for x in (min_x - 0.05, max_x + 0.05):
+                for y in (min_y - 0.05, max_y + 0.05):
+                    if 0 < x < FIELD_LENGTH and 0 < y < FIELD_WIDTH:
+                        self.nodes.append((x, y))
+
+        self.nodes = [
+            node
+            for node in self.nodes
+            if not any(_contains(rect, node) for rect in self.obstacles)
+        ]
+
+        self.edges: List[List[Tuple[int, float]]] = [[] for _ in self.nodes]
+        for i, a in enumerate(self.nodes):
+            for j in range(i + 1, len(self.nodes)):
+                b = self.nodes[j]
+
+                if self.visible(a, b):
+                    dist = math.dist(a, b)
+                    self.edges[i].append((j, dist))
+                    self.edges[j].append((i, dist))
+
+    def visible(self, a: Point, b: Point, ignore: Tuple[Rect, ...] = ()) -> bool:
+        return not any(
+            _crosses(rect, a, b) for rect in self.obstacles if rect not in ignore
+        )
+
+    def path(self, start: Point, goal: Point) -> List[Point]:
+        """
+        Find the shortest path from start to goal, as the corners to go through in
+        between. Obstacles the start or goal are inside of are ignored, so the robot
+        can always get out of (or up to) something like the grid.
+        """
+        ignore = tuple(
+            rect
+            for rect in self.obstacles
+            if _contains(rect, start) or _contains(rect, goal)
+        )
+
+        if self.visible(start, goal, ignore):
+            return []
+
+        # Dijkstra's from the start, with the goal as node -1. Entries are numbered
+        # in the order they're pushed, so ties never get as far as comparing `prev`
+        dist: Dict[int, float] = {}
+        came_from: Dict[int, int] = {}
+        queue = []
+        order = itertools.count()
+
+        for i, node in enumerate(self.nodes):
+            if self.visible(start, node, ignore):
+                heapq.heappush(queue, (math.dist(start, node), next(order), i, None))
+
+        while queue:
+            cost, _, i, prev = heapq.heappop(queue)
+
+            if i in dist:
+                continue
+
+            dist[i] = cost
+            if prev is not None:
+                came_from[i] = prev
+
+            if i == -1:
+                break
+
+            node = self.nodes[i]
+
+            if self.visible(node, goal, ignore):
+                heapq.heappush(
+                    queue, (cost + math.dist(node, goal), next(order), -1, i)
+                )
+
+            for j, edge in self.edges[i]:
+                if j not in dist:
+                    heapq.heappush(queue, (cost + edge, next(order), j, i))
+
+        if -1 not in dist:
+            # Nowhere to go, so just go straight there
+            return []
+
+        corners = []
+        i = came_from.get(-1)
+        while i is not None:
+            corners.append(self.nodes[i])
+            i = came_from.get(i)
+
+        return corners[::-1]
+
+
+def _quantize(pose: Pose2d) -> Tuple[int, int, int]:
+    return (
+        round(pose.X() / NAV_POSE_RESOLUTION),
+        round(pose.Y() / NAV_POSE_RESOLUTION),
+        round(pose.rotation().degrees() / NAV_HEADING_RESOLUTION),
+    )
+
+
+class Navigator:
+    """
+    Generates trajectories through the NavGraph on a background thread.
+    """
+
+    def __init__(self):
+        self._graph = NavGraph()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="Navigator")
+        self._cache: Dict[tuple, Future] = {}
+
+    def _generate(self, start: Pose2d, goal: Pose2d) -> ArrayTrajectory:
+        corners = self._graph.path((start.X(), start.Y()), (goal.X(), goal.Y()))
+
+        # Back up if the first place to go is behind the robot
+        first = corners[0] if corners else (goal.X(), goal.Y())
+        direction = math.atan2(first[1] - start.Y(), first[0] - start.X())
+        reversed = math.cos(direction - start.rotation().radians()) < 0
+
+        config = TrajectoryConfig(NAV_MAX_VEL, NAV_MAX_ACCEL)
+        config.setKinematics(DRIVE_KINEMATICS)
+        config.setReversed(reversed)
+
+        trajectory = TrajectoryGenerator.generateTrajectory(
+            start, [Translation2d(x, y) for x, y in corners], goal, config
+        )
+
+        return ArrayTrajectory(trajectory)
+
+    def request(self, start: Pose2d, goal: Pose2d) -> Future:
+        """
+        Get a Future of an ArrayTrajectory from about `start` to `goal`. The
+        trajectory starts at `start` rounded for caching. Failed trajectories aren't
+        cached, so they're tried again.
+        """
+        start_key = _quantize(start)
+        key = (start_key, goal.X(), goal.Y(), goal.rotation().radians())
+
+        future = self._cache.get(key)
+        if future is not None and future.done() and future.exception() is not None:
+            del self._cache[key]
+
+        if key not in self._cache:
+            if len(self._cache) >= NAV_CACHE_SIZE:
+                # Dicts keep insertion order, so this is the oldest
+                del self._cache[next(iter(self._cache))]
+
+            x, y, heading = start_key
+            rounded = Pose2d(
+                x * NAV_POSE_RESOLUTION,
+                y * NAV_POSE_RESOLUTION,
+                Rotation2d.fromDegrees(heading * NAV_HEADING_RESOLUTION),
+            )
+
+            self._cache[key] = self._executor.submit(self._generate, rounded, goal)
+
+        return self._cache[key]
+
+
+_BLUE_GRID_NODES = [
+    Pose2d(NAV_GRID_X, y, Rotation2d.fromDegrees(180)) for y in NAV_GRID_YS
+]
+_RED_GRID_NODES = [
+    Pose2d(FIELD_LENGTH - NAV_GRID_X, y, Rotation2d()) for y in NAV_GRID_YS
+]
+
+
+def nearest_grid_node(pose: Pose2d) -> Pose2d:
+    """
+    Get the pose to score from on the node of our alliance's grid that's closest to
+    `pose` across the field.
+    """
+    if DriverStation.getAlliance() == DriverStation.Alliance.kRed:
+        nodes = _RED_GRID_NODES
+    else:
+        nodes = _BLUE_GRID_NODES
+
+    return min(nodes, key=lambda node: abs(node.Y() - pose.Y()))
+
+
+class DriveToPose(DriveTrajectory):
+    """
+    Drives to a pose from wherever the robot is when the command starts, along a
+    trajectory generated on the fly by `robot.navigator`. The robot holds still until
+    it's ready.
+    """
+
+    def __init__(self, robot, goal: Union[Pose2d, Callable[[], Pose2d]]):
+        super().__init__(robot, None)
+        self._goal = goal
+
+        # Bound to a button, so it has to take over from the default arcade drive
+        self.addRequirements(robot.drivetrain)
+
+        self._future: Optional[Future] = None
+        self._arrays: ArrayTrajectory = None
+        self._failed = False
+
+    def initialize(self):
+        goal = self._goal() if callable(self._goal) else self._goal
+
+        self._future = self.robot.navigator.request(
+            self.robot.drivetrain.get_pose(), goal
+        )
+        self._arrays = None
+        self._failed = False
+
+    def execute(self):
+        if self._arrays is None:
+            if not self._future.done():
+                self.robot.drivetrain.set_wheel_speeds(0, 0)
+                return
+
+            if self._future.exception() is not None:
+                error = self._future.exception()
+                reportWarning(f"Failed to generate trajectory: {error}", False)
+                self._failed = True
+                return
+
+            self._arrays = self._future.result()
+            super().initialize()
+
+        super().execute()
+
+    def end(self, interupt: bool):
+        if self._arrays is None:
+            self.robot.drivetrain.set_wheel_speeds(0, 0)
+            return
+
+        super().end(interupt)
+
+    def isFinished(self):
+        return self._failed or (self._arrays is not None and super().isFinished())
@@ -0,0 +1,17 @@
+from robot.auto.trajectory import load_trajectory
+
+"""
+Every trajectory used by our auto routes is loaded here.
+
+These are kept out of `routes.py` so `compile_paths.py` can load all of them, and
+compile them into the trajectory cache, without needing a robot instance.
+"""
+
+SUB_TO_CUBE = load_trajectory("SubDriveToCube", 1.75, 5, True)
+FUNNY = load_trajectory("SubDriveToCube", 1.75, 5, True)
+SUB_TO_GRID = load_trajectory("SubDriveToGrid", 1.5, 5)
+
+BUMP_TO_CUBE = load_trajectory("BumpDriveToCube", 1.0, 5, True)
+BUMP_TO_GRID = load_trajectory("BumpDriveToGrid", 1.0, 5)
+
+GET_ON_CHARGE = load_trajectory("MidGetOnCharge", 1.75, True)
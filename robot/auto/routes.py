@@ -1,7 +1,6 @@
-from commands2 import Command, WaitCommand
-from commands2.cmd import sequence, waitUntil
-
-from robot.auto.trajectory import DriveTrajectory, load_trajectory
+from robot.auto.compiler import Node, compile_route, sequence, wait, wait_until
+from robot.auto.trajectory import DriveTrajectory
+from robot.auto.paths import *
 from robot.subsystems.arm import ArmPosition
 from robot.auto.selector import AutoSelector as auto
 
@@ -12,6 +11,9 @@ To create an auto route, the static `route` decorator of the `AutoSelector`
 class can be used on a function or class, which takes `robot` as it's first
 parameter. See `AutoSelector.route`'s docstring in `selector.py` to see more.
 
+Routes are built out of the groups in `compiler.py` instead of commands2's, so
+they're compiled into one flat command when they're built.
+
 ---
 
 Why did I do it this way? Well, for one, it's a lot cleaner than making a bunch
@@ -23,35 +25,36 @@ Python's decorators make it really easy to make easily expandable systems such
 as this.
 """
 
-# Trajectories
-SUB_TO_CUBE = load_trajectory("SubDriveToCube", 1.75, 5, True)
-FUNNY = load_trajectory("SubDriveToCube", 1.75, 5, True)
-SUB_TO_GRID = load_trajectory("SubDriveToGrid", 1.5, 5)
-
-BUMP_TO_CUBE = load_trajectory("BumpDriveToCube", 1.0, 5, True)
-BUMP_TO_GRID = load_trajectory("BumpDriveToGrid", 1.0, 5)
-
-GET_ON_CHARGE = load_trajectory("MidGetOnCharge", 1.75, True)
-
 
 @auto.route("PlaceHigh")
-def place_high(robot) -> Command:
+def place_high(robot) -> Node:
     return sequence(
         robot.claw.close(),
-        robot.arm.set_position(ArmPosition.HIGH),
-        WaitCommand(1.5),
+        robot.arm.move_to(ArmPosition.HIGH),
         robot.claw.open(),
-        WaitCommand(0.3),
         robot.arm.set_position(ArmPosition.HOME),
     )
 
 
+def intake(robot) -> Node:
+    """
+    Swing the arm back and grab a game piece off the floor. Started by the "intake"
+    marker on the paths that drive to a game piece, once the arm is clear of the grid.
+    """
+    return sequence(
+        robot.arm.set_position(ArmPosition.BACK),
+        robot.claw.open(),
+        wait_until(robot.claw.get_photosensor),
+        robot.claw.close(),
+    )
+
+
 @auto.route("MidCubeBalance")
-def cube_balance(robot) -> Command:
+def cube_balance(robot) -> Node:
     # fmt: off
     return sequence(
         place_high(robot),
-        WaitCommand(1),
+        robot.arm.wait_for_position(),
         robot.drivetrain.reset_level(),
         DriveTrajectory(robot, GET_ON_CHARGE),
         robot.drivetrain.drive_until_level(-0.4)
@@ -60,55 +63,42 @@ def cube_balance(robot) -> Command:
 
 
 @auto.route("SubConeCube")
-def sub_cone_cube(robot) -> Command:
+def sub_cone_cube(robot) -> Node:
     return sequence(
         robot.drivetrain.reset_pose(SUB_TO_CUBE.get_initial_state),
         place_high(robot),
-        WaitCommand(0.2),
-        DriveTrajectory(robot, SUB_TO_CUBE).deadlineWith(
-            sequence(
-                WaitCommand(0.7),
-                robot.arm.set_position(ArmPosition.BACK),
-                robot.claw.open(),
-                waitUntil(robot.claw.get_photosensor).andThen(robot.claw.close())
-            )
+        wait(0.2),
+        DriveTrajectory(
+            robot, SUB_TO_CUBE, events={"intake": compile_route(intake(robot))}
         ),
         robot.claw.close(),
-        WaitCommand(0.3),
         robot.arm.set_position(ArmPosition.HOME),
         DriveTrajectory(robot, SUB_TO_GRID),
         place_high(robot),
-        WaitCommand(0.2),
+        wait(0.2),
         DriveTrajectory(robot, FUNNY),
     )
 
 
 @auto.route("SubConeLeave")
-def sub_cone_leave(robot) -> Command:
+def sub_cone_leave(robot) -> Node:
     # fmt: off
     return sequence(
         place_high(robot),
-        WaitCommand(0.2),
+        wait(0.2),
         DriveTrajectory(robot, SUB_TO_CUBE))
     # fmt: on
 
 
 @auto.route("BumpConeCube")
-def bump_cone_cube(robot) -> Command:
+def bump_cone_cube(robot) -> Node:
     return sequence(
         place_high(robot),
-        WaitCommand(0.2),
-        DriveTrajectory(robot, BUMP_TO_CUBE).deadlineWith(
-            sequence(
-                WaitCommand(0.7),
-                robot.arm.set_position(ArmPosition.BACK),
-                robot.claw.open(),
-                waitUntil(robot.claw.get_photosensor),
-                robot.claw.close(),
-            )
+        wait(0.2),
+        DriveTrajectory(
+            robot, BUMP_TO_CUBE, events={"intake": compile_route(intake(robot))}
         ),
         robot.claw.close(),
-        WaitCommand(0.3),
         robot.arm.set_position(ArmPosition.HOME),
         DriveTrajectory(robot, BUMP_TO_GRID),
         place_high(robot),
@@ -116,10 +106,10 @@ def bump_cone_cube(robot) -> Command:
 
 
 @auto.route("BumpConeLeave")
-def bump_cone_leave(robot) -> Command:
+def bump_cone_leave(robot) -> Node:
     # fmt: off
     return sequence(
         place_high(robot),
-        WaitCommand(0.2),
+        wait(0.2),
         DriveTrajectory(robot, BUMP_TO_CUBE))
     # fmt: on
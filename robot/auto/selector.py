@@ -1,19 +1,29 @@
+from typing import Callable, Dict, Optional, Tuple
+
+from commands2 import Command
 from wpilib import SendableChooser
 
+from robot.auto.compiler import compile_route
+
 
 class AutoSelector(SendableChooser):
     """
     Auto selector class. Extends a SendableChooser to be a singleton so we
     don't have to worry about instances, and provides a decorator for easily
     adding auto commands.
-    
+
+    Routes are stored as factories and only the selected route is ever built, either
+    ahead of time while disabled (see `prewarm`) or in autonomousInit.
+
     Just like a SendableChooser, this can be published to SmartDashboard.
     """
 
     _instance: "AutoSelector" = None
     robot: "Robot" = None
 
-    _options = set()
+    _routes: Dict[str, Callable[["Robot"], Command]] = {}
+    _built: Tuple[str, Command] = (None, None)
+    _selected: str = None
 
     def __new__(cls, *args, **kwargs):
         # * Making this class a singleton, so there's ever only one instance
@@ -28,22 +38,79 @@ class AutoSelector(SendableChooser):
         self.robot = robot
         self.setDefaultOption("None", None)
 
-        # ? this is NOT good practice but I need to import the routes
-        # ? AFTER the robot instance has been passed to this class
-        # ? so the decorator works. A little jank but whatever.
+        # ? The routes register themselves when imported, and since they're only
+        # ? factories now this no longer needs the robot instance first.
         import robot.auto.routes
+        import robot.auto.sysid
 
         # TODO: Maybe use importlib instead?
 
+        for name in self._routes:
+            self.addOption(name, name)
+
+    @classmethod
+    def select(cls, name: str):
+        """
+        Select a route from code instead of from the dashboard, like when simulating
+        routes headlessly. Takes priority over the dashboard until cleared with None.
+        """
+        if name is not None and name not in cls._routes:
+            raise ValueError(f"No route with name '{name}'")
+
+        cls._selected = name
+
     @classmethod
-    def get_selected(cls):
+    def _get_selected_name(cls) -> str:
+        if cls._selected is not None:
+            return cls._selected
+
         return cls._instance.getSelected()
 
+    @classmethod
+    def build(cls, name: str) -> Optional[Command]:
+        """
+        Build the command for the route with the given name, compiling it if it's
+        made of route groups (see `compiler.py`). Returns None for no route.
+        """
+        if name is None:
+            return None
+
+        return compile_route(cls._routes[name](cls._instance.robot))
+
+    @classmethod
+    def prewarm(cls):
+        """
+        Build the selected route ahead of time if the selection has changed since it
+        was last built, so autonomousInit doesn't have to. Meant to be called while
+        disabled.
+        """
+        name = cls._get_selected_name()
+
+        if name != cls._built[0]:
+            cls._built = (name, cls.build(name))
+
+    @classmethod
+    def get_selected(cls) -> Optional[Command]:
+        """
+        Get the command for the selected route, using the pre-warmed one if it's
+        still the selected route. Each built command is only handed out once, so
+        every run of a route gets a freshly built command.
+        """
+        name = cls._get_selected_name()
+        built_name, command = cls._built
+        cls._built = (None, None)
+
+        if built_name != name:
+            command = cls.build(name)
+
+        return command
+
     @classmethod
     def route(cls, name: str):
         """
-        Utility decorator to add a command to the AutoSelector. Always passes in
-        the current robot instance as the first argument.
+        Utility decorator to add a route to the AutoSelector. The function is stored
+        as a factory, and is only called (with the current robot instance as the
+        first argument) when the route is selected and needs to be built.
 
         ## Example:
         ```
@@ -59,11 +126,10 @@ class AutoSelector(SendableChooser):
 
         def _dec(func):
             # This also prevents segfaults. Took an hour to figure out. Thanks C++.
-            if name in cls._options:
+            if name in cls._routes:
                 raise ValueError(f"Route with name '{name}' already exists")
 
-            cls._instance.addOption(name, func(cls._instance.robot))
-            cls._options.add(name)
+            cls._routes[name] = func
 
             return func
 
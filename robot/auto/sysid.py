@@ -0,0 +1,148 @@
+import atexit
+import math
+
+from commands2 import CommandBase
+from wpilib import RobotBase, Timer
+
+from robot.constants import *
+from robot.auto.selector import AutoSelector as auto
+from robot.util.datalog import DataLog
+
+"""
+On-robot characterization routines, for fitting the feedforward gains in
+`constants.py` with `fit_sysid.py`.
+
+Each test drives one mechanism with a voltage that either ramps up slowly
+(quasistatic) or jumps straight to a step (dynamic), forwards or backwards, and logs
+the voltage and the mechanism's position (and velocity, for the drivetrain) every
+loop to its own data log. The arm's joints are tested one at a time, with the other
+one held at its setpoint, and each test stops before the joint swings too far.
+
+Each test's log is opened once, when the test is registered, and every run of it is
+appended to it, tagged with the time the run started.
+
+The tests show up in the auto chooser when `SYSID_ENABLED` is set.
+"""
+
+# fmt: off
+DRIVE_FIELDS = (
+    "run", "time", "left_volts", "right_volts",
+    "left_pos", "right_pos", "left_vel", "right_vel",
+)
+# fmt: on
+ARM_FIELDS = ("run", "time", "volts", "pos")
+
+
+class SysIdTest(CommandBase):
+    """
+    Runs one characterization test on the "drive", "lower_arm" or "upper_arm".
+    """
+
+    def __init__(
+        self, robot, mechanism: str, dynamic: bool, forward: bool, log: DataLog
+    ):
+        super().__init__()
+        self.robot = robot
+        self.mechanism = mechanism
+        self.dynamic = dynamic
+        self.direction = 1 if forward else -1
+
+        self.addRequirements(robot.drivetrain if mechanism == "drive" else robot.arm)
+
+        self._timer = Timer()
+        self._log = log
+        self._run: float = 0
+
+    def _position(self) -> float:
+        if self.mechanism == "lower_arm":
+            return self.robot.arm.get_lower_position()
+        return self.robot.arm.get_upper_position()
+
+    def initialize(self):
+        self._run = Timer.getFPGATimestamp()
+
+        if self.mechanism != "drive":
+            self._start = self._position()
+
+        self._timer.restart()
+
+    def _volts(self) -> float:
+        if self.dynamic:
+            step = SYSID_DRIVE_STEP if self.mechanism == "drive" else SYSID_ARM_STEP
+            return self.direction * step
+
+        return self.direction * SYSID_RAMP_RATE * self._timer.get()
+
+    def execute(self):
+        now = Timer.getFPGATimestamp()
+        volts = self._volts()
+
+        if self.mechanism == "drive":
+            drivetrain = self.robot.drivetrain
+            # Like the arm below, log the voltages applied since the encoders were
+            # last read, before sending the new ones
+            applied = drivetrain.get_volts()
+            drivetrain.tank_drive_volts(volts, volts)
+
+            self._log.append(
+                self._run,
+                now,
+                *applied,
+                drivetrain.get_left_encoder_pos(),
+                drivetrain.get_right_encoder_pos(),
+                drivetrain.get_left_encoder_vel(),
+                drivetrain.get_right_encoder_vel(),
+            )
+        else:
+            if self.mechanism == "lower_arm":
+                self.robot.arm.set_volts(lower=volts)
+                applied = self.robot.arm.get_volts()[0]
+            else:
+                self.robot.arm.set_volts(upper=volts)
+                applied = self.robot.arm.get_volts()[1]
+
+            # The arm applies the new voltage in its next periodic, so this logs the
+            # voltage it's applying from when the position was read
+            self._log.append(self._run, now, applied, self._position())
+
+    def end(self, interrupted: bool):
+        if self.mechanism == "drive":
+            self.robot.drivetrain.tank_drive_volts(0, 0)
+        else:
+            self.robot.arm.set_volts()
+
+    def isFinished(self) -> bool:
+        if self._timer.hasElapsed(SYSID_TEST_LENGTH):
+            return True
+
+        if self.mechanism == "drive":
+            return False
+
+        return (
+            abs(math.remainder(self._position() - self._start, math.tau))
+            > SYSID_ARM_TRAVEL
+        )
+
+
+def _register(mechanism: str, dynamic: bool, forward: bool):
+    test = "Dynamic" if dynamic else "Quasistatic"
+    direction = "Forward" if forward else "Reverse"
+
+    log = DataLog(
+        DRIVE_FIELDS if mechanism == "drive" else ARM_FIELDS,
+        DATALOG_DIR if RobotBase.isReal() else "logs",
+        flush_period=DATALOG_FLUSH_PERIOD,
+        name=f"sysid_{mechanism}_{test.lower()}_{direction.lower()}",
+    )
+    atexit.register(log.close)
+
+    @auto.route(f"SysId {mechanism} {test} {direction}")
+    def _test(robot) -> SysIdTest:
+        return SysIdTest(robot, mechanism, dynamic, forward, log)
+
+
+if SYSID_ENABLED:
+    for mechanism in ("drive", "lower_arm", "upper_arm"):
+        for dynamic in (False, True):
+            for forward in (True, False):
+                _register(mechanism, dynamic, forward)
@@ -1,14 +1,18 @@
+import json
 import math
+import os
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple, Union
 
-from commands2 import CommandBase
+from commands2 import Command, CommandBase
 from wpilib import DriverStation, Timer
-from wpimath.controller import RamseteController
-from wpimath.kinematics import ChassisSpeeds
 from wpimath.trajectory import Trajectory
 from wpimath.geometry import Pose2d, Rotation2d
 from pathplannerlib import PathPlanner
 
 from robot.constants import *
+import robot.auto.cache as cache
 
 
 def mirror_trajectory(traj: Trajectory) -> Trajectory:
@@ -34,15 +38,272 @@ def mirror_trajectory(traj: Trajectory) -> Trajectory:
     )
 
 
+class ArrayTrajectory:
+    """
+    A compact, read-only copy of a Trajectory, stored as contiguous float arrays
+    instead of a list of State objects.
+
+    Sampling keeps a cursor into the arrays that only moves forward, since a drive
+    command always samples with an increasing time, so each sample is O(1) instead of
+    a binary search. `follow` then runs a Ramsete controller and the drive kinematics
+    on plain floats, so following a trajectory doesn't allocate any wpimath objects
+    every loop.
+    """
+
+    # fmt: off
+    __slots__ = (
+        "t", "x", "y", "heading", "velocity", "acceleration", "curvature", "_cursor"
+    )
+    # fmt: on
+
+    def __init__(self, traj: Trajectory):
+        states = traj.states()
+
+        self.t = array("d", (state.t for state in states))
+        self.x = array("d", (state.pose.X() for state in states))
+        self.y = array("d", (state.pose.Y() for state in states))
+        self.heading = array("d", (state.pose.rotation().radians() for state in states))
+        self.velocity = array("d", (state.velocity for state in states))
+        self.acceleration = array("d", (state.acceleration for state in states))
+        self.curvature = array("d", (state.curvature for state in states))
+
+        self._cursor = 1
+
+    def total_time(self) -> float:
+        return self.t[-1]
+
+    def reset(self):
+        """
+        Move the sampling cursor back to the start of the trajectory.
+        """
+        self._cursor = 1
+
+    def sample(self, time: float) -> Tuple[float, float, float, float, float]:
+        """
+        Sample the trajectory at a time, interpolating between states the same way
+        `Trajectory.sample` does. Returns (x, y, heading, velocity, curvature).
+        """
+        t = self.t
+        last = len(t) - 1
+
+        if time <= t[0] or last == 0:
+            return self._state(0)
+        if time >= t[last]:
+            return self._state(last)
+
+        i = self._cursor
+        if t[i - 1] > time:
+            # Time went backwards, so fall back to a search
+            i = max(bisect_left(t, time), 1)
+        while t[i] < time:
+            i += 1
+        self._cursor = i
+
+        prev = i - 1
+        dt = time - t[prev]
+        vel = self.velocity[prev]
+        accel = self.acceleration[prev]
+
+        # Interpolate by the distance travelled along the segment, like WPILib does
+        dx = self.x[i] - self.x[prev]
+        dy = self.y[i] - self.y[prev]
+        length = math.hypot(dx, dy)
+
+        if length > 1e-9:
+            frac = min(abs(vel * dt + 0.5 * accel * dt * dt) / length, 1.0)
+        else:
+            frac = dt / (t[i] - t[prev])
+
+        dh = math.remainder(self.heading[i] - self.heading[prev], math.tau)
+        curvature = self.curvature[prev]
+
+        return (
+            self.x[prev] + dx * frac,
+            self.y[prev] + dy * frac,
+            self.heading[prev] + dh * frac,
+            vel + accel * dt,
+            curvature + (self.curvature[i] - curvature) * frac,
+        )
+
+    def _state(self, i: int) -> Tuple[float, float, float, float, float]:
+        return (
+            self.x[i],
+            self.y[i],
+            self.heading[i],
+            self.velocity[i],
+            self.curvature[i],
+        )
+
+    def follow(
+        self, time: float, x: float, y: float, heading: float
+    ) -> Tuple[float, float]:
+        """
+        Sample the trajectory and calculate the (left, right) wheel speeds to follow
+        it from the current pose, using a Ramsete controller. This is the same math as
+        `RamseteController.calculate` followed by `DRIVE_KINEMATICS.toWheelSpeeds`.
+        """
+        ref_x, ref_y, ref_heading, ref_vel, ref_curvature = self.sample(time)
+        ref_omega = ref_vel * ref_curvature
+
+        # Error in the robot's frame of reference
+        cos = math.cos(heading)
+        sin = math.sin(heading)
+        dx = ref_x - x
+        dy = ref_y - y
+        err_x = cos * dx + sin * dy
+        err_y = cos * dy - sin * dx
+        err_heading = math.remainder(ref_heading - heading, math.tau)
+
+        if abs(err_heading) < 1e-9:
+            sinc = 1.0 - err_heading * err_heading / 6.0
+        else:
+            sinc = math.sin(err_heading) / err_heading
+
+        k = 2.0 * RAMSETE_ZETA * math.sqrt(ref_omega**2 + RAMSETE_B * ref_vel**2)
+        vel = ref_vel * math.cos(err_heading) + k * err_x
+        omega = ref_omega + k * err_heading + RAMSETE_B * ref_vel * sinc * err_y
+
+        return (
+            vel - omega * DRIVE_TRACK_WIDTH / 2,
+            vel + omega * DRIVE_TRACK_WIDTH / 2,
+        )
+
+
+def _bezier(points, t: float) -> Tuple[float, float]:
+    a, b, c, d = points
+    u = 1 - t
+
+    return (
+        u**3 * a[0] + 3 * u * u * t * b[0] + 3 * u * t * t * c[0] + t**3 * d[0],
+        u**3 * a[1] + 3 * u * u * t * b[1] + 3 * u * t * t * c[1] + t**3 * d[1],
+    )
+
+
+def load_markers(name: str) -> List[Tuple[float, str]]:
+    """
+    Read the event markers of a PathPlanner path, as (fraction of the path's length,
+    name). A waypoint's stop event names count as markers at that waypoint, but the
+    robot doesn't stop for them.
+    """
+    with open(os.path.join(cache.PATH_DIR, f"{name}.path")) as f:
+        path = json.load(f)
+
+    waypoints = path["waypoints"]
+    point = lambda p: (p["x"], p["y"]) if p is not None else None
+
+    # Positions are a waypoint index, plus how far along the segment after it
+    positions = [
+        (marker["position"], marker_name)
+        for marker in path.get("markers", [])
+        for marker_name in marker["names"]
+    ]
+    positions += [
+        (i, event_name)
+        for i, waypoint in enumerate(waypoints)
+        for event_name in (waypoint.get("stopEvent") or {}).get("names", [])
+    ]
+
+    if not positions:
+        return []
+
+    # The arc length along every segment, sampled evenly by its bezier parameter
+    samples = 100
+    segments = []
+    total = 0.0
+
+    for i in range(len(waypoints) - 1):
+        start = point(waypoints[i]["anchorPoint"])
+        end = point(waypoints[i + 1]["anchorPoint"])
+        curve = (
+            start,
+            point(waypoints[i]["nextControl"]) or start,
+            point(waypoints[i + 1]["prevControl"]) or end,
+            end,
+        )
+
+        lengths = [total]
+        prev = start
+        for k in range(1, samples + 1):
+            pos = _bezier(curve, k / samples)
+            lengths.append(lengths[-1] + math.dist(prev, pos))
+            prev = pos
+
+        segments.append(lengths)
+        total = lengths[-1]
+
+    markers = []
+    for position, marker_name in positions:
+        i = min(max(int(position), 0), len(segments) - 1)
+        k, frac = divmod(min(max(position - i, 0.0), 1.0) * samples, 1)
+        k = int(k)
+
+        lengths = segments[i]
+        if k == samples:
+            distance = lengths[k]
+        else:
+            distance = lengths[k] + (lengths[k + 1] - lengths[k]) * frac
+
+        markers.append((distance / total if total > 0 else 0.0, marker_name))
+
+    return markers
+
+
+def marker_times(
+    traj: Trajectory, markers: Sequence[Tuple[float, str]]
+) -> List[Tuple[float, str]]:
+    """
+    Convert markers at fractions of a trajectory's length to the times it passes
+    them, sorted by time.
+    """
+    if not markers:
+        return []
+
+    states = traj.states()
+    times = [state.t for state in states]
+    distances = [0.0]
+
+    if len(states) < 2:
+        return sorted((times[0], name) for _, name in markers)
+
+    for prev, state in zip(states, states[1:]):
+        step = prev.pose.translation().distance(state.pose.translation())
+        distances.append(distances[-1] + step)
+
+    result = []
+    for fraction, name in markers:
+        distance = fraction * distances[-1]
+        i = min(max(bisect_left(distances, distance), 1), len(distances) - 1)
+
+        # Interpolate linearly between the two states around the marker
+        span = distances[i] - distances[i - 1]
+        frac = (distance - distances[i - 1]) / span if span > 0 else 0.0
+        frac = min(max(frac, 0.0), 1.0)
+        result.append((times[i - 1] + (times[i] - times[i - 1]) * frac, name))
+
+    return sorted(result)
+
+
 class Trajectories:
     """
     Creates a pair of trajectories. Can be used to switch between a trajectory and it's
     mirror when the drive command is run instead of when it is instantiated.
+
+    The event markers are (time, name) pairs, sorted by time. Mirroring a trajectory
+    doesn't change when it passes them, so they're the same for both alliances.
     """
 
-    def __init__(self, trajectory: Trajectory):
+    def __init__(
+        self,
+        trajectory: Trajectory,
+        mirrored: Trajectory = None,
+        markers: Sequence[Tuple[float, str]] = (),
+    ):
         self._blue = trajectory
-        self._red = mirror_trajectory(trajectory)
+        self._red = mirrored if mirrored is not None else mirror_trajectory(trajectory)
+        self.markers: List[Tuple[float, str]] = sorted(markers)
+
+        self._blue_arrays: ArrayTrajectory = None
+        self._red_arrays: ArrayTrajectory = None
 
     @property
     def trajectory(self) -> Trajectory:
@@ -50,70 +311,172 @@ class Trajectories:
             return self._red
         else:
             return self._blue
-        
+
+    @property
+    def arrays(self) -> ArrayTrajectory:
+        """
+        The array-backed copy of the current alliance's trajectory, created once when
+        it's first needed.
+        """
+        if DriverStation.getAlliance() == DriverStation.Alliance.kRed:
+            if self._red_arrays is None:
+                self._red_arrays = ArrayTrajectory(self._red)
+            return self._red_arrays
+        else:
+            if self._blue_arrays is None:
+                self._blue_arrays = ArrayTrajectory(self._blue)
+            return self._blue_arrays
+
     def get_initial_state(self) -> Pose2d:
         return self.trajectory.initialPose()
 
 
-def load_trajectory(name: str, *args, **kwargs) -> Trajectories:
-    return Trajectories(
-        PathPlanner.loadPath(name, *args, **kwargs).asWPILibTrajectory()
-    )
+def load_trajectory(
+    name: str, max_vel: float, max_accel: float, reversed: bool = False
+) -> Trajectories:
+    """
+    Load a PathPlanner path as a pair of Trajectories, along with the times of its
+    event markers. The precompiled trajectory cache is used when it's up to date, so
+    the path (and its markers) is only generated and re-cached if its cache entry is
+    missing or stale. See `cache.py`.
+    """
+    cached = cache.read(name, max_vel, max_accel, reversed)
+
+    if cached is not None:
+        blue, red, markers = cached
+    else:
+        blue = PathPlanner.loadPath(
+            name, max_vel, max_accel, reversed
+        ).asWPILibTrajectory()
+        red = mirror_trajectory(blue)
+        markers = marker_times(blue, load_markers(name))
+        cache.write(name, max_vel, max_accel, reversed, blue, red, markers)
+
+    return Trajectories(blue, red, markers)
 
 
 class DriveTrajectory(CommandBase):
     """
-    Uses a RamseteController to drive along a provided Trajectory, or along
+    Uses a Ramsete controller to drive along a provided Trajectory, or along
     a Trajectory provided by a Trajectories object.
+
+    Commands can be bound to the Trajectories' event markers with `events`. Each one
+    starts as soon as the trajectory's timer passes its marker, runs alongside the
+    drive, and is interrupted if it's still running when the drive ends.
     """
 
-    def __init__(self, robot, trajectory: Trajectories | Trajectory):
+    def __init__(
+        self,
+        robot,
+        trajectory: Union[Trajectories, Trajectory],
+        events: Dict[str, Command] = None,
+    ):
         super().__init__()
         self.robot = robot
 
         self.trajectory = trajectory
 
+        if isinstance(trajectory, Trajectory):
+            self._arrays = ArrayTrajectory(trajectory)
+
         self._timer = Timer()
-        self._controller = RamseteController()
+
+        # Find out about typos in marker names when the route is built
+        self._events = events or {}
+        markers = trajectory.markers if isinstance(trajectory, Trajectories) else []
+        names = {name for _, name in markers}
+
+        for name, command in self._events.items():
+            if name not in names:
+                raise ValueError(f"Trajectory has no event marker named '{name}'")
+
+            self.addRequirements(*command.getRequirements())
+
+        # Only the markers with a command, as parallel arrays of times and commands
+        self._marker_times = array(
+            "d", (time for time, name in markers if name in self._events)
+        )
+        self._marker_commands = [
+            self._events[name] for _, name in markers if name in self._events
+        ]
+        self._next_marker = 0
+        self._active_events: List[Command] = []
+
+        # Whether it's driving, and how far from the end of its trajectory it
+        # finished last time (in m), for tools like simulate_autos.py
+        self.running = False
+        self.pose_error: float = None
 
     def initialize(self):
         if isinstance(self.trajectory, Trajectories):
-            self.trajectory = self.trajectory.trajectory
+            self._arrays = self.trajectory.arrays
 
+        self._arrays.reset()
         self._prev_time = -1
-        initial_state = self.trajectory.sample(0)
-        self._prev_speeds = DRIVE_KINEMATICS.toWheelSpeeds(
-            ChassisSpeeds(
-                initial_state.velocity,
-                0,
-                initial_state.curvature * initial_state.velocity,
-            )
-        )
+        self._next_marker = 0
+        self._active_events.clear()
         self._timer.restart()
 
+        self.running = True
+        self.robot.drivetrain.set_follower(self)
+
+    def _run_events(self, cur_time: float):
+        times = self._marker_times
+
+        while self._next_marker < len(times) and times[self._next_marker] <= cur_time:
+            command = self._marker_commands[self._next_marker]
+            self._next_marker += 1
+
+            if command not in self._active_events:
+                command.initialize()
+                self._active_events.append(command)
+
+        for command in self._active_events[:]:
+            command.execute()
+
+            if command.isFinished():
+                command.end(False)
+                self._active_events.remove(command)
+
     def execute(self):
         cur_time = self._timer.get()
 
+        if self._active_events or self._next_marker < len(self._marker_times):
+            self._run_events(cur_time)
+
         if self._prev_time < 0:
             self.robot.drivetrain.set_wheel_speeds(0, 0)
             self._prev_time = cur_time
             return
 
-        target_whl_spds = DRIVE_KINEMATICS.toWheelSpeeds(
-            self._controller.calculate(
-                self.robot.drivetrain.get_pose(), self.trajectory.sample(cur_time)
-            )
+        pose = self.robot.drivetrain.get_pose()
+        left, right = self._arrays.follow(
+            cur_time, pose.X(), pose.Y(), pose.rotation().radians()
         )
 
-        self.robot.drivetrain.use_wheel_speeds(target_whl_spds)
-        self._prev_speeds = target_whl_spds
+        self.robot.drivetrain.set_wheel_speeds(left, right)
         self._prev_time = cur_time
 
     def end(self, interupt: bool):
         self._timer.stop()
+        self.running = False
+
+        for command in self._active_events:
+            command.end(True)
+        self._active_events.clear()
+
+        pose = self.robot.drivetrain.get_pose()
+        x, y, _, _, _ = self._arrays.sample(self._arrays.total_time())
+        self.pose_error = math.hypot(pose.X() - x, pose.Y() - y)
 
         if interupt:
             self.robot.drivetrain.set_wheel_speeds(0, 0)
 
     def isFinished(self):
-        return self._timer.hasElapsed(self.trajectory.totalTime())
+        return self._timer.hasElapsed(self._arrays.total_time())
+
+    def get_reference(self) -> Tuple[float, float]:
+        """
+        Get the (x, y) the robot should be at right now.
+        """
+        return self._arrays.sample(self._timer.get())[:2]
@@ -10,11 +10,71 @@ in2m = lambda x: x * 0.0254
 FIELD_LENGTH = in2m(54 * 12)
 FIELD_WIDTH = in2m(32 * 12)
 
+# Blue charge station and grid (min x, max x, min y, max y) in meters, mirrored for red
+CHARGE_STATION = (2.92, 4.85, 1.51, 3.98)
+GRID = (0, 1.38, 0, 5.49)
+
+# ----- ROBOT -----
+
+LOOP_PERIOD = 0.02
+
+# Motor controllers are configured in the background. See robot/util/motor_config.py
+CAN_TIMEOUT_MS = 50
+CAN_CONFIG_RETRIES = 3
+
+# Status frame periods (ms) for the signals we read from each device, and for the rest
+# of them, and how often (s) to publish the bus's health. See robot/util/can_bus.py
+CAN_FAST_FRAME_PERIOD = 20
+CAN_SLOW_FRAME_PERIOD = 255
+CAN_MONITOR_PERIOD = 0.5
+
+# Time subsystems, commands and robot callbacks. See robot/util/profiler.py
+PROFILE_LOOP = False
+PROFILE_WINDOW = 500  # durations kept per callable
+PROFILE_PUBLISH_PERIOD = 50  # loops between publishing summaries
+
+# Log a snapshot of the robot every loop. Only on the real robot unless DATALOG_SIM
+# is set, so sim, benchmark and tuning runs don't fill up logs/. See
+# robot/util/datalog.py
+DATALOG_ENABLED = True
+DATALOG_SIM = False
+DATALOG_DIR = "/home/lvuser/logs"  # "logs" in sim
+DATALOG_FLUSH_PERIOD = 0.5
+
+# ----- AUTO -----
+
+# Build the selected auto route while disabled instead of in autonomousInit
+AUTO_PREWARM = True
+
+# Characterization routines in the auto chooser. See robot/auto/sysid.py
+SYSID_ENABLED = False
+SYSID_RAMP_RATE = 0.25  # volts per second, for quasistatic tests
+SYSID_DRIVE_STEP = 7  # volts, for dynamic tests
+SYSID_ARM_STEP = 3
+SYSID_TEST_LENGTH = 10  # seconds
+SYSID_ARM_TRAVEL = 1.5  # radians a joint can move before its test stops
+
+# Trajectories generated on the fly. See robot/auto/navigation.py
+NAV_MAX_VEL = 1.5
+NAV_MAX_ACCEL = 3
+NAV_CLEARANCE = 0.5  # meters from the robot's center to keep from obstacles
+# Start poses are rounded to these, in meters and degrees, so trajectories can be cached
+NAV_POSE_RESOLUTION = 0.1
+NAV_HEADING_RESOLUTION = 10
+NAV_CACHE_SIZE = 64
+# Where the robot's center lines up to score on each of the blue grid's nodes, facing
+# the grid (mirrored for red). Holding the driver's A button drives to the nearest one
+NAV_GRID_X = 1.92
+NAV_GRID_YS = (0.51, 1.07, 1.63, 2.19, 2.75, 3.31, 3.87, 4.42, 4.98)
+
 # ----- CLAW -----
 
 CLAW_CHANNEL = 6
 CLAW_PHOTO = 2
 
+# How long the claw's piston takes to open or close, in seconds
+CLAW_ACTUATION_TIME = 0.15
+
 # ----- DRIVETRAIN -----
 
 DRIVE_LB_MOTOR = 10
@@ -35,8 +95,31 @@ DRIVE_MAX_SPEED = 6
 DRIVE_MAX_ROT_SPEED = 6
 
 DRIVE_PID = {"Kp": 3.1285, "Ki": 0, "Kd": 0}
+# Close the wheel velocity loops on the Talons at 1 kHz, with DRIVE_PID and DRIVE_FF
+# converted to Talon units, instead of in Python every loop
+DRIVE_ONBOARD_PID = True
+# Volts the Talons' output is compensated to, so full output is always the same
+DRIVE_VOLTAGE_COMP = 12
+
+# RamseteController defaults, in meters and radians
+RAMSETE_B = 2.0
+RAMSETE_ZETA = 0.7
 DRIVE_FF = {"kS": 0.50892, "kV": 0.28201, "kA": 1.1083}
 
+# Standard deviations of limelight poses (x, y, heading) in the pose estimator, for
+# one tag up close. See robot/util/localization.py
+VISION_STD_DEVS = (5, 5, 5)
+# How much the std devs grow with the square of the distance to the tags, in 1/m^2
+VISION_DISTANCE_SCALE = 0.1
+# Single tag frames farther than this (meters) are thrown out
+VISION_MAX_DISTANCE = 5
+# Frames farther than this (meters) from the estimate are thrown out, unless this
+# many are in a row, in which case the estimate is probably what's wrong
+VISION_MAX_ERROR = 1
+VISION_MAX_REJECTS = 10
+# Frames waiting to be added to the pose estimator. See robot/util/vision.py
+VISION_QUEUE_SIZE = 8
+
 # ----- ARM ------
 
 LOWER_ARM_MOTOR = 20
@@ -48,9 +131,35 @@ UPPER_ARM_HOME = 1
 LOWER_ARM_ENCODER = 7
 UPPER_ARM_ENCODER = 8
 
+LOWER_ARM_LENGTH = 0.762  # meters
+UPPER_ARM_LENGTH = 0.659
+
+# Geometry the arm can't pass through, in meters from the lower arm's pivot (x) and
+# from the floor (heights). See robot/util/arm_planner.py
+ARM_PIVOT_HEIGHT = 0.57
+ROBOT_FRAME = (-0.45, 0.45, 0.2)  # back, front, top of the bumpers
+ARM_PYLON_HALF_WIDTH = 0.05
+ARM_CLEARANCE = 0.05
+
+# How close (in radians) both joints must be to their setpoints to be at a position,
+# and how slow (in rad/s) they must be moving to have settled there
+ARM_TOLERANCE = 0.05
+ARM_VELOCITY_TOLERANCE = 0.2
+# How long a command waits for the arm to get somewhere before giving up, in seconds
+ARM_MOVE_TIMEOUT = 3
+
+# Moves the arm planner remembers, besides the ones between presets
+ARM_PLAN_CACHE_SIZE = 32
+
 UPPER_ARM_PID = {"Kp": 3, "Ki": 0, "Kd": 0}
 LOWER_ARM_PID = {"Kp": 3, "Ki": 0, "Kd": 0}
 
+# Limits of the arm's motion profiles, in rad/s and rad/s^2
+LOWER_ARM_MAX_VEL = 3
+LOWER_ARM_MAX_ACCEL = 6
+UPPER_ARM_MAX_VEL = 4
+UPPER_ARM_MAX_ACCEL = 8
+
 UPPER_ARM_FF = {"kS": 0.66617, "kG": 0.085621, "kV": 1.944, "kA": 0.046416}
 
 LOWER_ARM_FF = {"kS": 0.38834, "kG": 0.0942, "kV": 2.0427, "kA": 0.23556}
@@ -1,26 +1,80 @@
+import atexit
+from typing import TYPE_CHECKING
+
 from commands2 import TimedCommandRobot
 from commands2.button import CommandXboxController
-from wpilib import SmartDashboard
+from wpilib import RobotBase, SmartDashboard, Timer
 
-from robot.subsystems.arm import Arm, ArmPosition
-from robot.subsystems.drivetrain import Drivetrain
-from robot.subsystems.claw import Claw
 from robot.constants import *
 from robot.auto import AutoSelector
+import robot.util.profiler as profiler
+import robot.util.telemetry as telemetry
+from robot.util.datalog import DataLog
+
+if TYPE_CHECKING:
+    from robot.auto.navigation import Navigator
+    from robot.subsystems.arm import Arm
+    from robot.subsystems.claw import Claw
+    from robot.subsystems.drivetrain import Drivetrain
+
+# fmt: off
+LOG_FIELDS = (
+    "time",
+    "left_pos", "right_pos", "left_vel", "right_vel", "gyro", "level",
+    "left_volts", "right_volts",
+    "lower_setpoint", "upper_setpoint", "lower_pos", "upper_pos",
+    "lower_volts", "upper_volts",
+    "claw_open",
+    "est_x", "est_y", "est_heading", "pose_resets",
+    "vision_frames",
+)
+# fmt: on
+
+# Every limelight frame that arrived in a loop is logged, in this many slots of
+# these fields, so replay.py can add the same frames to the estimator
+VISION_FIELDS = ("time", "x", "y", "yaw", "tags", "distance")
+LOG_FIELDS += tuple(
+    f"vision{i}_{name}" for i in range(VISION_QUEUE_SIZE) for name in VISION_FIELDS
+)
+NO_VISION = (0.0,) * (len(VISION_FIELDS) * VISION_QUEUE_SIZE)
 
 
 class Robot(TimedCommandRobot):
-    arm = Arm()
-    claw = Claw()
-    drivetrain = Drivetrain()
+    """
+    The subsystems and controllers are created in robotInit, not when this module
+    is imported or the robot is constructed, so the slow imports (ctre, rev,
+    pathplannerlib) and all of the hardware are only touched once the robot is
+    actually starting. See `profile_boot.py`.
+    """
+
+    arm: "Arm" = None
+    claw: "Claw" = None
+    drivetrain: "Drivetrain" = None
 
-    driver = CommandXboxController(0)
-    aux = CommandXboxController(1)
+    navigator: "Navigator" = None
+
+    driver: CommandXboxController = None
+    aux: CommandXboxController = None
 
     _auto_cmd: None = None
+    _datalog: DataLog = None
+
+    def robotInit(self):
+        from robot.auto.navigation import DriveToPose, Navigator, nearest_grid_node
+        from robot.subsystems.arm import Arm, ArmPosition
+        from robot.util.can_bus import CANMonitor
+        from robot.subsystems.claw import Claw
+        from robot.subsystems.drivetrain import Drivetrain
 
-    def __init__(self):
-        super().__init__()
+        self.arm = Arm()
+        self.claw = Claw()
+        self.drivetrain = Drivetrain()
+
+        # Builds the navigation graph now, instead of the first time it's needed
+        self.navigator = Navigator()
+
+        self.driver = CommandXboxController(0)
+        self.aux = CommandXboxController(1)
 
         # Why no RobotContainer? Because it's unneeded boilerplate - Patrick
 
@@ -40,14 +94,81 @@ class Robot(TimedCommandRobot):
             self.drivetrain.arcade_drive(self.driver.getLeftY, self.driver.getRightX)
         )
 
+        # Line up to score on the nearest grid node, for as long as A is held
+        self.driver.A().whileTrue(
+            DriveToPose(self, lambda: nearest_grid_node(self.drivetrain.get_pose()))
+        )
+
         SmartDashboard.putData("auto", AutoSelector(self))
 
+        for subsystem in (self.arm, self.claw, self.drivetrain):
+            profiler.instrument(subsystem)
+
+        self._run_scheduler = profiler.timed(
+            super().robotPeriodic, "CommandScheduler.run"
+        )
+        self._flush_telemetry = profiler.timed(telemetry.flush, "telemetry.flush")
+        self._can_monitor = CANMonitor()
+
+        if DATALOG_ENABLED and (RobotBase.isReal() or DATALOG_SIM):
+            self._datalog = DataLog(
+                LOG_FIELDS,
+                DATALOG_DIR if RobotBase.isReal() else "logs",
+                flush_period=DATALOG_FLUSH_PERIOD,
+            )
+            # Records the writer couldn't keep up with, which are lost
+            self._datalog_dropped = telemetry.number("Dropped", table="DataLog")
+            # Otherwise the writer thread dies with the process, and takes whatever
+            # it hadn't written yet with it
+            atexit.register(self._datalog.close)
+
+    def robotPeriodic(self):
+        self._run_scheduler()
+        self._can_monitor.update()
+
+        if self._datalog is not None:
+            self._log_snapshot()
+            self._datalog_dropped.set(self._datalog.dropped)
+
+        self._flush_telemetry()
+        profiler.end_loop()
+
+    @profiler.timed
+    def _log_snapshot(self):
+        pose = self.drivetrain.get_pose()
+        # The queue never holds more than this, but the record has to fit
+        frames = self.drivetrain.get_vision_frames()[:VISION_QUEUE_SIZE]
+
+        self._datalog.append(
+            Timer.getFPGATimestamp(),
+            self.drivetrain.get_left_encoder_pos(),
+            self.drivetrain.get_right_encoder_pos(),
+            self.drivetrain.get_left_encoder_vel(),
+            self.drivetrain.get_right_encoder_vel(),
+            self.drivetrain.get_gyro_heading(),
+            self.drivetrain.get_level_heading(),
+            *self.drivetrain.get_volts(),
+            *self.arm.get_setpoints(),
+            self.arm.get_lower_position(),
+            self.arm.get_upper_position(),
+            *self.arm.get_volts(),
+            self.claw.is_open(),
+            pose.X(),
+            pose.Y(),
+            pose.rotation().radians(),
+            self.drivetrain.get_pose_resets(),
+            len(frames),
+            *(value for frame in frames for value in frame),
+            *NO_VISION[len(frames) * len(VISION_FIELDS) :],
+        )
+
+    @profiler.timed
     def teleopInit(self):
         if self._auto_cmd is not None:
             self._auto_cmd.cancel()
-        self.drivetrain.set_wheel_speeds(0, 0) 
-
+        self.drivetrain.set_wheel_speeds(0, 0)
 
+    @profiler.timed
     def autonomousInit(self):
         self._auto_cmd = AutoSelector.get_selected()
         self.drivetrain.set_wheel_speeds(0, 0)
@@ -57,6 +178,7 @@ class Robot(TimedCommandRobot):
         else:
             print("NO AUTO ROUTE SELECTED")
 
+    @profiler.timed
     def disabledInit(self) -> None:
         if self._auto_cmd is not None:
             self._auto_cmd.cancel()
@@ -64,3 +186,8 @@ class Robot(TimedCommandRobot):
         # added after the robot punched a locker after re-enabling autonomous
         # always remember the turn OFF the motors if you want it to stay still
         self.drivetrain.set_wheel_speeds(0, 0)
+
+    @profiler.timed
+    def disabledPeriodic(self) -> None:
+        if AUTO_PREWARM:
+            AutoSelector.prewarm()
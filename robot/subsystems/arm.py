@@ -1,5 +1,6 @@
 import math
-from typing import Tuple
+from concurrent.futures import Future
+from typing import List, Optional, Tuple, Union
 
 from wpilib import (
     Color8Bit,
@@ -7,13 +8,24 @@ from wpilib import (
     DutyCycleEncoder,
     Mechanism2d,
     SmartDashboard,
+    Timer,
+    reportWarning,
 )
-from commands2 import SubsystemBase
+from commands2 import Command, CommandScheduler, SubsystemBase
+from commands2.cmd import runOnce, waitUntil
 from wpimath.controller import ArmFeedforward, PIDController
 from rev import CANSparkMax
 
 from robot.constants import *
 import robot.util.cmd as cmd
+from robot.util.motion import CoordinatedProfile, FeedforwardTable
+import robot.util.arm_kinematics as arm_kinematics
+import robot.util.arm_planner as arm_planner
+from robot.util.arm_kinematics import ClawTarget
+import robot.util.telemetry as telemetry
+import robot.util.motor_config as motor_config
+from robot.util.motor_config import SparkMaxConfig
+from robot.util.can_bus import spark_max_frames
 
 
 class ArmPosition:
@@ -30,6 +42,15 @@ class ArmPosition:
     BACK = (5.407518, 2.951937)
 
 
+class ArmInputs:
+    """
+    Snapshot of every arm sensor, sampled once at the start of each loop so
+    everything in a loop sees the same values.
+    """
+
+    __slots__ = ("time", "lower_pos", "upper_pos", "lower_home", "upper_home")
+
+
 class Arm(SubsystemBase):
     """
     The Arm subsystem
@@ -38,31 +59,83 @@ class Arm(SubsystemBase):
     _lower_setpoint: float = ArmPosition.HOME[0]
     _upper_setpoint: float = ArmPosition.HOME[1]
 
-    _lower_motor = CANSparkMax(LOWER_ARM_MOTOR, CANSparkMax.MotorType.kBrushless)
+    _lower_volts: float = 0
+    _upper_volts: float = 0
 
-    _lower_ff = ArmFeedforward(**LOWER_ARM_FF)
+    # Voltages to drive the motors at directly, instead of to the setpoints
+    _lower_override: float = None
+    _upper_override: float = None
+
+    _lower_motor: CANSparkMax
+
+    _lower_ff = FeedforwardTable(
+        ArmFeedforward(**LOWER_ARM_FF), LOWER_ARM_FF["kA"], LOWER_ARM_MAX_VEL
+    )
     _lower_con = PIDController(**LOWER_ARM_PID)
 
-    _upper_motor = CANSparkMax(UPPER_ARM_MOTOR, CANSparkMax.MotorType.kBrushless)
+    _upper_motor: CANSparkMax
 
-    _upper_ff = ArmFeedforward(**UPPER_ARM_FF)
+    _upper_ff = FeedforwardTable(
+        ArmFeedforward(**UPPER_ARM_FF), UPPER_ARM_FF["kA"], UPPER_ARM_MAX_VEL
+    )
     _upper_con = PIDController(**UPPER_ARM_PID)
 
-    _lower_home = DigitalInput(LOWER_ARM_HOME)
-    _upper_home = DigitalInput(UPPER_ARM_HOME)
+    _lower_home: DigitalInput
+    _upper_home: DigitalInput
 
-    _lower_enc = DutyCycleEncoder(LOWER_ARM_ENCODER)
-    _upper_enc = DutyCycleEncoder(UPPER_ARM_ENCODER)
+    _lower_enc: DutyCycleEncoder
+    _upper_enc: DutyCycleEncoder
 
-    def __init__(self):
-        self._lower_motor.restoreFactoryDefaults()
-        self._upper_motor.restoreFactoryDefaults()
+    _inputs: ArmInputs
 
-        self._lower_motor.setIdleMode(CANSparkMax.IdleMode.kBrake)
-        self._upper_motor.setIdleMode(CANSparkMax.IdleMode.kBrake)
+    _profile = CoordinatedProfile(ArmPosition.HOME, ArmPosition.HOME, (0, 0), (0, 0))
+    _profile_start: float = 0
 
-        self._lower_motor.setInverted(True)
-        self._upper_motor.setInverted(True)
+    # Setpoints the current plan goes to, and the waypoints left after this profile
+    _planned_goal: Optional[Tuple[float, float]] = ArmPosition.HOME
+    _waypoints: List[Tuple[float, float]]
+    # Whether there's no collision-free way to the planned goal
+    _plan_failed: bool = False
+
+    # A plan being made in the background, the setpoints it goes to, and where the
+    # arm is holding until it's ready
+    _pending: Optional[Future] = None
+    _pending_goal: Optional[Tuple[float, float]] = None
+    _plan_start: Tuple[float, float] = ArmPosition.HOME
+
+    def __init__(self):
+        # The hardware is created here instead of with the class, so just importing
+        # this module doesn't touch any devices
+        kBrushless = CANSparkMax.MotorType.kBrushless
+        self._lower_motor = CANSparkMax(LOWER_ARM_MOTOR, kBrushless)
+        self._upper_motor = CANSparkMax(UPPER_ARM_MOTOR, kBrushless)
+
+        self._lower_home = DigitalInput(LOWER_ARM_HOME)
+        self._upper_home = DigitalInput(UPPER_ARM_HOME)
+
+        self._lower_enc = DutyCycleEncoder(LOWER_ARM_ENCODER)
+        self._upper_enc = DutyCycleEncoder(UPPER_ARM_ENCODER)
+
+        self._inputs = ArmInputs()
+        self._waypoints = []
+
+        self._lower_con.setTolerance(ARM_TOLERANCE, ARM_VELOCITY_TOLERANCE)
+        self._upper_con.setTolerance(ARM_TOLERANCE, ARM_VELOCITY_TOLERANCE)
+
+        # Configured in the background, see robot/util/motor_config.py. Nothing is
+        # read from the motors, since the joints have their own absolute encoders
+        self._motor_config = motor_config.configure(
+            SparkMaxConfig(
+                self._lower_motor,
+                inverted=True,
+                periodic_frames=spark_max_frames(),
+            ),
+            SparkMaxConfig(
+                self._upper_motor,
+                inverted=True,
+                periodic_frames=spark_max_frames(),
+            ),
+        )
 
         self._mech_2d = Mechanism2d(100, 60)
 
@@ -73,17 +146,104 @@ class Arm(SubsystemBase):
 
         SmartDashboard.putData("ArmView", self._mech_2d)
 
+        self._lower_view = telemetry.register(self._mech_lower.setAngle, deadband=0.1)
+        self._upper_view = telemetry.register(self._mech_upper.setAngle, deadband=0.1)
+
+        self.sample_inputs()
+
+        # Memory map the IK grid now instead of on the first ClawTarget
+        arm_kinematics.get_grid()
+
+        # Start planning the moves between presets now, so they're lookups later
+        presets = (value for name, value in vars(ArmPosition).items() if name.isupper())
+        self._planner = arm_planner.get_planner()
+        self._planner.precompute(presets)
+
         super().__init__()
 
     @cmd.run_once
-    def set_position(self, pos: Tuple[float, float]):
+    def set_position(self, pos: Union[Tuple[float, float], ClawTarget]):
         """
         Set the position, or setpoint of the arm, using a tuple: (lower, upper)
+        or a ClawTarget: (x, z) of the claw, in meters from the lower arm's pivot
         """
+        if isinstance(pos, ClawTarget):
+            joints = arm_kinematics.get_grid().lookup(pos.x, pos.z)
+
+            if joints is None:
+                reportWarning(f"Arm can't reach {pos}", False)
+                return
+
+            pos = joints
 
         self._lower_setpoint = pos[0]
         self._upper_setpoint = pos[1]
 
+    def move_to(
+        self,
+        pos: Union[Tuple[float, float], ClawTarget],
+        timeout: float = ARM_MOVE_TIMEOUT,
+    ) -> Command:
+        """
+        Set the position of the arm, like `set_position`, but finish once the arm is
+        there, or after `timeout` seconds. See `wait_for_position`.
+        """
+        return self.set_position(pos).andThen(self.wait_for_position(timeout))
+
+    def wait_for_position(self, timeout: float = ARM_MOVE_TIMEOUT) -> Command:
+        """
+        Wait until the arm is at its setpoints, or for `timeout` seconds. If there's
+        no collision-free way to its setpoints, whatever is using the arm (like an
+        auto route) is interrupted instead, so it doesn't carry on as if it got there.
+        """
+        return (
+            waitUntil(lambda: self.at_position() or self.plan_failed())
+            .withTimeout(timeout)
+            .andThen(runOnce(self._interrupt_if_failed))
+        )
+
+    def _interrupt_if_failed(self):
+        if not self.plan_failed():
+            return
+
+        command = CommandScheduler.getInstance().requiring(self)
+        if command is not None:
+            command.cancel()
+
+    def at_position(self) -> bool:
+        """
+        Whether the arm has finished moving to its setpoints, with both joints
+        within tolerance of them and settled, by their PID controllers' position
+        and velocity errors.
+        """
+        return (
+            self._planned_goal == (self._lower_setpoint, self._upper_setpoint)
+            and self._pending is None
+            and not self._plan_failed
+            and not self._waypoints
+            and self._inputs.time - self._profile_start >= self._profile.total
+            and self._lower_con.atSetpoint()
+            and self._upper_con.atSetpoint()
+        )
+
+    def plan_failed(self) -> bool:
+        """
+        Whether there's no collision-free way to the arm's setpoints, so it's holding
+        where it was instead.
+        """
+        return self._plan_failed and self._planned_goal == (
+            self._lower_setpoint,
+            self._upper_setpoint,
+        )
+
+    def get_claw_position(self) -> ClawTarget:
+        """
+        Get the (x, z) position of the claw, in meters from the lower arm's pivot
+        """
+        return arm_kinematics.forward(
+            self.get_lower_position(), self.get_upper_position()
+        )
+
     @cmd.run
     def bump_lower_position(self, bump: float):
         """
@@ -100,52 +260,233 @@ class Arm(SubsystemBase):
         """
         self._upper_setpoint += bump
 
+    def set_volts(self, lower: float = None, upper: float = None):
+        """
+        Drive the motors at fixed voltages instead of to the setpoints, like for
+        characterization. A joint given None goes back to being controlled, holding
+        wherever it was left.
+        """
+        released = False
+
+        if self._lower_override is not None and lower is None:
+            self._lower_setpoint = self.get_lower_position()
+            released = True
+
+        if self._upper_override is not None and upper is None:
+            self._upper_setpoint = self.get_upper_position()
+            released = True
+
+        if released:
+            # The old profile ended wherever the arm was before, so replan from where
+            # it is now, and forget the error the PIDs built up in the meantime
+            self._planned_goal = None
+            if self._pending is not None:
+                self._pending.cancel()
+                self._pending = None
+            self._profile_start = -math.inf
+            self._lower_con.reset()
+            self._upper_con.reset()
+
+        self._lower_override = lower
+        self._upper_override = upper
+
     def get_lower_position(self) -> float:
         """
         Get the position of the lower arm in Radians
         """
-        return self._lower_enc.getAbsolutePosition() * (2 * math.pi)
+        return self._inputs.lower_pos
 
     def get_upper_position(self) -> float:
         """
         Get the position of the upper arm in Radians
         """
-        return self._upper_enc.getAbsolutePosition() * (2 * math.pi)
+        return self._inputs.upper_pos
+
+    def get_setpoints(self) -> Tuple[float, float]:
+        """
+        Get the (lower, upper) setpoints of the arm in Radians
+        """
+        return self._lower_setpoint, self._upper_setpoint
+
+    def get_volts(self) -> Tuple[float, float]:
+        """
+        Get the last (lower, upper) voltages sent to the motors
+        """
+        return self._lower_volts, self._upper_volts
+
+    def is_ready(self) -> bool:
+        """
+        Whether the motors have finished being configured, and were all verified.
+        Motors that failed to configure are never driven, since they might not be
+        inverted or current limited properly.
+        """
+        return self._motor_config.ok()
 
     def is_lower_home(self) -> bool:
         """
         Get the value of the lower limit switch
         """
-        return self._lower_home.get()
+        return self._inputs.lower_home
 
     def is_upper_home(self) -> bool:
         """
         Get the value of the upper limit switch
         """
-        return self._upper_home.get()
+        return self._inputs.upper_home
+
+    def sample_inputs(self):
+        """
+        Read every sensor into the inputs snapshot. Called at the start of periodic,
+        and everything else reads from the snapshot.
+        """
+        inputs = self._inputs
+
+        inputs.time = Timer.getFPGATimestamp()
+        inputs.lower_pos = self._lower_enc.getAbsolutePosition() * (2 * math.pi)
+        inputs.upper_pos = self._upper_enc.getAbsolutePosition() * (2 * math.pi)
+        inputs.lower_home = self._lower_home.get()
+        inputs.upper_home = self._upper_home.get()
+
+    @staticmethod
+    def _make_profile(start, goal) -> CoordinatedProfile:
+        return CoordinatedProfile(
+            start,
+            goal,
+            (LOWER_ARM_MAX_VEL, UPPER_ARM_MAX_VEL),
+            (LOWER_ARM_MAX_ACCEL, UPPER_ARM_MAX_ACCEL),
+        )
+
+    def _request_plan(self, now: float):
+        """
+        Start planning a collision-free path to the current setpoints, from where the
+        arm is now. It holds there until the plan is ready, see `_start_plan`.
+        """
+        if self._pending is not None:
+            # Already holding for another plan, so start from there instead, and don't
+            # bother making that plan if it hasn't been started yet
+            self._pending.cancel()
+            start = self._plan_start
+        elif now - self._profile_start < self._profile.total:
+            # Already moving, so start from where it's supposed to be
+            t = now - self._profile_start
+            start = (self._profile.sample(t, 0)[0], self._profile.sample(t, 1)[0])
+        else:
+            start = (self.get_lower_position(), self.get_upper_position())
+
+        goal = (self._lower_setpoint, self._upper_setpoint)
+
+        self._profile = self._make_profile(start, start)
+        self._profile_start = now
+        self._waypoints = []
+
+        self._plan_start = start
+        self._pending_goal = goal
+        self._pending = self._planner.request(start, goal)
+
+    def _start_plan(self, now: float):
+        """
+        Start profiling to the first waypoint of the plan that was just made.
+        """
+        pending, goal = self._pending, self._pending_goal
+        self._pending = self._pending_goal = None
+
+        error = pending.exception()
+        waypoints = pending.result() if error is None else None
+
+        self._planned_goal = goal
+        self._plan_failed = waypoints is None
+
+        if waypoints is None:
+            # Going straight there would hit something, so keep holding where it is.
+            # The setpoints are left alone, so whatever asked for them can tell
+            reportWarning(
+                f"Arm can't get to {goal} without colliding"
+                + (f": {error}" if error is not None else ""),
+                False,
+            )
+            return
+
+        self._profile = self._make_profile(self._plan_start, waypoints[0])
+        self._profile_start = now
+        self._waypoints = waypoints[1:]
+
+    def get_arrival_time(self) -> float:
+        """
+        Get how long until the profiled setpoints reach the current setpoints, in
+        seconds. Both joints arrive at the same time. It's infinite while there's no
+        plan to the setpoints yet, or if there can't be.
+        """
+        if self._pending is not None or self.plan_failed():
+            return math.inf
+
+        now = self._inputs.time
+        remaining = max(0.0, self._profile_start + self._profile.total - now)
+
+        start = self._profile.goal
+        for waypoint in self._waypoints:
+            remaining += self._make_profile(start, waypoint).total
+            start = waypoint
+
+        return remaining
 
     def periodic(self):
-        lower_out = -self._lower_con.calculate(
-            self.get_lower_position(), self._lower_setpoint
+        self.sample_inputs()
+        now = self._inputs.time
+
+        goal = (self._lower_setpoint, self._upper_setpoint)
+        wanted = self._planned_goal if self._pending is None else self._pending_goal
+
+        if goal != wanted:
+            self._request_plan(now)
+
+        if self._pending is not None:
+            # Straight moves and moves between presets are ready right away
+            if self._pending.done():
+                self._start_plan(now)
+        elif self._waypoints and now - self._profile_start >= self._profile.total:
+            # Reached a waypoint, so go on to the next one
+            self._profile = self._make_profile(self._profile.goal, self._waypoints[0])
+            self._profile_start = now
+            self._waypoints = self._waypoints[1:]
+
+        t = now - self._profile_start
+        lower_sp, lower_vel, lower_accel = self._profile.sample(t, 0)
+        upper_sp, upper_vel, upper_accel = self._profile.sample(t, 1)
+
+        lower_out = -self._lower_con.calculate(self.get_lower_position(), lower_sp)
+        upper_out = -self._upper_con.calculate(self.get_upper_position(), upper_sp)
+
+        # Like the PID output, the motors move opposite to the encoders, so the
+        # velocity and acceleration are negated for the feedforward
+        lower_v = lower_out + self._lower_ff.calculate(
+            lower_sp, -lower_vel, -lower_accel
         )
-        upper_out = -self._upper_con.calculate(
-            self.get_upper_position(), self._upper_setpoint
+        upper_v = upper_out + self._upper_ff.calculate(
+            upper_sp, -upper_vel, -upper_accel
         )
 
-        lower_v = lower_out + self._lower_ff.calculate(self._lower_con.getSetpoint(), 0)
+        if self._lower_override is not None:
+            lower_v = lower_out = self._lower_override
 
-        upper_v = upper_out + self._upper_ff.calculate(self._upper_con.getSetpoint(), 0)
+        if self._upper_override is not None:
+            upper_v = upper_out = self._upper_override
 
         if self.is_lower_home() and lower_out < 0.1:
-            self._lower_motor.setVoltage(0)
-        else:
-            self._lower_motor.setVoltage(lower_v)
+            lower_v = 0
 
         if self.is_upper_home() and upper_out < 0.1:
-            self._upper_motor.setVoltage(0)
-        else:
-            self._upper_motor.setVoltage(upper_v)
+            upper_v = 0
+
+        # Don't drive motors that aren't (or never will be) configured properly
+        if not self.is_ready():
+            lower_v = upper_v = 0
+
+        self._lower_volts = lower_v
+        self._upper_volts = upper_v
+
+        self._lower_motor.setVoltage(lower_v)
+        self._upper_motor.setVoltage(upper_v)
 
         # Output to Glass ArmView widget
-        self._mech_lower.setAngle(238 + math.degrees(self.get_lower_position()))
-        self._mech_upper.setAngle(180 - math.degrees(self.get_upper_position()))
+        self._lower_view.set(238 + math.degrees(self.get_lower_position()))
+        self._upper_view.set(180 - math.degrees(self.get_upper_position()))
@@ -1,29 +1,65 @@
-from commands2 import SubsystemBase
-from wpilib import Solenoid, PneumaticsModuleType, DigitalInput
+import math
+
+from commands2 import Command, SubsystemBase
+from commands2.cmd import waitUntil
+from wpilib import Solenoid, PneumaticsModuleType, DigitalInput, Timer
 
 from robot.constants import *
 import robot.util.cmd as cmd
 
 
 class Claw(SubsystemBase):
-    _solenoid = Solenoid(PneumaticsModuleType.CTREPCM, CLAW_CHANNEL)
-    _photosensor = DigitalInput(CLAW_PHOTO)
+    _solenoid: Solenoid
+    _photosensor: DigitalInput
+
+    # When the solenoid last changed, to model when the piston is done moving
+    _changed_at: float = -math.inf
 
     def __init__(self):
         super().__init__()
+
+        self._solenoid = Solenoid(PneumaticsModuleType.CTREPCM, CLAW_CHANNEL)
+        self._photosensor = DigitalInput(CLAW_PHOTO)
+
         self._solenoid.set(False)
 
+    def _set(self, open: bool):
+        if self._solenoid.get() != open:
+            self._solenoid.set(open)
+            self._changed_at = Timer.getFPGATimestamp()
+
     @cmd.run_once
     def toggle(self):
-        self._solenoid.toggle()
+        self._set(not self._solenoid.get())
 
     @cmd.run_once
-    def close(self):
-        self._solenoid.set(False)
+    def _actuate(self, open: bool):
+        self._set(open)
 
-    @cmd.run_once
-    def open(self):
-        self._solenoid.set(True)
+    def close(self) -> Command:
+        """
+        Close the claw, finishing once it's had time to close. Finishes right away if
+        it's already closed.
+        """
+        return self._actuate(False).andThen(waitUntil(self.is_actuated))
+
+    def open(self) -> Command:
+        """
+        Open the claw, finishing once it's had time to open. Finishes right away if
+        it's already open.
+        """
+        return self._actuate(True).andThen(waitUntil(self.is_actuated))
+
+    def is_open(self) -> bool:
+        return self._solenoid.get()
+
+    def is_actuated(self) -> bool:
+        """
+        Whether the piston has had time to finish moving since the claw last opened
+        or closed. There's no sensor on the piston, so this goes by
+        `CLAW_ACTUATION_TIME`.
+        """
+        return Timer.getFPGATimestamp() - self._changed_at >= CLAW_ACTUATION_TIME
 
     def get_photosensor(self) -> bool:
         return self._photosensor.get()
@@ -1,4 +1,4 @@
-from typing import Callable
+from typing import Callable, List, Tuple
 from ntcore import NetworkTable, NetworkTableInstance
 
 import wpimath
@@ -8,86 +8,189 @@ from wpimath.geometry import Rotation2d, Pose2d
 from wpimath.estimator import DifferentialDrivePoseEstimator
 from wpimath.kinematics import DifferentialDriveWheelSpeeds, ChassisSpeeds
 from ctre import (
-    NeutralMode,
-    FeedbackDevice,
+    ControlMode,
+    DemandType,
     InvertType,
+    SlotConfiguration,
     WPI_TalonFX,
     StatorCurrentLimitConfiguration,
+    TalonFXFeedbackDevice,
 )
 from commands2 import SubsystemBase
 
 from robot.constants import *
 import robot.util.cmd as cmd
+import robot.util.telemetry as telemetry
+import robot.util.motor_config as motor_config
+from robot.util.motor_config import TalonFXConfig
+from robot.util.can_bus import talon_fx_frames
+from robot.util.localization import (
+    VisionFilter,
+    VisionFrame,
+    make_pose_estimator,
+    update_pose_estimator,
+)
+from robot.util.vision import VisionQueue
+
+# Wheel speed in m/s of one Talon FX velocity unit (sensor counts per 100 ms)
+TALON_VEL_UNIT = 10 / DRIVE_ENC_CPR * DRIVE_GEARBOX * DRIVE_ENC_DPR
+
+
+def talon_velocity_gains(pid: dict) -> SlotConfiguration:
+    """
+    Convert velocity PID gains in volts and m/s, like DRIVE_PID, to a Talon FX slot.
+    The Talon's output is 1023 at DRIVE_VOLTAGE_COMP volts, its error is in velocity
+    units, and its loop runs every millisecond, so the integral and derivative are
+    per millisecond instead of per second.
+    """
+    scale = 1023 / DRIVE_VOLTAGE_COMP * TALON_VEL_UNIT
+
+    slot = SlotConfiguration()
+    slot.kP = pid["Kp"] * scale
+    slot.kI = pid["Ki"] * scale * 0.001
+    slot.kD = pid["Kd"] * scale / 0.001
+    slot.kF = 0
+
+    return slot
+
+
+class DrivetrainInputs:
+    """
+    Snapshot of every drivetrain sensor, sampled once at the start of each loop so
+    they're only read over CAN once, and everything in a loop sees the same values.
+    """
+
+    # fmt: off
+    __slots__ = (
+        "time", "left_pos", "right_pos", "left_vel", "right_vel",
+        "gyro_heading", "gyro_rotation", "level_heading",
+    )
+    # fmt: on
 
 
 class Drivetrain(SubsystemBase):
-    _gyro = ADXRS450_Gyro(SPI.Port.kOnboardCS0)
-    _level = AnalogGyro(0)
+    _gyro: ADXRS450_Gyro
+    _level: AnalogGyro
 
-    _left_motor = WPI_TalonFX(DRIVE_LB_MOTOR)
-    _left_follower = WPI_TalonFX(DRIVE_LF_MOTOR)
+    _left_motor: WPI_TalonFX
+    _left_follower: WPI_TalonFX
 
-    _right_motor = WPI_TalonFX(DRIVE_RB_MOTOR)
-    _right_follower = WPI_TalonFX(DRIVE_RF_MOTOR)
+    _right_motor: WPI_TalonFX
+    _right_follower: WPI_TalonFX
 
     _left_controller = PIDController(**DRIVE_PID)
     _right_controller = PIDController(**DRIVE_PID)
 
     _ff = SimpleMotorFeedforwardMeters(**DRIVE_FF)
 
-    _pose_estimator: DifferentialDrivePoseEstimator
-    _field = Field2d()
-    _limelight: NetworkTable = NetworkTableInstance.getDefault().getTable("limelight")
+    _left_volts: float = 0
+    _right_volts: float = 0
 
-    def __init__(self):
-        super().__init__()
+    _pose_resets: int = 0
+
+    # The last DriveTrajectory to drive the robot. See robot/auto/trajectory.py
+    _follower: "DriveTrajectory" = None
+
+    # Whether set_wheel_speeds closes the loop on the Talons or in Python
+    _onboard_pid: bool = DRIVE_ONBOARD_PID
 
-        # This is a lot of config methods, there's sure to be a better way
+    # Every limelight frame that arrived this loop, oldest first
+    _vision_frames: List[VisionFrame]
 
-        self._left_motor.configFactoryDefault()
-        self._left_follower.configFactoryDefault()
-        self._right_motor.configFactoryDefault()
-        self._right_follower.configFactoryDefault()
+    _inputs: DrivetrainInputs
 
-        self._left_motor.setNeutralMode(NeutralMode.Brake)
-        self._left_follower.setNeutralMode(NeutralMode.Brake)
-        self._right_motor.setNeutralMode(NeutralMode.Brake)
-        self._right_follower.setNeutralMode(NeutralMode.Brake)
+    _pose_estimator: DifferentialDrivePoseEstimator
+    _field: Field2d
+    _limelight: NetworkTable
+    _vision: VisionQueue
+    _vision_filter: VisionFilter
+
+    def __init__(self):
+        super().__init__()
 
-        self._left_follower.follow(self._left_motor)
-        self._right_follower.follow(self._right_motor)
+        self._inputs = DrivetrainInputs()
+        self._vision_frames = []
+        self._vision_filter = VisionFilter()
 
-        self._left_follower.setSensorPhase(False)
-        self._right_follower.setSensorPhase(False)
+        self._gyro = ADXRS450_Gyro(SPI.Port.kOnboardCS0)
+        self._level = AnalogGyro(0)
 
-        self._left_motor.setInverted(False)
-        self._right_motor.setInverted(True)
+        self._left_motor = WPI_TalonFX(DRIVE_LB_MOTOR)
+        self._left_follower = WPI_TalonFX(DRIVE_LF_MOTOR)
 
-        self._left_follower.setInverted(InvertType.FollowMaster)
-        self._right_follower.setInverted(InvertType.FollowMaster)
+        self._right_motor = WPI_TalonFX(DRIVE_RB_MOTOR)
+        self._right_follower = WPI_TalonFX(DRIVE_RF_MOTOR)
 
-        self._left_motor.configSelectedFeedbackSensor(FeedbackDevice.IntegratedSensor)
-        self._right_motor.configSelectedFeedbackSensor(FeedbackDevice.IntegratedSensor)
+        self._field = Field2d()
+        self._limelight = NetworkTableInstance.getDefault().getTable("limelight")
 
         cur_limit = StatorCurrentLimitConfiguration(True, 100, 100, 0)
+        velocity_gains = talon_velocity_gains(DRIVE_PID)
+
+        # Only the leaders' sensors and applied voltages are read, nothing from the
+        # followers
+        leader_frames = talon_fx_frames("output", "sensor")
+
+        # Configured in the background, see robot/util/motor_config.py
+        self._motor_config = motor_config.configure(
+            TalonFXConfig(
+                self._left_motor,
+                inverted=False,
+                stator_limit=cur_limit,
+                feedback=TalonFXFeedbackDevice.IntegratedSensor,
+                slot0=velocity_gains,
+                voltage_comp=DRIVE_VOLTAGE_COMP,
+                status_frames=leader_frames,
+            ),
+            TalonFXConfig(
+                self._right_motor,
+                inverted=True,
+                stator_limit=cur_limit,
+                feedback=TalonFXFeedbackDevice.IntegratedSensor,
+                slot0=velocity_gains,
+                voltage_comp=DRIVE_VOLTAGE_COMP,
+                status_frames=leader_frames,
+            ),
+            TalonFXConfig(
+                self._left_follower,
+                inverted=InvertType.FollowMaster,
+                stator_limit=cur_limit,
+                follow=self._left_motor,
+                sensor_phase=False,
+                status_frames=talon_fx_frames(),
+            ),
+            TalonFXConfig(
+                self._right_follower,
+                inverted=InvertType.FollowMaster,
+                stator_limit=cur_limit,
+                follow=self._right_motor,
+                sensor_phase=False,
+                status_frames=talon_fx_frames(),
+            ),
+        )
 
-        self._left_motor.configStatorCurrentLimit(cur_limit)
-        self._right_motor.configStatorCurrentLimit(cur_limit)
-        self._right_follower.configStatorCurrentLimit(cur_limit)
-        self._left_follower.configStatorCurrentLimit(cur_limit)
+        self.sample_inputs()
 
-        self._pose_estimator = DifferentialDrivePoseEstimator(
-            DRIVE_KINEMATICS,
+        self._pose_estimator = make_pose_estimator(
             self.get_gyro_rotation(),
             self.get_left_encoder_pos(),
             self.get_right_encoder_pos(),
-            Pose2d(),
         )
 
-        self._pose_estimator.setVisionMeasurementStdDevs((5, 5, 5))
+        # Frames arrive in the background, see robot/util/vision.py
+        self._vision = VisionQueue(self._limelight)
 
         SmartDashboard.putData(self._field)
 
+        # Published as (x, y, degrees)
+        self._field_pose = telemetry.register(
+            lambda pose: self._field.setRobotPose(
+                pose[0], pose[1], Rotation2d.fromDegrees(pose[2])
+            ),
+            deadband=0.005,
+            period=0.05,
+        )
+
     def calibrate_gyro(self):
         self._gyro.calibrate()
         self._level.calibrate()
@@ -97,17 +200,17 @@ class Drivetrain(SubsystemBase):
         self._right_motor.setSelectedSensorPosition(0)
 
     def get_gyro_heading(self) -> float:
-        return self._gyro.getAngle()
+        return self._inputs.gyro_heading
 
     @cmd.run_once
     def reset_level(self):
         self._level.reset()
 
     def get_level_heading(self) -> float:
-        return self._level.getAngle()
+        return self._inputs.level_heading
 
     def get_gyro_rotation(self) -> Rotation2d:
-        return self._gyro.getRotation2d()
+        return self._inputs.gyro_rotation
 
     def talon_to_meters(self, rotations: float):
         wheel_rot = rotations * DRIVE_GEARBOX
@@ -115,40 +218,122 @@ class Drivetrain(SubsystemBase):
         return pos_mtrs
 
     def get_left_encoder_vel(self) -> float:
-        return self.talon_to_meters(
-            self._left_motor.getSelectedSensorVelocity() / DRIVE_ENC_CPR * 10
-        )
+        return self._inputs.left_vel
 
     def get_right_encoder_vel(self) -> float:
-        return self.talon_to_meters(
-            self._right_motor.getSelectedSensorVelocity() / DRIVE_ENC_CPR * 10
-        )
+        return self._inputs.right_vel
 
     def get_left_encoder_pos(self) -> float:
-        return self.talon_to_meters(
-            self._left_motor.getSelectedSensorPosition() / DRIVE_ENC_CPR
-        )
+        return self._inputs.left_pos
 
     def get_right_encoder_pos(self) -> float:
-        return self.talon_to_meters(
+        return self._inputs.right_pos
+
+    def sample_inputs(self):
+        """
+        Read every sensor into the inputs snapshot. Called at the start of periodic,
+        and everything else reads from the snapshot.
+        """
+        inputs = self._inputs
+
+        inputs.time = Timer.getFPGATimestamp()
+        inputs.left_pos = self.talon_to_meters(
+            self._left_motor.getSelectedSensorPosition() / DRIVE_ENC_CPR
+        )
+        inputs.right_pos = self.talon_to_meters(
             self._right_motor.getSelectedSensorPosition() / DRIVE_ENC_CPR
         )
+        inputs.left_vel = self.talon_to_meters(
+            self._left_motor.getSelectedSensorVelocity() / DRIVE_ENC_CPR * 10
+        )
+        inputs.right_vel = self.talon_to_meters(
+            self._right_motor.getSelectedSensorVelocity() / DRIVE_ENC_CPR * 10
+        )
+        inputs.gyro_heading = self._gyro.getAngle()
+        # The ADXRS450 is clockwise positive, like getRotation2d we negate it
+        inputs.gyro_rotation = Rotation2d.fromDegrees(-inputs.gyro_heading)
+        inputs.level_heading = self._level.getAngle()
+
+    def is_ready(self) -> bool:
+        """
+        Whether the motors have finished being configured, and were all verified.
+        Motors that failed to configure are never driven, since they might not be
+        inverted or current limited properly.
+        """
+        return self._motor_config.ok()
 
     def tank_drive_volts(self, left: float, right: float) -> None:
-        self._left_motor.setVoltage(left)
-        self._right_motor.setVoltage(right)
+        # Don't drive motors that aren't (or never will be) configured properly
+        if not self.is_ready():
+            left = right = 0
+
+        self._left_volts = left
+        self._right_volts = right
+
+        # With voltage compensation, full output is DRIVE_VOLTAGE_COMP volts
+        self._left_motor.set(ControlMode.PercentOutput, left / DRIVE_VOLTAGE_COMP)
+        self._right_motor.set(ControlMode.PercentOutput, right / DRIVE_VOLTAGE_COMP)
+
+    def get_volts(self) -> Tuple[float, float]:
+        """
+        Get the last (left, right) voltages sent to the motors, or the voltages they
+        last reported applying while they're closing the loop themselves
+        """
+        return self._left_volts, self._right_volts
 
     def use_wheel_speeds(self, speeds: DifferentialDriveWheelSpeeds):
         self.set_wheel_speeds(speeds.left, speeds.right)
 
     def set_wheel_speeds(self, left: float, right: float) -> None:
+        """
+        Drive the wheels at speeds in m/s, with the feedforward and a velocity PID,
+        either on the Talons or in Python (see `use_onboard_pid`).
+        """
         l_ff = self._ff.calculate(left)
         r_ff = self._ff.calculate(right)
 
-        l_out = self._left_controller.calculate(self.get_left_encoder_vel(), left)
-        r_out = self._right_controller.calculate(self.get_right_encoder_vel(), right)
+        if not self._onboard_pid:
+            l_out = self._left_controller.calculate(self.get_left_encoder_vel(), left)
+            r_out = self._right_controller.calculate(
+                self.get_right_encoder_vel(), right
+            )
+
+            self.tank_drive_volts(l_out + l_ff, r_out + r_ff)
+            return
+
+        if not self.is_ready():
+            self.tank_drive_volts(0, 0)
+            return
+
+        # The feedforward is added to the Talon's PID output, as a fraction of
+        # full output
+        self._left_motor.set(
+            ControlMode.Velocity,
+            left / TALON_VEL_UNIT,
+            DemandType.ArbitraryFeedForward,
+            l_ff / DRIVE_VOLTAGE_COMP,
+        )
+        self._right_motor.set(
+            ControlMode.Velocity,
+            right / TALON_VEL_UNIT,
+            DemandType.ArbitraryFeedForward,
+            r_ff / DRIVE_VOLTAGE_COMP,
+        )
+
+        # From the Talons' last status frames, so this doesn't wait on CAN
+        self._left_volts = self._left_motor.getMotorOutputVoltage()
+        self._right_volts = self._right_motor.getMotorOutputVoltage()
+
+    def use_onboard_pid(self, onboard: bool):
+        """
+        Switch between closing the velocity loops on the Talons (the default, see
+        DRIVE_ONBOARD_PID) and the Python PIDControllers, as a fallback.
+        """
+        if onboard != self._onboard_pid:
+            self._left_controller.reset()
+            self._right_controller.reset()
 
-        self.tank_drive_volts(l_out + l_ff, r_out + r_ff)
+        self._onboard_pid = onboard
 
     @cmd.run
     def arcade_drive(self, forward: Callable[[], float], rotation: Callable[[], float]):
@@ -181,32 +366,52 @@ class Drivetrain(SubsystemBase):
             self.get_right_encoder_pos(),
             pose_suppiler(),
         )
+        self._pose_resets += 1
 
     def get_pose(self) -> Pose2d:
         return self._pose_estimator.getEstimatedPosition()
 
+    def get_pose_resets(self) -> int:
+        """
+        Get the number of times the pose has been reset
+        """
+        return self._pose_resets
+
+    def set_follower(self, follower: "DriveTrajectory"):
+        """
+        Record the DriveTrajectory that's started driving the robot, for tools like
+        simulate_autos.py
+        """
+        self._follower = follower
+
+    def get_follower(self) -> "DriveTrajectory":
+        """
+        Get the last DriveTrajectory to drive the robot, or None if none has
+        """
+        return self._follower
+
+    def get_vision_frames(self) -> List[VisionFrame]:
+        """
+        Get every limelight frame that arrived this loop, oldest first. They might
+        not have been trusted by the pose estimator.
+        """
+        return self._vision_frames
+
     def periodic(self):
-        self._pose_estimator.update(
+        self.sample_inputs()
+
+        frames = self._vision.drain()
+        self._vision_frames = frames
+
+        update_pose_estimator(
+            self._pose_estimator,
+            self._vision_filter,
+            self._inputs.time,
             self.get_gyro_rotation(),
             self.get_left_encoder_pos(),
             self.get_right_encoder_pos(),
+            frames,
         )
 
-        if self._limelight.containsKey("botpose"):
-            entry = self._limelight.getNumberArray("botpose", [])
-
-            if entry[0] != 0:
-                # Limelight centers it's poses around the center of the field while
-                # the estimator does it around the bottom left corner, so we offset
-                # it here.
-                pose = Pose2d(
-                    entry[0] + (FIELD_LENGTH / 2),
-                    entry[1] + (FIELD_WIDTH / 2),
-                    Rotation2d.fromDegrees(entry[5]),
-                )
-
-                self._pose_estimator.addVisionMeasurement(
-                    pose, Timer.getFPGATimestamp() - (entry[6] / 1000)
-                )
-
-        self._field.setRobotPose(self._pose_estimator.getEstimatedPosition())
+        pose = self._pose_estimator.getEstimatedPosition()
+        self._field_pose.set((pose.X(), pose.Y(), pose.rotation().degrees()))
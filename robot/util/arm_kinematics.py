@@ -0,0 +1,288 @@
+import math
+import mmap
+import os
+import struct
+from array import array
+from typing import NamedTuple, Optional, Tuple, Union
+
+from wpilib import getDeployDirectory, reportWarning
+
+from robot.constants import *
+
+"""
+Kinematics of the two-link arm.
+
+Joint angles are the raw absolute encoder angles the rest of the arm code uses
+(like in `ArmPosition`). They're converted to the same geometry as the ArmView
+Mechanism2d: the lower arm's angle is measured from horizontal (forwards), and the
+upper arm's angle is relative to the lower arm. Claw positions are (x, z) in meters
+from the lower arm's pivot, with x forwards and z up.
+
+Inverse kinematics is done with a grid of precomputed solutions over the arm's
+workspace, so converting a claw position to joint angles is a constant time lookup
+and interpolation. The grid is built at deploy time by `compile_arm.py` and memory
+mapped when the robot boots. Building it takes far too long to do on the robot, so
+if it's missing or stale, IK is solved analytically instead, with a warning.
+"""
+
+GRID_FILE = os.path.join(getDeployDirectory(), "arm", "ik.grid")
+GRID_RESOLUTION = 0.01  # meters
+
+MAGIC = b"ARMK"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHHdddII")
+
+
+class ClawTarget(NamedTuple):
+    """
+    A claw position, in meters from the lower arm's pivot, to move the arm to.
+    """
+
+    x: float
+    z: float
+
+
+def joints_to_geometry(lower: float, upper: float) -> Tuple[float, float]:
+    """
+    Convert encoder angles to (lower arm angle from horizontal, upper arm angle
+    relative to the lower arm), in radians. The lower angle is in [-pi/2, 3pi/2).
+    """
+    # Same offsets as the ArmView Mechanism2d
+    shoulder = math.radians(238) + lower
+    elbow = math.pi - upper
+
+    shoulder = (shoulder + math.pi / 2) % math.tau - math.pi / 2
+    elbow = math.remainder(elbow, math.tau)
+
+    return shoulder, elbow
+
+
+def geometry_to_joints(shoulder: float, elbow: float) -> Tuple[float, float]:
+    """
+    Convert geometric angles back to encoder angles, in [0, 2pi).
+    """
+    return (shoulder - math.radians(238)) % math.tau, (math.pi - elbow) % math.tau
+
+
+def forward(lower: float, upper: float) -> ClawTarget:
+    """
+    Get the claw position for a pair of encoder angles.
+    """
+    shoulder, elbow = joints_to_geometry(lower, upper)
+
+    return ClawTarget(
+        LOWER_ARM_LENGTH * math.cos(shoulder)
+        + UPPER_ARM_LENGTH * math.cos(shoulder + elbow),
+        LOWER_ARM_LENGTH * math.sin(shoulder)
+        + UPPER_ARM_LENGTH * math.sin(shoulder + elbow),
+    )
+
+
+def inverse_geometry(
+    x: float, z: float, clamp: bool = False
+) -> Optional[Tuple[float, float]]:
+    """
+    Solve for the geometric (shoulder, elbow) angles that put the claw at (x, z),
+    or None if it can't reach. Always uses the solution with the elbow bent down,
+    like most of our presets. With `clamp`, positions out of reach get as close as
+    the arm can.
+    """
+    cos_elbow = (x * x + z * z - LOWER_ARM_LENGTH**2 - UPPER_ARM_LENGTH**2) / (
+        2 * LOWER_ARM_LENGTH * UPPER_ARM_LENGTH
+    )
+
+    if not -1 <= cos_elbow <= 1:
+        if not clamp:
+            return None
+
+        cos_elbow = max(-1.0, min(cos_elbow, 1.0))
+
+    elbow = -math.acos(cos_elbow)
+    shoulder = math.atan2(z, x) - math.atan2(
+        UPPER_ARM_LENGTH * math.sin(elbow),
+        LOWER_ARM_LENGTH + UPPER_ARM_LENGTH * math.cos(elbow),
+    )
+    shoulder = (shoulder + math.pi / 2) % math.tau - math.pi / 2
+
+    return shoulder, elbow
+
+
+class IKGrid:
+    """
+    Grid of inverse kinematics solutions over the arm's workspace. Each cell holds
+    the geometric (shoulder, elbow) angles, or NaN if it can't be reached.
+    """
+
+    def __init__(self, values, size: int, origin: float, resolution: float):
+        self._values = values
+        self._size = size
+        self._origin = origin
+        self._resolution = resolution
+
+    @classmethod
+    def build(cls, resolution: float = GRID_RESOLUTION) -> "IKGrid":
+        reach = LOWER_ARM_LENGTH + UPPER_ARM_LENGTH
+        size = int(math.ceil(2 * reach / resolution)) + 1
+        origin = -reach
+
+        values = array("d")
+        nan = (math.nan, math.nan)
+
+        # Cells just out of reach are clamped, so positions at full extension (like
+        # our high preset) can still be interpolated
+        clamp_reach = reach + 2 * resolution
+
+        for i in range(size):
+            x = origin + i * resolution
+
+            for j in range(size):
+                z = origin + j * resolution
+                clamp = math.hypot(x, z) <= clamp_reach
+                values.extend(inverse_geometry(x, z, clamp) or nan)
+
+        return cls(values, size, origin, resolution)
+
+    @classmethod
+    def load(cls, filename: str = GRID_FILE) -> Optional["IKGrid"]:
+        """
+        Memory map a grid file. Returns None if it's missing or stale.
+        """
+        try:
+            with open(filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size < _HEADER.size:
+                    return None
+
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+
+        magic, version, _, lower, upper, resolution, size, _ = _HEADER.unpack_from(mm)
+
+        # fmt: off
+        if (
+            magic != MAGIC or version != VERSION
+            or lower != LOWER_ARM_LENGTH or upper != UPPER_ARM_LENGTH
+            or len(mm) != _HEADER.size + size * size * 2 * 8
+        ):
+            mm.close()
+            return None
+        # fmt: on
+
+        values = memoryview(mm)[_HEADER.size :].cast("d")
+        origin = -(LOWER_ARM_LENGTH + UPPER_ARM_LENGTH)
+
+        return cls(values, size, origin, resolution)
+
+    def write(self, filename: str = GRID_FILE) -> None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        header = _HEADER.pack(
+            MAGIC,
+            VERSION,
+            0,
+            LOWER_ARM_LENGTH,
+            UPPER_ARM_LENGTH,
+            self._resolution,
+            self._size,
+            0,
+        )
+
+        with open(filename + ".tmp", "wb") as f:
+            f.write(header)
+            f.write(bytes(self._values))
+
+        os.replace(filename + ".tmp", filename)
+
+    def lookup(self, x: float, z: float) -> Optional[Tuple[float, float]]:
+        """
+        Get the encoder angles that put the claw at (x, z), interpolated from the
+        grid, or None if it can't reach.
+        """
+        gx = (x - self._origin) / self._resolution
+        gz = (z - self._origin) / self._resolution
+        i = int(gx)
+        j = int(gz)
+
+        if not (0 <= i < self._size - 1 and 0 <= j < self._size - 1):
+            return None
+
+        fx = gx - i
+        fz = gz - j
+        size = self._size
+        values = self._values
+
+        corners = (
+            (i * size + j) * 2,
+            (i * size + j + 1) * 2,
+            ((i + 1) * size + j) * 2,
+            ((i + 1) * size + j + 1) * 2,
+        )
+        weights = ((1 - fx) * (1 - fz), (1 - fx) * fz, fx * (1 - fz), fx * fz)
+
+        first_shoulder = values[corners[0]]
+        first_elbow = values[corners[0] + 1]
+        shoulder = 0.0
+        elbow = 0.0
+
+        for corner, weight in zip(corners, weights):
+            if math.isnan(values[corner]):
+                return None
+
+            # Blend the angles the short way around, relative to the first corner,
+            # so corners on either side of the shoulder's wrap at -pi/2 don't average
+            # out to the opposite side
+            shoulder += (
+                first_shoulder
+                + math.remainder(values[corner] - first_shoulder, math.tau)
+            ) * weight
+            elbow += (
+                first_elbow + math.remainder(values[corner + 1] - first_elbow, math.tau)
+            ) * weight
+
+        return geometry_to_joints(shoulder, elbow)
+
+
+class AnalyticIK:
+    """
+    Solves inverse kinematics directly, for when there's no IK grid. Same interface
+    (and answers, give or take the interpolation) as IKGrid, just slower.
+    """
+
+    def lookup(self, x: float, z: float) -> Optional[Tuple[float, float]]:
+        """
+        Get the encoder angles that put the claw at (x, z), or None if it can't reach.
+        """
+        # Clamped as far out as the grid's cells are
+        reach = LOWER_ARM_LENGTH + UPPER_ARM_LENGTH + 2 * GRID_RESOLUTION
+        geometry = inverse_geometry(x, z, math.hypot(x, z) <= reach)
+
+        if geometry is None:
+            return None
+
+        return geometry_to_joints(*geometry)
+
+
+_grid: Union[IKGrid, AnalyticIK] = None
+
+
+def get_grid() -> Union[IKGrid, AnalyticIK]:
+    """
+    Get the IK grid, memory mapping it the first time. If the grid file is missing
+    or stale, falls back to solving IK analytically, since building the grid on the
+    robot would take far too long.
+    """
+    global _grid
+
+    if _grid is None:
+        _grid = IKGrid.load()
+
+        if _grid is None:
+            reportWarning(
+                f"{GRID_FILE} is missing or stale, solving IK analytically"
+                " (run `pdm run arm`)",
+                False,
+            )
+            _grid = AnalyticIK()
+
+    return _grid
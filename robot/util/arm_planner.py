@@ -0,0 +1,458 @@
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from wpilib import getDeployDirectory, reportWarning
+
+from robot.constants import *
+from robot.util.arm_kinematics import joints_to_geometry
+
+"""
+Collision-aware path planning for the arm.
+
+The arm's configuration space (every pair of lower and upper encoder angles) is
+split into a grid, and each cell is marked as occupied if the arm would hit the
+floor, the robot's frame and bumpers, or the pylon in that position. Moves between
+two positions then search that grid with A*, for the fastest path that doesn't
+collide, and the path is shortened to as few waypoints as possible.
+
+The occupancy grid is a bitmap built at deploy time by `compile_arm.py` and memory
+mapped when the robot boots. The file's header has a hash of the geometry it was
+built from, so a bitmap from old geometry is never used. If it's missing or stale,
+the arm just moves in straight lines, since building it on the robot would take far
+too long.
+
+Searching takes too long for the main loop, so it only ever happens on a background
+thread. The plans between every pair of `ArmPosition` presets are made there when
+the arm is created, and then straight moves and moves between presets are just
+lookups. Since the arm rarely starts a move exactly at a preset (it's usually a bit
+off, or in the middle of another move), other moves are planned in the background,
+through the nearest preset to their start and goal that's a straight line away,
+reusing the plan between them. A move is only searched for if it can't, and those
+plans are kept in a small LRU cache.
+"""
+
+CSPACE_FILE = os.path.join(getDeployDirectory(), "arm", "cspace.grid")
+CSPACE_SIZE = 128
+
+CELL = math.tau / CSPACE_SIZE
+
+MAGIC = b"ARMC"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHH8s")
+
+Cell = Tuple[int, int]
+
+
+def in_collision(lower: float, upper: float) -> bool:
+    """
+    Check if the arm collides with anything at a pair of encoder angles.
+    """
+    shoulder, elbow = joints_to_geometry(lower, upper)
+    frame_min, frame_max, frame_top = ROBOT_FRAME
+    c = ARM_CLEARANCE
+
+    elbow_x = LOWER_ARM_LENGTH * math.cos(shoulder)
+    elbow_z = LOWER_ARM_LENGTH * math.sin(shoulder)
+
+    # Points along both links, skipping the part of the lower arm at the pivot
+    points = [(elbow_x * f, elbow_z * f) for f in (0.3, 0.5, 0.75)]
+    points += [
+        (
+            elbow_x + UPPER_ARM_LENGTH * f * math.cos(shoulder + elbow),
+            elbow_z + UPPER_ARM_LENGTH * f * math.sin(shoulder + elbow),
+        )
+        for f in (0.0, 0.25, 0.5, 0.75, 1.0)
+    ]
+
+    for x, z in points:
+        height = ARM_PIVOT_HEIGHT + z
+
+        if height < c:
+            return True
+        if frame_min - c <= x <= frame_max + c and height < frame_top + c:
+            return True
+        if abs(x) < ARM_PYLON_HALF_WIDTH + c and height < ARM_PIVOT_HEIGHT - 0.1:
+            return True
+
+    return False
+
+
+def geometry_hash() -> bytes:
+    """
+    Hash of everything the collision check depends on, to tell if a bitmap is stale.
+    """
+    geometry = (
+        CSPACE_SIZE,
+        LOWER_ARM_LENGTH,
+        UPPER_ARM_LENGTH,
+        ARM_PIVOT_HEIGHT,
+        ROBOT_FRAME,
+        ARM_PYLON_HALF_WIDTH,
+        ARM_CLEARANCE,
+    )
+    return hashlib.sha1(repr(geometry).encode()).digest()[:8]
+
+
+def to_cell(angle: float) -> int:
+    return min(int((angle % math.tau) / CELL), CSPACE_SIZE - 1)
+
+
+def to_angle(cell: int) -> float:
+    return (cell + 0.5) * CELL
+
+
+def _to_cells(angles: Tuple[float, float]) -> Cell:
+    return to_cell(angles[0]), to_cell(angles[1])
+
+
+def _to_waypoints(
+    cells: Optional[List[Cell]], goal: Tuple[float, float]
+) -> Optional[List[Tuple[float, float]]]:
+    if cells is None:
+        return None
+
+    waypoints = [(to_angle(i), to_angle(j)) for i, j in cells[:-1]]
+    waypoints.append(tuple(goal))
+
+    return waypoints
+
+
+def _done(result) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class ConfigSpace:
+    """
+    Occupancy bitmap of the arm's configuration space, one bit per cell.
+    """
+
+    def __init__(self, bits):
+        self._bits = bits
+
+    @classmethod
+    def build(cls) -> "ConfigSpace":
+        bits = bytearray(CSPACE_SIZE * CSPACE_SIZE // 8)
+
+        for i in range(CSPACE_SIZE):
+            for j in range(CSPACE_SIZE):
+                if in_collision(to_angle(i), to_angle(j)):
+                    index = i * CSPACE_SIZE + j
+                    bits[index >> 3] |= 1 << (index & 7)
+
+        return cls(bits)
+
+    @classmethod
+    def load(cls, filename: str = CSPACE_FILE) -> Optional["ConfigSpace"]:
+        """
+        Memory map a bitmap file. Returns None if it's missing or stale.
+        """
+        try:
+            with open(filename, "rb") as f:
+                size = _HEADER.size + CSPACE_SIZE * CSPACE_SIZE // 8
+                if os.fstat(f.fileno()).st_size != size:
+                    return None
+
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+
+        magic, version, _, geometry = _HEADER.unpack_from(mm)
+
+        if magic != MAGIC or version != VERSION or geometry != geometry_hash():
+            mm.close()
+            return None
+
+        return cls(memoryview(mm)[_HEADER.size :])
+
+    def write(self, filename: str = CSPACE_FILE) -> None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename + ".tmp", "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, 0, geometry_hash()))
+            f.write(bytes(self._bits))
+
+        os.replace(filename + ".tmp", filename)
+
+    def occupied(self, cell: Cell) -> bool:
+        index = cell[0] * CSPACE_SIZE + cell[1]
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+
+def _move_time(a: Cell, b: Cell) -> float:
+    # Both joints move together, so the slower one sets the time
+    return max(
+        abs(a[0] - b[0]) * CELL / LOWER_ARM_MAX_VEL,
+        abs(a[1] - b[1]) * CELL / UPPER_ARM_MAX_VEL,
+    )
+
+
+class ArmPlanner:
+    """
+    Plans collision-free moves through a ConfigSpace. Plans between presets are
+    kept for good, and the last `ARM_PLAN_CACHE_SIZE` other plans are cached.
+
+    Everything but `request`'s lookups runs on one background thread, so only that
+    thread ever touches the LRU cache. The presets and their plans are replaced
+    rather than changed, so the main loop can always read them.
+    """
+
+    def __init__(self, cspace: ConfigSpace):
+        self._cspace = cspace
+        self._presets: List[Cell] = []
+        self._preset_plans: Dict[Tuple[Cell, Cell], Optional[List[Cell]]] = {}
+        self._plans: "OrderedDict[Tuple[Cell, Cell], Optional[List[Cell]]]" = (
+            OrderedDict()
+        )
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="ArmPlanner")
+
+    def _line_free(self, a: Cell, b: Cell) -> bool:
+        steps = max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+        for step in range(1, steps):
+            cell = (
+                round(a[0] + (b[0] - a[0]) * step / steps),
+                round(a[1] + (b[1] - a[1]) * step / steps),
+            )
+
+            if self._cspace.occupied(cell):
+                return False
+
+        return True
+
+    def _astar(self, start: Cell, goal: Cell) -> Optional[List[Cell]]:
+        open_set = [(_move_time(start, goal), 0.0, start)]
+        came_from: Dict[Cell, Cell] = {}
+        cost = {start: 0.0}
+
+        while open_set:
+            _, cur_cost, cell = heapq.heappop(open_set)
+
+            if cell == goal:
+                path = [cell]
+                while cell in came_from:
+                    cell = came_from[cell]
+                    path.append(cell)
+                return path[::-1]
+
+            if cur_cost > cost[cell]:
+                continue
+
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    i, j = cell[0] + di, cell[1] + dj
+                    new = (i, j)
+
+                    if not (0 <= i < CSPACE_SIZE and 0 <= j < CSPACE_SIZE):
+                        continue
+                    if new != goal and self._cspace.occupied(new):
+                        continue
+
+                    new_cost = cur_cost + _move_time(cell, new)
+
+                    if new_cost < cost.get(new, math.inf):
+                        cost[new] = new_cost
+                        came_from[new] = cell
+                        heapq.heappush(
+                            open_set, (new_cost + _move_time(new, goal), new_cost, new)
+                        )
+
+        return None
+
+    def _shortcut(self, path: List[Cell]) -> List[Cell]:
+        """
+        Reduce a path to the waypoints where it has to turn, skipping the start.
+        """
+        waypoints = []
+        anchor = path[0]
+        i = 1
+
+        while i < len(path):
+            # Go as far along the path as possible in a straight line
+            j = len(path) - 1
+            while j > i and not self._line_free(anchor, path[j]):
+                j -= 1
+
+            anchor = path[j]
+            waypoints.append(anchor)
+            i = j + 1
+
+        return waypoints
+
+    def _search(self, start: Cell, goal: Cell) -> Optional[List[Cell]]:
+        path = self._astar(start, goal)
+        return self._shortcut(path) if path else None
+
+    def _nearest_preset(self, cell: Cell) -> Optional[Cell]:
+        """
+        Get the preset closest to a cell that's a straight line away from it.
+        """
+        best = None
+        best_time = math.inf
+
+        for preset in self._presets:
+            time = _move_time(cell, preset)
+
+            if time < best_time and self._line_free(cell, preset):
+                best = preset
+                best_time = time
+
+        return best
+
+    def _via_presets(self, start: Cell, goal: Cell) -> Optional[List[Cell]]:
+        """
+        Plan a move through the nearest presets to its start and goal, using the
+        plan between them. Returns None if it can't.
+        """
+        via_start = self._nearest_preset(start)
+        via_goal = self._nearest_preset(goal)
+
+        if via_start is None or via_goal is None:
+            return None
+
+        path = [start, via_start]
+
+        if via_start != via_goal:
+            between = self._preset_plans.get((via_start, via_goal))
+            if between is None:
+                return None
+            path += between
+
+        if goal != via_goal:
+            path.append(goal)
+
+        return self._shortcut(path)
+
+    def plan_cells(self, start: Cell, goal: Cell) -> Optional[List[Cell]]:
+        """
+        Plan a move between two cells. Returns the waypoints after the start, or None
+        if there's no collision-free path.
+        """
+        if self._line_free(start, goal):
+            return [goal]
+
+        key = (start, goal)
+
+        if key in self._preset_plans:
+            return self._preset_plans[key]
+
+        if key in self._plans:
+            self._plans.move_to_end(key)
+            return self._plans[key]
+
+        plan = self._via_presets(start, goal) or self._search(start, goal)
+
+        self._plans[key] = plan
+        if len(self._plans) > ARM_PLAN_CACHE_SIZE:
+            self._plans.popitem(last=False)
+
+        return plan
+
+    def _precompute(self, cells: List[Cell]) -> None:
+        plans = dict(self._preset_plans)
+
+        for start in cells:
+            for goal in cells:
+                if start != goal:
+                    if self._line_free(start, goal):
+                        plan = [goal]
+                    else:
+                        plan = self._search(start, goal)
+
+                    plans[(start, goal)] = plan
+
+        self._preset_plans = plans
+        self._presets = self._presets + [
+            cell for cell in cells if not self._cspace.occupied(cell)
+        ]
+
+    def precompute(self, positions: Iterable[Tuple[float, float]]) -> Future:
+        """
+        Plan the moves between every pair of positions on the background thread, and
+        keep them for good. Returns a Future of when they're done.
+        """
+        cells = [_to_cells(position) for position in positions]
+        return self._executor.submit(self._precompute, cells)
+
+    def plan(
+        self, start: Tuple[float, float], goal: Tuple[float, float]
+    ) -> Optional[List[Tuple[float, float]]]:
+        """
+        Plan a move between two pairs of encoder angles. Returns the waypoints to
+        move through, ending exactly at the goal, or None if there's no
+        collision-free path. This can search, so it shouldn't be called from the
+        main loop, see `request`.
+        """
+        return _to_waypoints(self.plan_cells(_to_cells(start), _to_cells(goal)), goal)
+
+    def request(self, start: Tuple[float, float], goal: Tuple[float, float]) -> Future:
+        """
+        Get a Future of `plan(start, goal)`. Straight moves and moves between presets
+        are looked up right away, so their Future is already done, and anything else
+        is planned on the background thread.
+        """
+        start_cell = _to_cells(start)
+        goal_cell = _to_cells(goal)
+
+        if self._line_free(start_cell, goal_cell):
+            return _done(_to_waypoints([goal_cell], goal))
+
+        preset_plans = self._preset_plans
+        if (start_cell, goal_cell) in preset_plans:
+            return _done(_to_waypoints(preset_plans[(start_cell, goal_cell)], goal))
+
+        return self._executor.submit(self.plan, start, goal)
+
+
+class StraightLinePlanner:
+    """
+    Stands in for the ArmPlanner when there's no occupancy bitmap, by moving
+    straight to every goal.
+    """
+
+    def precompute(self, positions: Iterable[Tuple[float, float]]) -> Future:
+        return _done(None)
+
+    def plan(
+        self, start: Tuple[float, float], goal: Tuple[float, float]
+    ) -> Optional[List[Tuple[float, float]]]:
+        return [tuple(goal)]
+
+    def request(self, start: Tuple[float, float], goal: Tuple[float, float]) -> Future:
+        return _done(self.plan(start, goal))
+
+
+_planner: Union[ArmPlanner, StraightLinePlanner] = None
+
+
+def get_planner() -> Union[ArmPlanner, StraightLinePlanner]:
+    """
+    Get the arm planner, memory mapping the occupancy bitmap the first time. If the
+    bitmap is missing or stale, falls back to moving in straight lines, since
+    building it on the robot would take far too long.
+    """
+    global _planner
+
+    if _planner is None:
+        cspace = ConfigSpace.load()
+
+        if cspace is None:
+            reportWarning(
+                f"{CSPACE_FILE} is missing or stale, so the arm won't avoid collisions"
+                " (run `pdm run arm`)",
+                False,
+            )
+            _planner = StraightLinePlanner()
+        else:
+            _planner = ArmPlanner(cspace)
+
+    return _planner
@@ -0,0 +1,128 @@
+from typing import Dict, Iterable
+
+from ctre import StatusFrameEnhanced
+from rev import CANSparkMax
+from wpilib import RobotController, Timer, reportWarning
+
+from robot.constants import *
+import robot.util.telemetry as telemetry
+
+"""
+CAN bus management.
+
+Every motor controller sends a bunch of status frames at fixed rates by default, no
+matter what's read from it, and most of them are never read. Instead, each device's
+config declares which signals the code actually reads from it, and the frames that
+carry those signals are sent every `CAN_FAST_FRAME_PERIOD`. Every other frame is
+slowed down to `CAN_SLOW_FRAME_PERIOD`. The periods are set with the rest of the
+device's config, in the background. See `motor_config.py`.
+
+`CANMonitor` publishes the bus's utilization, and the frames dropped and errors seen
+by the roboRIO's CAN controller, to the "CAN" NetworkTable.
+
+## Example:
+```
+TalonFXConfig(motor, status_frames=talon_fx_frames("sensor"))
+TalonFXConfig(follower, follow=motor, status_frames=talon_fx_frames())
+```
+"""
+
+# The signals in each Talon FX status frame
+TALON_FX_SIGNALS = {
+    "output": StatusFrameEnhanced.Status_1_General,  # applied output, faults
+    "sensor": StatusFrameEnhanced.Status_2_Feedback0,  # selected sensor pos and vel
+    "temperature": StatusFrameEnhanced.Status_4_AinTempVbat,  # and bus voltage
+    "pid": StatusFrameEnhanced.Status_13_Base_PIDF0,  # closed loop error and target
+    "current": StatusFrameEnhanced.Status_Brushless_Current,
+}
+
+# Frames only used by features we don't use, which are always slowed down
+TALON_FX_UNUSED = (
+    StatusFrameEnhanced.Status_3_Quadrature,
+    StatusFrameEnhanced.Status_8_PulseWidth,
+    StatusFrameEnhanced.Status_10_Targets,
+    StatusFrameEnhanced.Status_12_Feedback1,
+    StatusFrameEnhanced.Status_14_Turn_PIDF1,
+)
+
+# The signals in each Spark MAX periodic frame
+SPARK_MAX_SIGNALS = {
+    "output": CANSparkMax.PeriodicFrame.kStatus0,  # applied output, faults
+    "velocity": CANSparkMax.PeriodicFrame.kStatus1,
+    "temperature": CANSparkMax.PeriodicFrame.kStatus1,
+    "current": CANSparkMax.PeriodicFrame.kStatus1,
+    "position": CANSparkMax.PeriodicFrame.kStatus2,
+    "analog": CANSparkMax.PeriodicFrame.kStatus3,
+    "alternate_encoder": CANSparkMax.PeriodicFrame.kStatus4,
+}
+
+
+def _frame_periods(signals: Dict[str, object], used: Iterable[str], unused=()):
+    used = set(used)
+    unknown = used - signals.keys()
+
+    if unknown:
+        raise ValueError(f"Unknown signals: {', '.join(sorted(unknown))}")
+
+    periods = {frame: CAN_SLOW_FRAME_PERIOD for frame in unused}
+
+    for signal, frame in signals.items():
+        if signal in used:
+            periods[frame] = CAN_FAST_FRAME_PERIOD
+        else:
+            periods.setdefault(frame, CAN_SLOW_FRAME_PERIOD)
+
+    return periods
+
+
+def talon_fx_frames(*used: str) -> Dict[StatusFrameEnhanced, int]:
+    """
+    Get the status frame periods (in ms) for a Talon FX that the given signals (see
+    `TALON_FX_SIGNALS`) are read from. A follower doesn't need any.
+    """
+    return _frame_periods(TALON_FX_SIGNALS, used, TALON_FX_UNUSED)
+
+
+def spark_max_frames(*used: str) -> Dict[CANSparkMax.PeriodicFrame, int]:
+    """
+    Get the periodic frame periods (in ms) for a Spark MAX that the given signals
+    (see `SPARK_MAX_SIGNALS`) are read from.
+    """
+    return _frame_periods(SPARK_MAX_SIGNALS, used)
+
+
+class CANMonitor:
+    """
+    Publishes the CAN bus's health every `CAN_MONITOR_PERIOD` seconds. Call `update`
+    every loop.
+    """
+
+    def __init__(self):
+        self._utilization = telemetry.number("Utilization", 0.5, table="CAN")
+        self._dropped = telemetry.number("Dropped", table="CAN")
+        self._bus_off = telemetry.number("BusOff", table="CAN")
+        self._rx_errors = telemetry.number("ReceiveErrors", table="CAN")
+        self._tx_errors = telemetry.number("TransmitErrors", table="CAN")
+
+        self._next = 0.0
+        self._bus_off_count = 0
+
+    def update(self):
+        now = Timer.getFPGATimestamp()
+
+        if now < self._next:
+            return
+
+        self._next = now + CAN_MONITOR_PERIOD
+        status = RobotController.getCANStatus()
+
+        self._utilization.set(status.percentBusUtilization * 100)
+        # Frames the roboRIO couldn't send because its transmit buffer was full
+        self._dropped.set(status.txFullCount)
+        self._bus_off.set(status.busOffCount)
+        self._rx_errors.set(status.receiveErrorCount)
+        self._tx_errors.set(status.transmitErrorCount)
+
+        if status.busOffCount > self._bus_off_count:
+            reportWarning("CAN bus went off (check the wiring)", False)
+            self._bus_off_count = status.busOffCount
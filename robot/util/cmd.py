@@ -2,6 +2,8 @@ import functools
 
 from commands2 import Command, Subsystem, cmd
 
+import robot.util.profiler as profiler
+
 
 def run(func):
     """
@@ -18,7 +20,9 @@ def run(func):
         if args and isinstance(args[0], Subsystem):
             requires = [args[0]]
 
-        return cmd.run(lambda: func(*args, **kwargs), requirements=requires)
+        action = profiler.timed(lambda: func(*args, **kwargs), func.__qualname__)
+
+        return cmd.run(action, requirements=requires)
 
     return _cmd
 
@@ -38,6 +42,8 @@ def run_once(func):
         if args and isinstance(args[0], Subsystem):
             requires = [args[0]]
 
-        return cmd.runOnce(lambda: func(*args, **kwargs), requirements=requires)
+        action = profiler.timed(lambda: func(*args, **kwargs), func.__qualname__)
+
+        return cmd.runOnce(action, requirements=requires)
 
     return _cmd
@@ -0,0 +1,143 @@
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Sequence, Tuple
+
+"""
+Binary on-robot data logger.
+
+Every loop, a snapshot of the robot's state is appended as a fixed-width record of
+doubles into a preallocated ring buffer. That's one `struct.pack_into`, so it costs
+microseconds and never touches the disk. A background thread drains the buffer to an
+append-only file every `flush_period` seconds. If the writer ever falls so far
+behind that the buffer fills, new records are dropped (and counted) instead of
+blocking the main loop.
+
+Log files start with a header naming the fields, so `read_log` can read any log
+back, even if the fields change later:
+
+    magic, version, field count, then each field name as a length-prefixed string
+    records: one double per field, repeated until the end of the file
+"""
+
+MAGIC = b"RLOG"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHH")
+_NAME = struct.Struct("<B")
+
+
+class DataLog:
+    """
+    Logs fixed-width records of the given fields to a file in `directory`.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        directory: str,
+        capacity: int = 1024,
+        flush_period: float = 0.5,
+        name: str = "log",
+    ):
+        self.fields = tuple(fields)
+        self._record = struct.Struct("<" + "d" * len(self.fields))
+        self._capacity = capacity
+        self._flush_period = flush_period
+
+        self._buffer = bytearray(self._record.size * capacity)
+        self._view = memoryview(self._buffer)
+
+        # Records are written at `_head` by the main loop and read from `_tail` by
+        # the writer thread. Each is only ever changed by one thread.
+        self._head = 0
+        self._tail = 0
+
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.filename = os.path.join(
+            directory, time.strftime(f"{name}_%Y%m%d_%H%M%S.rlog")
+        )
+
+        self._file = open(self.filename, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(self.fields)))
+        for name in self.fields:
+            encoded = name.encode()
+            self._file.write(_NAME.pack(len(encoded)) + encoded)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="DataLog", daemon=True)
+        self._thread.start()
+
+    def append(self, *values: float) -> None:
+        """
+        Append a record. Must be called with one value per field.
+        """
+        if self._head - self._tail >= self._capacity:
+            self.dropped += 1
+            return
+
+        offset = (self._head % self._capacity) * self._record.size
+        self._record.pack_into(self._buffer, offset, *values)
+        self._head += 1
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop the writer thread, after it writes everything that's left. Without
+        `wait`, it finishes in the background.
+        """
+        self._stop.set()
+
+        if wait:
+            self._thread.join()
+
+    def _drain(self) -> None:
+        head = self._head
+        size = self._record.size
+
+        while self._tail < head:
+            start = self._tail % self._capacity
+            # Only write up to the end of the buffer, the rest wraps around
+            end = min(start + (head - self._tail), self._capacity)
+
+            self._file.write(self._view[start * size : end * size])
+            self._tail += end - start
+
+        self._file.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_period):
+            self._drain()
+
+        self._drain()
+        self._file.close()
+
+
+def read_log(filename: str) -> Tuple[Tuple[str, ...], Iterator[Tuple[float, ...]]]:
+    """
+    Read a log file written by a DataLog. Returns the field names, and an iterator of
+    the records.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    magic, version, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"'{filename}' is not a version {VERSION} data log")
+
+    offset = _HEADER.size
+    fields = []
+
+    for _ in range(count):
+        (length,) = _NAME.unpack_from(data, offset)
+        offset += _NAME.size
+        fields.append(data[offset : offset + length].decode())
+        offset += length
+
+    record = struct.Struct("<" + "d" * count)
+    # Ignore a partially written record at the end of the file
+    end = offset + (len(data) - offset) // record.size * record.size
+
+    return tuple(fields), record.iter_unpack(data[offset:end])
@@ -0,0 +1,124 @@
+from typing import Iterable, NamedTuple, Tuple
+
+from wpimath.estimator import DifferentialDrivePoseEstimator
+from wpimath.geometry import Pose2d, Rotation2d
+
+from robot.constants import *
+
+"""
+The pose estimation code path, kept separate from the Drivetrain so it only depends
+on wpimath. The Drivetrain runs it with live sensor values, and `replay.py` runs the
+exact same code over recorded data logs, with no HAL, timers or NetworkTables.
+
+Limelight frames go through a VisionFilter before they're added to the estimator,
+which throws out frames that are too far from the current estimate or from bad tag
+views, and scales each frame's std devs by how many tags it saw and how far away.
+"""
+
+
+class VisionFrame(NamedTuple):
+    """
+    One limelight botpose. `time` is the FPGA timestamp the frame was captured at, x,
+    y and yaw are from the center of the field, and `distance` is the average
+    distance to the tags (0 if the limelight didn't report it).
+    """
+
+    time: float
+    x: float
+    y: float
+    yaw: float
+    tags: float
+    distance: float
+
+
+NO_FRAME = VisionFrame(0, 0, 0, 0, 0, 0)
+
+
+def make_pose_estimator(
+    gyro: Rotation2d, left: float, right: float
+) -> DifferentialDrivePoseEstimator:
+    """
+    Create the drivetrain's pose estimator, starting at the origin.
+    """
+    estimator = DifferentialDrivePoseEstimator(
+        DRIVE_KINEMATICS, gyro, left, right, Pose2d()
+    )
+    estimator.setVisionMeasurementStdDevs(VISION_STD_DEVS)
+
+    return estimator
+
+
+def botpose_to_pose(x: float, y: float, yaw: float) -> Pose2d:
+    """
+    Convert a limelight botpose to a field pose.
+    """
+    # Limelight centers it's poses around the center of the field while
+    # the estimator does it around the bottom left corner, so we offset
+    # it here.
+    return Pose2d(
+        x + (FIELD_LENGTH / 2), y + (FIELD_WIDTH / 2), Rotation2d.fromDegrees(yaw)
+    )
+
+
+class VisionFilter:
+    """
+    Decides which vision frames to trust, and how much.
+    """
+
+    def __init__(self, std_devs: Tuple[float, float, float] = VISION_STD_DEVS):
+        self.std_devs = std_devs
+
+        self.accepted = 0
+        self.rejected = 0
+        self._rejects_in_row = 0
+
+    def check(self, estimate: Pose2d, pose: Pose2d, frame: VisionFrame) -> bool:
+        """
+        Whether to add a frame with this `pose` to an estimator at `estimate`.
+        """
+        ok = frame.tags > 0
+
+        if frame.tags < 2 and frame.distance > VISION_MAX_DISTANCE:
+            ok = False
+        elif ok and self._rejects_in_row < VISION_MAX_REJECTS:
+            ok = estimate.translation().distance(pose.translation()) < VISION_MAX_ERROR
+
+        if ok:
+            self.accepted += 1
+            self._rejects_in_row = 0
+        else:
+            self.rejected += 1
+            self._rejects_in_row += 1
+
+        return ok
+
+    def frame_std_devs(self, frame: VisionFrame) -> Tuple[float, float, float]:
+        """
+        Std devs for a frame, growing with distance and shrinking with more tags.
+        """
+        scale = (1 + frame.distance**2 * VISION_DISTANCE_SCALE) / max(frame.tags, 1)
+        return tuple(std * scale for std in self.std_devs)
+
+
+def update_pose_estimator(
+    estimator: DifferentialDrivePoseEstimator,
+    vision_filter: VisionFilter,
+    time: float,
+    gyro: Rotation2d,
+    left: float,
+    right: float,
+    frames: Iterable[VisionFrame],
+) -> None:
+    """
+    Update the estimator with one loop's odometry and the limelight frames that
+    arrived since the last loop. `time` is the FPGA timestamp.
+    """
+    estimator.updateWithTime(time, gyro, left, right)
+
+    for frame in frames:
+        pose = botpose_to_pose(frame.x, frame.y, frame.yaw)
+
+        if vision_filter.check(estimator.getEstimatedPosition(), pose, frame):
+            estimator.addVisionMeasurement(
+                pose, frame.time, vision_filter.frame_std_devs(frame)
+            )
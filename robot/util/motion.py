@@ -0,0 +1,149 @@
+import math
+from array import array
+from typing import Sequence, Tuple
+
+from wpimath.controller import ArmFeedforward
+
+"""
+Motion profiling utilities for the arm.
+"""
+
+
+class CoordinatedProfile:
+    """
+    Trapezoidal motion profile that moves any number of joints from a start to a goal
+    so that they all arrive at the same time.
+
+    Every joint follows the same normalized profile (0 to 1), scaled by how far that
+    joint moves. The normalized profile is the fastest one that keeps every joint
+    under its max velocity and acceleration, so the slowest joint sets the pace and
+    the others just move slower to match it.
+    """
+
+    # fmt: off
+    __slots__ = (
+        "start", "goal", "delta", "rate", "accel", "t_accel", "t_cruise", "total"
+    )
+    # fmt: on
+
+    def __init__(
+        self,
+        start: Sequence[float],
+        goal: Sequence[float],
+        max_vel: Sequence[float],
+        max_accel: Sequence[float],
+    ):
+        self.start = tuple(start)
+        self.goal = tuple(goal)
+        self.delta = tuple(g - s for s, g in zip(start, goal))
+
+        # Max rate and acceleration of the normalized profile
+        rate = math.inf
+        accel = math.inf
+
+        for delta, vel, acc in zip(self.delta, max_vel, max_accel):
+            if abs(delta) > 1e-9:
+                rate = min(rate, vel / abs(delta))
+                accel = min(accel, acc / abs(delta))
+
+        if math.isinf(rate):
+            # Nothing to move
+            self.rate = self.accel = self.t_accel = self.t_cruise = self.total = 0.0
+            return
+
+        if rate * rate / accel > 1:
+            # Never gets up to the max rate, so it's a triangle instead
+            self.t_accel = math.sqrt(1 / accel)
+            self.t_cruise = 0.0
+            rate = accel * self.t_accel
+        else:
+            self.t_accel = rate / accel
+            self.t_cruise = (1 - rate * self.t_accel) / rate
+
+        self.rate = rate
+        self.accel = accel
+        self.total = 2 * self.t_accel + self.t_cruise
+
+    def _normalized(self, t: float) -> Tuple[float, float, float]:
+        if t <= 0:
+            return 0.0, 0.0, 0.0
+        if t >= self.total:
+            return 1.0, 0.0, 0.0
+
+        if t < self.t_accel:
+            return 0.5 * self.accel * t * t, self.accel * t, self.accel
+
+        if t < self.t_accel + self.t_cruise:
+            pos = 0.5 * self.accel * self.t_accel**2 + self.rate * (t - self.t_accel)
+            return pos, self.rate, 0.0
+
+        remaining = self.total - t
+        return (
+            1 - 0.5 * self.accel * remaining * remaining,
+            self.accel * remaining,
+            -self.accel,
+        )
+
+    def sample(self, t: float, joint: int) -> Tuple[float, float, float]:
+        """
+        Get the (position, velocity, acceleration) of a joint `t` seconds into the
+        profile.
+        """
+        pos, rate, accel = self._normalized(t)
+        delta = self.delta[joint]
+
+        return self.start[joint] + delta * pos, delta * rate, delta * accel
+
+
+class FeedforwardTable:
+    """
+    Lookup table of an ArmFeedforward's output over angle and velocity, precomputed
+    once so each loop is a bilinear interpolation instead of a call into wpimath.
+    The acceleration term is linear, so it's added on directly.
+    """
+
+    __slots__ = ("_table", "_kA", "_max_vel", "_angle_steps", "_vel_steps")
+
+    def __init__(
+        self,
+        ff: ArmFeedforward,
+        kA: float,
+        max_vel: float,
+        angle_steps: int = 128,
+        vel_steps: int = 32,
+    ):
+        self._kA = kA
+        self._max_vel = max_vel
+        self._angle_steps = angle_steps
+        self._vel_steps = vel_steps
+
+        # One row per angle, wrapping around, with one column per velocity
+        self._table = array(
+            "d",
+            (
+                ff.calculate(
+                    (i / angle_steps) * math.tau,
+                    -max_vel + (j / vel_steps) * 2 * max_vel,
+                )
+                for i in range(angle_steps + 1)
+                for j in range(vel_steps + 1)
+            ),
+        )
+
+    def calculate(self, angle: float, vel: float, accel: float = 0.0) -> float:
+        vel = max(-self._max_vel, min(vel, self._max_vel))
+
+        a = (angle % math.tau) / math.tau * self._angle_steps
+        v = (vel + self._max_vel) / (2 * self._max_vel) * self._vel_steps
+
+        i = min(int(a), self._angle_steps - 1)
+        j = min(int(v), self._vel_steps - 1)
+        fa = a - i
+        fv = v - j
+
+        row = self._vel_steps + 1
+        table = self._table
+        low = table[i * row + j] * (1 - fv) + table[i * row + j + 1] * fv
+        high = table[(i + 1) * row + j] * (1 - fv) + table[(i + 1) * row + j + 1] * fv
+
+        return low * (1 - fa) + high * fa + self._kA * accel
@@ -0,0 +1,244 @@
+import math
+import threading
+from typing import Dict, List, Union
+
+from ctre import (
+    ErrorCode,
+    InvertType,
+    NeutralMode,
+    SlotConfiguration,
+    StatorCurrentLimitConfiguration,
+    StatusFrameEnhanced,
+    TalonFXConfiguration,
+    TalonFXFeedbackDevice,
+    WPI_TalonFX,
+)
+from rev import CANSparkMax, REVLibError
+from wpilib import reportWarning
+
+from robot.constants import *
+
+"""
+Declarative motor controller configuration.
+
+Configuring a motor controller means a bunch of config calls that each wait on a CAN
+round trip (and can time out), so doing them one after another in a subsystem's
+constructor stalls robot boot. Instead, each controller's desired config is
+described once, and `configure` applies them all in the background, with one thread
+per device. Each device is configured in as few calls as possible (Talon FX configs
+are sent all at once with `configAllSettings`), then read back to verify it, and
+retried if anything failed.
+
+Subsystems get a `ConfigStatus` back, and shouldn't drive their motors until it's
+ready, since things like inversion aren't set until then.
+"""
+
+
+class TalonFXConfig:
+    """
+    Desired config of a Talon FX.
+    """
+
+    def __init__(
+        self,
+        motor: WPI_TalonFX,
+        inverted: Union[bool, InvertType] = False,
+        neutral_mode: NeutralMode = NeutralMode.Brake,
+        stator_limit: StatorCurrentLimitConfiguration = None,
+        feedback: TalonFXFeedbackDevice = None,
+        follow: WPI_TalonFX = None,
+        sensor_phase: bool = None,
+        slot0: SlotConfiguration = None,
+        voltage_comp: float = None,
+        status_frames: Dict[StatusFrameEnhanced, int] = None,
+    ):
+        self.motor = motor
+        self.inverted = inverted
+        self.neutral_mode = neutral_mode
+        self.stator_limit = stator_limit
+        self.feedback = feedback
+        self.follow = follow
+        self.sensor_phase = sensor_phase
+        self.slot0 = slot0
+        self.voltage_comp = voltage_comp
+        self.status_frames = status_frames or {}
+
+        self.name = f"TalonFX {motor.getDeviceID()}"
+
+    def apply(self) -> bool:
+        # Anything not set here is left at its factory default
+        config = TalonFXConfiguration()
+
+        if self.stator_limit is not None:
+            config.statorCurrLimit = self.stator_limit
+
+        if self.feedback is not None:
+            config.primaryPID.selectedFeedbackSensor = self.feedback
+
+        if self.slot0 is not None:
+            config.slot0 = self.slot0
+
+        if self.voltage_comp is not None:
+            config.voltageCompSaturation = self.voltage_comp
+
+        error = self.motor.configAllSettings(config, CAN_TIMEOUT_MS)
+
+        # These aren't stored configs, so they're sent without waiting
+        self.motor.setNeutralMode(self.neutral_mode)
+
+        if self.follow is not None:
+            self.motor.follow(self.follow)
+
+        self.motor.setInverted(self.inverted)
+
+        if self.sensor_phase is not None:
+            self.motor.setSensorPhase(self.sensor_phase)
+
+        if self.voltage_comp is not None:
+            self.motor.enableVoltageCompensation(True)
+
+        # Status frame periods aren't part of the config, and aren't saved either
+        ok = error == ErrorCode.OK
+        for frame, period in self.status_frames.items():
+            error = self.motor.setStatusFramePeriod(frame, period, CAN_TIMEOUT_MS)
+            ok = error == ErrorCode.OK and ok
+
+        return ok
+
+    def verify(self) -> bool:
+        config = TalonFXConfiguration()
+
+        if self.motor.getAllConfigs(config, CAN_TIMEOUT_MS) != ErrorCode.OK:
+            return False
+
+        if self.stator_limit is not None:
+            limit = config.statorCurrLimit
+
+            if (
+                limit.enable != self.stator_limit.enable
+                or limit.currentLimit != self.stator_limit.currentLimit
+            ):
+                return False
+
+        if self.feedback is not None:
+            if config.primaryPID.selectedFeedbackSensor != self.feedback:
+                return False
+
+        if self.slot0 is not None:
+            # Gains are stored in fixed point, so they don't read back exactly
+            for gain in ("kP", "kI", "kD", "kF"):
+                if not math.isclose(
+                    getattr(config.slot0, gain),
+                    getattr(self.slot0, gain),
+                    rel_tol=1e-3,
+                    abs_tol=1e-4,
+                ):
+                    return False
+
+        if self.voltage_comp is not None:
+            if config.voltageCompSaturation != self.voltage_comp:
+                return False
+
+        return True
+
+
+class SparkMaxConfig:
+    """
+    Desired config of a Spark MAX.
+    """
+
+    def __init__(
+        self,
+        motor: CANSparkMax,
+        inverted: bool = False,
+        idle_mode: CANSparkMax.IdleMode = CANSparkMax.IdleMode.kBrake,
+        periodic_frames: Dict[CANSparkMax.PeriodicFrame, int] = None,
+    ):
+        self.motor = motor
+        self.inverted = inverted
+        self.idle_mode = idle_mode
+        self.periodic_frames = periodic_frames or {}
+
+        self.name = f"SparkMax {motor.getDeviceId()}"
+
+    def apply(self) -> bool:
+        ok = self.motor.restoreFactoryDefaults() == REVLibError.kOk
+        ok = self.motor.setIdleMode(self.idle_mode) == REVLibError.kOk and ok
+        self.motor.setInverted(self.inverted)
+
+        for frame, period in self.periodic_frames.items():
+            error = self.motor.setPeriodicFramePeriod(frame, period)
+            ok = error == REVLibError.kOk and ok
+
+        return ok
+
+    def verify(self) -> bool:
+        return (
+            self.motor.getIdleMode() == self.idle_mode
+            and self.motor.getInverted() == self.inverted
+        )
+
+
+class ConfigStatus:
+    """
+    Status of a group of devices being configured in the background.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.failed: List[str] = []
+
+    def ready(self) -> bool:
+        """
+        Whether every device has finished configuring. Devices that failed to
+        configure are reported, but still count as finished, see `ok`.
+        """
+        return self._done.is_set()
+
+    def ok(self) -> bool:
+        """
+        Whether every device has finished configuring, and none of them failed.
+        """
+        return self._done.is_set() and not self.failed
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+
+def _configure_device(config, status: ConfigStatus) -> None:
+    for _ in range(CAN_CONFIG_RETRIES):
+        if config.apply() and config.verify():
+            return
+
+    status.failed.append(config.name)
+    reportWarning(f"{config.name} failed to configure", False)
+
+
+def configure(*configs) -> ConfigStatus:
+    """
+    Configure all the given devices in the background, in parallel.
+    """
+    status = ConfigStatus()
+
+    threads = [
+        threading.Thread(
+            target=_configure_device,
+            args=(config, status),
+            name=f"Configure {config.name}",
+            daemon=True,
+        )
+        for config in configs
+    ]
+
+    def _supervise():
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        status._done.set()
+
+    threading.Thread(target=_supervise, name="MotorConfig", daemon=True).start()
+
+    return status
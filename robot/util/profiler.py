@@ -0,0 +1,154 @@
+import functools
+import time
+from array import array
+from typing import Callable, Dict, List, Tuple
+
+from ntcore import NetworkTableInstance
+
+from robot.constants import *
+
+"""
+Opt-in loop profiler, turned on with the PROFILE_LOOP constant.
+
+Anything wrapped with `timed` (every subsystem's periodic, every command made with
+`robot.util.cmd`, the command scheduler and the robot mode callbacks) is timed with
+a high resolution timer. The most recent durations of each callable are kept in a
+fixed-size ring buffer, and a p50/p99/max summary of each one is published to the
+"Profiler" NetworkTable about once a second.
+
+When a loop takes longer than LOOP_PERIOD it's counted as an overrun, and blamed on
+whichever callable spent the most time in that loop, not counting time spent in
+other timed callables it called.
+
+When PROFILE_LOOP is off, `timed` returns the function unchanged, so this costs
+nothing.
+"""
+
+
+class Timings:
+    """
+    Ring buffer of the most recent call durations of one callable, in seconds.
+    """
+
+    __slots__ = ("_samples", "_index", "_count")
+
+    def __init__(self, size: int = PROFILE_WINDOW):
+        self._samples = array("d", bytes(8 * size))
+        self._index = 0
+        self._count = 0
+
+    def record(self, duration: float):
+        self._samples[self._index] = duration
+        self._index = (self._index + 1) % len(self._samples)
+        self._count = min(self._count + 1, len(self._samples))
+
+    def summary(self) -> Tuple[float, float, float]:
+        """
+        Get the (p50, p99, max) of the recorded durations, in milliseconds.
+        """
+        if self._count == 0:
+            return (0.0, 0.0, 0.0)
+
+        samples = sorted(self._samples[: self._count])
+        last = self._count - 1
+
+        return (
+            samples[last // 2] * 1000,
+            samples[(last * 99) // 100] * 1000,
+            samples[last] * 1000,
+        )
+
+
+timings: Dict[str, Timings] = {}
+overruns = 0
+last_overrun = ""
+
+_loop_start: float = None
+_loops = 0
+_stack: List[float] = []
+_worst: Tuple[str, float] = ("", 0.0)
+
+
+def timed(func: Callable, name: str = None) -> Callable:
+    """
+    Wrap a function so every call to it is timed. Can also be used as a decorator.
+    """
+    if not PROFILE_LOOP:
+        return func
+
+    name = name or func.__qualname__
+    func_timings = timings.setdefault(name, Timings())
+
+    @functools.wraps(func)
+    def _timed(*args, **kwargs):
+        global _loop_start, _worst
+
+        start = time.perf_counter()
+        if _loop_start is None:
+            _loop_start = start
+
+        # Keeps track of how much time was spent in other timed functions
+        _stack.append(0.0)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            func_timings.record(duration)
+
+            self_time = duration - _stack.pop()
+            if _stack:
+                _stack[-1] += duration
+
+            if self_time > _worst[1]:
+                _worst = (name, self_time)
+
+    return _timed
+
+
+def instrument(subsystem) -> None:
+    """
+    Time a subsystem's periodic method.
+    """
+    subsystem.periodic = timed(
+        subsystem.periodic, f"{type(subsystem).__name__}.periodic"
+    )
+
+
+def end_loop() -> None:
+    """
+    Mark the end of a robot loop. Should be called at the end of robotPeriodic.
+    """
+    global _loop_start, _loops, _worst, overruns, last_overrun
+
+    if not PROFILE_LOOP or _loop_start is None:
+        return
+
+    duration = time.perf_counter() - _loop_start
+    timings.setdefault("Loop", Timings()).record(duration)
+
+    if duration > LOOP_PERIOD:
+        overruns += 1
+        last_overrun = (
+            f"{duration * 1000:.2f}ms, worst: {_worst[0]} ({_worst[1] * 1000:.2f}ms)"
+        )
+
+    _loop_start = None
+    _worst = ("", 0.0)
+    _loops += 1
+
+    if _loops % PROFILE_PUBLISH_PERIOD == 0:
+        publish()
+
+
+def publish() -> None:
+    """
+    Publish the timing summaries to NetworkTables.
+    """
+    table = NetworkTableInstance.getDefault().getTable("Profiler")
+
+    for name, func_timings in timings.items():
+        table.putNumberArray(name, func_timings.summary())
+
+    table.putNumber("Overruns", overruns)
+    table.putString("LastOverrun", last_overrun)
@@ -0,0 +1,102 @@
+from typing import Any, Callable, List
+
+from ntcore import NetworkTableInstance
+from wpilib import Timer
+
+"""
+Central, change-only telemetry publisher.
+
+Instead of writing dashboard values every loop, subsystems register a signal for
+each output once, and `set` it every loop. Nothing is written until `flush` is called
+at the end of the loop, and then a signal is only published if it has changed by
+more than its deadband, and if its period has passed since it was last published.
+
+Signals can be numbers, bools, or tuples of numbers (like a pose), where a change in
+any one element counts.
+
+## Example:
+```
+self._speed = telemetry.number("Speed", deadband=0.01, period=0.1)
+self._angle = telemetry.register(self._mech_arm.setAngle, deadband=0.5)
+
+def periodic(self):
+    self._speed.set(self.get_speed())
+    self._angle.set(self.get_angle())
+```
+"""
+
+
+class Signal:
+    """
+    A single telemetry output. `setter` is called with the value when it's published.
+    """
+
+    __slots__ = ("_setter", "_deadband", "_period", "_value", "_published", "_next")
+
+    def __init__(self, setter: Callable[[Any], None], deadband: float, period: float):
+        self._setter = setter
+        self._deadband = deadband
+        self._period = period
+
+        self._value = None
+        self._published = None
+        self._next = 0.0
+
+    def set(self, value) -> None:
+        self._value = value
+
+    def _changed(self) -> bool:
+        if self._published is None:
+            return True
+
+        if isinstance(self._value, tuple):
+            return any(
+                abs(new - old) > self._deadband
+                for new, old in zip(self._value, self._published)
+            )
+
+        return abs(self._value - self._published) > self._deadband
+
+    def _flush(self, now: float) -> None:
+        if self._value is None or now < self._next or not self._changed():
+            return
+
+        self._setter(self._value)
+        self._published = self._value
+        self._next = now + self._period
+
+
+_signals: List[Signal] = []
+
+
+def register(
+    setter: Callable[[Any], None], deadband: float = 0.0, period: float = 0.0
+) -> Signal:
+    """
+    Register a signal that publishes by calling `setter` with its value.
+    """
+    signal = Signal(setter, deadband, period)
+    _signals.append(signal)
+
+    return signal
+
+
+def number(
+    key: str, deadband: float = 0.0, period: float = 0.0, table: str = "SmartDashboard"
+) -> Signal:
+    """
+    Register a number signal that's published to a NetworkTables topic.
+    """
+    topic = NetworkTableInstance.getDefault().getTable(table).getDoubleTopic(key)
+
+    return register(topic.publish().set, deadband, period)
+
+
+def flush() -> None:
+    """
+    Publish every signal that needs to be. Should be called at the end of the loop.
+    """
+    now = Timer.getFPGATimestamp()
+
+    for signal in _signals:
+        signal._flush(now)
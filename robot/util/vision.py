@@ -0,0 +1,87 @@
+from collections import deque
+from typing import List
+
+from ntcore import Event, EventFlags, NetworkTable, NetworkTableInstance
+
+from robot.constants import *
+from robot.util.localization import VisionFrame
+
+"""
+Event driven limelight ingestion.
+
+Instead of polling the limelight's botpose every loop (and adding the same frame
+over and over until a new one arrives), a NetworkTables listener gets every new
+value as it's published. Each one is turned into a VisionFrame stamped with when
+it was captured, duplicates and out of order frames are dropped, and the rest wait
+in a small bounded queue until the drivetrain drains them in periodic.
+
+The listener runs on the NetworkTables listener thread. The queue is a deque, which
+is safe to append to from one thread and pop from another.
+"""
+
+
+class VisionQueue:
+    """
+    Queue of new botpose frames from a limelight's NetworkTable.
+    """
+
+    def __init__(
+        self,
+        table: NetworkTable,
+        key: str = "botpose",
+        capacity: int = VISION_QUEUE_SIZE,
+    ):
+        self._frames = deque(maxlen=capacity)
+        self._last_time = 0.0
+
+        # Frames that were pushed out of a full queue before being drained
+        self.dropped = 0
+
+        self._sub = table.getDoubleArrayTopic(key).subscribe([])
+        self._listener = NetworkTableInstance.getDefault().addListener(
+            self._sub, EventFlags.kValueAll, self._on_value
+        )
+
+    def _on_value(self, event: Event):
+        value = event.data.value
+        entry = value.getDoubleArray()
+
+        # No target, or not a full botpose
+        if len(entry) < 7 or entry[0] == 0:
+            return
+
+        # NT timestamps are in microseconds, on the same clock as the FPGA
+        # timestamp, and the limelight reports its latency in milliseconds
+        time = value.time() / 1e6 - entry[6] / 1000
+
+        if time <= self._last_time:
+            return
+
+        self._last_time = time
+
+        # Newer limelight firmware adds the tag count, span, distance and area
+        if len(entry) >= 10:
+            tags, distance = entry[7], entry[9]
+        else:
+            tags, distance = 1, 0
+
+        if len(self._frames) == self._frames.maxlen:
+            self.dropped += 1
+
+        self._frames.append(
+            VisionFrame(time, entry[0], entry[1], entry[5], tags, distance)
+        )
+
+    def drain(self) -> List[VisionFrame]:
+        """
+        Take every frame that's arrived since the last drain, oldest first.
+        """
+        frames = []
+
+        while self._frames:
+            frames.append(self._frames.popleft())
+
+        return frames
+
+    def close(self):
+        NetworkTableInstance.getDefault().removeListener(self._listener)
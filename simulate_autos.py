@@ -0,0 +1,249 @@
+import argparse
+import math
+import multiprocessing
+import threading
+from typing import Dict, List, Tuple
+
+"""
+Headless batch simulation of every auto route, for both alliances.
+
+Each route runs in its own process, since the HAL and our subsystems only exist once
+per process. In each one, the HAL sim clock is paused and stepped by hand, along with
+`physics.py`'s PhysicsEngine, so the robot code runs as fast as the CPU allows
+instead of at wall-clock speed.
+"""
+
+AUTO_LENGTH = 15
+SIM_PERIOD = 0.02
+
+
+def _list_routes() -> List[str]:
+    import robot.auto.routes
+    from robot.auto.selector import AutoSelector
+
+    return list(AutoSelector._routes)
+
+
+class _Sim:
+    """
+    A robot and its physics, with the HAL sim clock paused and stepped by hand.
+    """
+
+    def __init__(self, mode: str, alliance: str = "blue"):
+        import hal
+        from wpilib.simulation import (
+            DriverStationSim,
+            pauseTiming,
+            waitForProgramStart,
+        )
+
+        from physics import PhysicsEngine
+        from robot import Robot
+
+        pauseTiming()
+
+        self.robot = Robot()
+        self._thread = threading.Thread(target=self.robot.startCompetition, daemon=True)
+        self._thread.start()
+        waitForProgramStart()
+
+        self.engine = PhysicsEngine(None, self.robot)
+        self.now = 0.0
+        self.peak_current = 0.0
+
+        station = (
+            hal.AllianceStationID.kRed1
+            if alliance == "red"
+            else hal.AllianceStationID.kBlue1
+        )
+        DriverStationSim.setAllianceStationId(station)
+        DriverStationSim.setDsAttached(True)
+        DriverStationSim.setAutonomous(mode == "auto")
+        DriverStationSim.setEnabled(True)
+        DriverStationSim.notifyNewData()
+
+    def step(self):
+        from wpilib.simulation import stepTiming
+
+        self.engine.update_sim(self.now, SIM_PERIOD)
+        stepTiming(SIM_PERIOD)
+        self.now += SIM_PERIOD
+
+        self.peak_current = max(self.peak_current, self.engine.get_current_draw())
+
+    def stop(self):
+        from wpilib.simulation import DriverStationSim, stepTiming
+
+        DriverStationSim.setEnabled(False)
+        DriverStationSim.notifyNewData()
+        stepTiming(SIM_PERIOD)
+        self.robot.endCompetition()
+        self._thread.join(1)
+
+
+class _ArmSettle:
+    """
+    Tracks how long the arm takes to settle, from a setpoint change until both
+    joints are in tolerance and stay there.
+    """
+
+    def __init__(self, arm):
+        self.arm = arm
+        self.setpoints = arm.get_setpoints()
+        self.moved_at = 0.0
+        self.settled_at = 0.0
+        self.settle_time = 0.0
+
+    def update(self, now: float):
+        from robot.constants import ARM_TOLERANCE
+
+        arm = self.arm
+
+        if arm.get_setpoints() != self.setpoints:
+            self.setpoints = arm.get_setpoints()
+            self.moved_at = now
+            self.settled_at = None
+
+        in_tolerance = (
+            abs(arm.get_lower_position() - self.setpoints[0]) < ARM_TOLERANCE
+            and abs(arm.get_upper_position() - self.setpoints[1]) < ARM_TOLERANCE
+        )
+
+        if not in_tolerance:
+            self.settled_at = None
+        elif self.settled_at is None:
+            self.settled_at = now
+            self.settle_time = max(self.settle_time, self.settled_at - self.moved_at)
+
+    def get_settle_time(self) -> float:
+        return self.settle_time if self.settled_at is not None else float("inf")
+
+
+def run_route(route: str, alliance: str) -> Dict[str, float]:
+    """
+    Simulate one auto route on one alliance. Returns when it finished (or None),
+    the worst final pose error of its trajectories, the mean distance from the
+    trajectory while driving one, the arm's worst settle time and the peak current.
+    """
+    from robot.auto import AutoSelector
+    from robot.auto.trajectory import DriveTrajectory
+
+    sim = _Sim("auto", alliance)
+    AutoSelector.select(route)
+
+    robot = sim.robot
+    arm = _ArmSettle(robot.arm)
+
+    finished = None
+    drives: List[DriveTrajectory] = []
+    tracking = []
+
+    while sim.now < AUTO_LENGTH:
+        sim.step()
+        arm.update(sim.now)
+
+        drive = robot.drivetrain.get_follower()
+        if drive is not None and drive not in drives:
+            drives.append(drive)
+
+        if drive is not None and drive.running:
+            x, y = drive.get_reference()
+            model = sim.engine.drive_model
+            tracking.append(math.hypot(model.x - x, model.y - y))
+
+        auto_cmd = robot._auto_cmd
+        if auto_cmd is not None and not auto_cmd.isScheduled():
+            finished = sim.now
+            break
+
+    sim.stop()
+
+    errors = [drive.pose_error for drive in drives if drive.pose_error is not None]
+
+    return {
+        "finished": finished,
+        "pose_error": max(errors, default=None),
+        "tracking_error": sum(tracking) / len(tracking) if tracking else 0.0,
+        "settle_time": arm.get_settle_time(),
+        "peak_current": sim.peak_current,
+    }
+
+
+def run_arm_moves(timeout: float = 4) -> Dict[str, float]:
+    """
+    Simulate the arm moving between every preset, in teleop. Returns the worst
+    settle time and the peak current.
+    """
+    from robot.subsystems.arm import ArmPosition
+
+    sim = _Sim("teleop")
+    robot = sim.robot
+    arm = _ArmSettle(robot.arm)
+    settle_time = 0.0
+
+    presets = [value for name, value in vars(ArmPosition).items() if name.isupper()]
+
+    for preset in presets[1:] + presets[:1]:
+        robot.arm.set_position(preset).schedule()
+        start = sim.now
+
+        # Step until it's settled and stayed settled for a bit, or gives up
+        while sim.now - start < timeout:
+            sim.step()
+            arm.update(sim.now)
+
+            if arm.settled_at is not None and sim.now - arm.settled_at > 0.25:
+                break
+
+        settle_time = max(settle_time, arm.get_settle_time())
+
+    sim.stop()
+
+    return {"settle_time": settle_time, "peak_current": sim.peak_current}
+
+
+def simulate_route(job: Tuple[str, str]) -> str:
+    """
+    Simulate one auto route on one alliance, and summarize how it did.
+    """
+    route, alliance = job
+    result = run_route(route, alliance)
+
+    finished = result["finished"]
+    completion = f"{finished:.2f}s" if finished is not None else "did not finish"
+    pose_error = result["pose_error"]
+    pose_error = f"{pose_error:.3f}m" if pose_error is not None else "n/a"
+
+    return (
+        f"{route} ({alliance}): {completion}, final pose error {pose_error}, "
+        f"tracking error {result['tracking_error']:.3f}m, "
+        f"arm settle {result['settle_time']:.2f}s, "
+        f"peak current {result['peak_current']:.0f}A"
+    )
+
+
+def main():
+    """
+    Simulate every auto route for both alliances, in parallel, faster than real time.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("routes", nargs="*", help="routes to run (default: all)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    # Each process can only ever run one robot, so workers are never reused, and they
+    # are spawned so they don't inherit anything from this one
+    context = multiprocessing.get_context("spawn")
+
+    with context.Pool(1) as pool:
+        routes = args.routes or pool.apply(_list_routes)
+
+    jobs = [(route, alliance) for route in routes for alliance in ("blue", "red")]
+
+    with context.Pool(args.jobs, maxtasksperchild=1) as pool:
+        for summary in pool.imap(simulate_route, jobs):
+            print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import random
+from typing import Dict, List, Sequence, Tuple
+
+"""
+Gain tuning by simulation.
+
+Searches the Ramsete, drive PID and arm PID gains with a separable CMA-ES (an
+evolution strategy that adapts a step size and a per-gain spread as it learns which
+directions improve the score). Each candidate is scored by simulating the auto
+routes and the arm moving between its presets, headless and faster than real time,
+with the candidate's gains patched into `robot.constants` before the robot code is
+imported. Every simulation gets its own process, and they run in parallel.
+
+Each candidate is measured on three things that trade off against each other:
+trajectory tracking error, arm settle time and peak current draw. The search
+minimizes a weighted sum of them, relative to the current gains, but every
+evaluated candidate is kept, and the Pareto front (candidates nothing else beats on
+all three) is reported at the end so the tradeoff can be picked by hand.
+
+Evaluated candidates are cached in `tuning/cache.jsonl`, so rerunning the search,
+or extending it, doesn't simulate anything twice.
+"""
+
+OUT_DIR = "tuning"
+CACHE_FILE = os.path.join(OUT_DIR, "cache.jsonl")
+PARETO_FILE = os.path.join(OUT_DIR, "pareto.csv")
+
+# (constant, key in the constant's dict or None, min, max)
+PARAMS = (
+    ("RAMSETE_B", None, 0.5, 5),
+    ("RAMSETE_ZETA", None, 0.3, 1),
+    ("DRIVE_PID", "Kp", 0, 8),
+    ("LOWER_ARM_PID", "Kp", 0, 10),
+    ("LOWER_ARM_PID", "Kd", 0, 1),
+    ("UPPER_ARM_PID", "Kp", 0, 10),
+    ("UPPER_ARM_PID", "Kd", 0, 1),
+)
+PARAM_NAMES = tuple(f"{c}.{k}" if k else c for c, k, _, _ in PARAMS)
+
+OBJECTIVES = ("tracking_error", "settle_time", "peak_current")
+
+# Score of a candidate that couldn't finish a route, or never settled the arm
+FAILED = 1e6
+
+Gains = Tuple[float, ...]
+
+
+def current_gains() -> Gains:
+    import robot.constants as constants
+
+    return tuple(
+        getattr(constants, name)[key] if key else getattr(constants, name)
+        for name, key, _, _ in PARAMS
+    )
+
+
+def apply_gains(gains: Gains) -> None:
+    """
+    Patch gains into robot.constants. Must happen before anything else imports it.
+    """
+    import robot.constants as constants
+
+    for (name, key, _, _), value in zip(PARAMS, gains):
+        if key:
+            getattr(constants, name)[key] = value
+        else:
+            setattr(constants, name, value)
+
+
+def _simulate(job: Tuple[Gains, str, str, str]) -> Tuple[Gains, Dict[str, float]]:
+    gains, kind, route, alliance = job
+    apply_gains(gains)
+
+    import simulate_autos
+
+    if kind == "arm":
+        return gains, simulate_autos.run_arm_moves()
+
+    return gains, simulate_autos.run_route(route, alliance)
+
+
+def _combine(results: List[Dict[str, float]]) -> Dict[str, float]:
+    """
+    Combine one candidate's simulation results into its three objectives.
+    """
+    tracking = [r["tracking_error"] for r in results if "tracking_error" in r]
+    failed = any("finished" in r and r["finished"] is None for r in results)
+
+    return {
+        "tracking_error": FAILED if failed else sum(tracking) / max(len(tracking), 1),
+        "settle_time": min(max(r["settle_time"] for r in results), FAILED),
+        "peak_current": max(r["peak_current"] for r in results),
+    }
+
+
+class Evaluator:
+    """
+    Scores candidates by simulating them in a process pool, with a disk cache.
+    """
+
+    def __init__(self, routes: Sequence[str], alliances: Sequence[str], jobs: int):
+        self.routes = routes
+        self.alliances = alliances
+        self.jobs = jobs
+
+        self.cache: Dict[Gains, Dict[str, float]] = {}
+
+        if os.path.exists(CACHE_FILE):
+            with open(CACHE_FILE) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    same_params = entry["params"] == list(PARAM_NAMES)
+
+                    if same_params and entry["routes"] == list(routes):
+                        self.cache[tuple(entry["gains"])] = entry["objectives"]
+
+    def evaluate(self, candidates: Sequence[Gains]) -> List[Dict[str, float]]:
+        # Round so candidates that are basically the same share a cache entry
+        candidates = [tuple(round(g, 4) for g in gains) for gains in candidates]
+        todo = list(dict.fromkeys(g for g in candidates if g not in self.cache))
+
+        if todo:
+            jobs = [
+                (gains, "route", route, alliance)
+                for gains in todo
+                for route in self.routes
+                for alliance in self.alliances
+            ]
+            jobs += [(gains, "arm", None, None) for gains in todo]
+
+            results: Dict[Gains, List[Dict[str, float]]] = {g: [] for g in todo}
+
+            # Every simulation needs a fresh process, see simulate_autos.py
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(self.jobs, maxtasksperchild=1) as pool:
+                for gains, result in pool.imap_unordered(_simulate, jobs):
+                    results[gains].append(result)
+
+            os.makedirs(OUT_DIR, exist_ok=True)
+
+            with open(CACHE_FILE, "a") as f:
+                for gains in todo:
+                    objectives = _combine(results[gains])
+                    self.cache[gains] = objectives
+
+                    entry = {
+                        "params": PARAM_NAMES,
+                        "routes": list(self.routes),
+                        "gains": gains,
+                        "objectives": objectives,
+                    }
+                    f.write(json.dumps(entry) + "\n")
+
+        return [self.cache[gains] for gains in candidates]
+
+
+def _clip(x: float) -> float:
+    return min(max(x, 0.0), 1.0)
+
+
+class SepCMAES:
+    """
+    Separable CMA-ES (a CMA-ES with a diagonal covariance), minimizing over the unit
+    box. Plain Python, since there are only a handful of gains.
+    """
+
+    def __init__(self, mean: Sequence[float], sigma: float = 0.2, seed: int = None):
+        n = len(mean)
+        self.n = n
+        self.mean = list(mean)
+        self.sigma = sigma
+        self.diag = [1.0] * n
+        self.p_sigma = [0.0] * n
+        self.p_c = [0.0] * n
+        self.generation = 0
+        self.random = random.Random(seed)
+
+        self.popsize = 4 + int(3 * math.log(n))
+        self.mu = self.popsize // 2
+
+        weights = [math.log(self.mu + 0.5) - math.log(i + 1) for i in range(self.mu)]
+        total = sum(weights)
+        self.weights = [w / total for w in weights]
+        self.mu_eff = 1 / sum(w * w for w in self.weights)
+
+        mu_eff = self.mu_eff
+        self.c_sigma = (mu_eff + 2) / (n + mu_eff + 5)
+        self.d_sigma = (
+            1 + 2 * max(0, math.sqrt((mu_eff - 1) / (n + 1)) - 1) + self.c_sigma
+        )
+        self.c_c = 4 / (n + 4)
+
+        # The separable variant can learn faster, since it has fewer parameters
+        c1 = 2 / ((n + 1.3) ** 2 + mu_eff)
+        c_mu = min(1 - c1, 2 * (mu_eff - 2 + 1 / mu_eff) / ((n + 2) ** 2 + mu_eff))
+        self.c1 = min(1, c1 * (n + 2) / 3)
+        self.c_mu = min(1 - self.c1, c_mu * (n + 2) / 3)
+
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+
+    def ask(self) -> List[List[float]]:
+        """
+        Sample a generation of points around the mean, clipped to the box.
+        """
+        gauss = self.random.gauss
+
+        self._points = [
+            [
+                _clip(m + self.sigma * math.sqrt(d) * gauss(0, 1))
+                for m, d in zip(self.mean, self.diag)
+            ]
+            for _ in range(self.popsize)
+        ]
+
+        return self._points
+
+    def tell(self, scores: Sequence[float]) -> None:
+        """
+        Update the distribution from the scores of the last generation.
+        """
+        n = self.n
+        order = sorted(range(self.popsize), key=lambda i: scores[i])
+
+        # Steps to the points that were actually evaluated, so clipping to the box
+        # doesn't throw off the step size
+        best = [
+            [(x - m) / self.sigma for x, m in zip(self._points[i], self.mean)]
+            for i in order[: self.mu]
+        ]
+
+        step = [sum(w * y[j] for w, y in zip(self.weights, best)) for j in range(n)]
+        self.mean = [m + self.sigma * s for m, s in zip(self.mean, step)]
+
+        scale = math.sqrt(self.c_sigma * (2 - self.c_sigma) * self.mu_eff)
+        self.p_sigma = [
+            (1 - self.c_sigma) * p + scale * s / math.sqrt(d)
+            for p, s, d in zip(self.p_sigma, step, self.diag)
+        ]
+        norm = math.sqrt(sum(p * p for p in self.p_sigma))
+
+        self.generation += 1
+        decay = math.sqrt(1 - (1 - self.c_sigma) ** (2 * self.generation))
+        h_sigma = norm / decay < (1.4 + 2 / (n + 1)) * self.chi_n
+
+        scale = math.sqrt(self.c_c * (2 - self.c_c) * self.mu_eff)
+        self.p_c = [
+            (1 - self.c_c) * p + (scale * s if h_sigma else 0)
+            for p, s in zip(self.p_c, step)
+        ]
+
+        correction = 0 if h_sigma else self.c_c * (2 - self.c_c)
+        self.diag = [
+            (1 - self.c1 - self.c_mu) * d
+            + self.c1 * (self.p_c[j] ** 2 + correction * d)
+            + self.c_mu * sum(w * y[j] ** 2 for w, y in zip(self.weights, best))
+            for j, d in enumerate(self.diag)
+        ]
+
+        self.sigma *= math.exp(self.c_sigma / self.d_sigma * (norm / self.chi_n - 1))
+
+
+def _to_gains(x: Sequence[float]) -> Gains:
+    return tuple(lo + v * (hi - lo) for v, (_, _, lo, hi) in zip(x, PARAMS))
+
+
+def _to_unit(gains: Gains) -> List[float]:
+    return [_clip((g - lo) / (hi - lo)) for g, (_, _, lo, hi) in zip(gains, PARAMS)]
+
+
+def pareto_front(points: Dict[Gains, Dict[str, float]]) -> List[Gains]:
+    """
+    Get every candidate that no other candidate beats on every objective.
+    """
+
+    def dominates(a: Dict[str, float], b: Dict[str, float]) -> bool:
+        return all(a[o] <= b[o] for o in OBJECTIVES) and any(
+            a[o] < b[o] for o in OBJECTIVES
+        )
+
+    return [
+        gains
+        for gains, objectives in points.items()
+        if not any(dominates(other, objectives) for other in points.values())
+    ]
+
+
+def _describe(objectives: Dict[str, float]) -> str:
+    return (
+        f"tracking {objectives['tracking_error']:.3f}m, "
+        f"settle {objectives['settle_time']:.2f}s, "
+        f"peak {objectives['peak_current']:.0f}A"
+    )
+
+
+def main():
+    """
+    Tune the Ramsete, drive PID and arm PID gains by simulating auto routes and arm
+    moves, and report the Pareto front of tracking error, settle time and peak
+    current.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("routes", nargs="*", help="routes to score with (default: all)")
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--alliances", nargs="+", default=["blue"], choices=("blue", "red")
+    )
+    parser.add_argument(
+        "--weights",
+        nargs=3,
+        type=float,
+        default=(1, 1, 0.5),
+        metavar=("TRACKING", "SETTLE", "CURRENT"),
+        help="how much each objective counts towards the score the search minimizes",
+    )
+    args = parser.parse_args()
+
+    import simulate_autos
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        routes = args.routes or pool.apply(simulate_autos._list_routes)
+
+    evaluator = Evaluator(routes, args.alliances, args.jobs)
+
+    # Scores are relative to how the current gains do
+    start = current_gains()
+    (baseline,) = evaluator.evaluate([start])
+
+    def score(objectives: Dict[str, float]) -> float:
+        return sum(
+            w * objectives[o] / max(baseline[o], 1e-9)
+            for w, o in zip(args.weights, OBJECTIVES)
+        )
+
+    print(f"current gains: {_describe(baseline)}, score {score(baseline):.3f}")
+
+    es = SepCMAES(_to_unit(start), seed=args.seed)
+
+    for generation in range(args.generations):
+        candidates = [_to_gains(x) for x in es.ask()]
+        results = evaluator.evaluate(candidates)
+        scores = [score(r) for r in results]
+        es.tell(scores)
+
+        best = min(range(len(scores)), key=lambda i: scores[i])
+        print(
+            f"generation {generation + 1}: best score {scores[best]:.3f}, "
+            f"{_describe(results[best])}"
+        )
+
+    points = {g: o for g, o in evaluator.cache.items() if o["tracking_error"] < FAILED}
+    front = sorted(pareto_front(points), key=lambda g: points[g]["tracking_error"])
+
+    print(f"\nPareto front ({len(front)} of {len(points)} candidates):")
+    print("  ".join(f"{name:>18}" for name in PARAM_NAMES + OBJECTIVES))
+
+    for gains in front:
+        values = list(gains) + [points[gains][o] for o in OBJECTIVES]
+        print("  ".join(f"{value:18.4f}" for value in values))
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+
+    with open(PARETO_FILE, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(PARAM_NAMES + OBJECTIVES)
+        for gains in front:
+            writer.writerow(list(gains) + [points[gains][o] for o in OBJECTIVES])
+
+    print(f"\n{PARETO_FILE}: written")
+
+
+if __name__ == "__main__":
+    main()